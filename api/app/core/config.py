@@ -22,15 +22,88 @@ class Settings(BaseSettings):
     
     # Hugging Face モデル設定 (USE_OLLAMA=Falseの場合に使用)
     HF_MODEL_ID: str = "google/gemma-3-12b-it"
+    HF_DRAFT_MODEL_ID: str = ""                     # 投機的デコーディングのドラフトモデル（例: google/gemma-3-1b-it、空なら使わない）
+    HF_DRAFT_NUM_TOKENS: int = 5                    # ドラフトモデルが1回に先読みするトークン数の初期値
+    HF_DRAFT_BASELINE_INTERVAL: int = 20            # 速度比の計測のため、この件数ごとに1件は通常のデコーディングで生成する（0で無効）
     HF_MODEL_CACHE_DIR: str = "./models"
     HF_USE_4BIT_QUANTIZATION: bool = True
     HF_USE_8BIT_QUANTIZATION: bool = False
     HF_USE_FLASH_ATTENTION: bool = True
     HF_TOKEN: Optional[str] = None
+    HF_EMBEDDING_BATCH_SIZE: int = 32               # 埋め込み計算の1回のフォワードに含める最大テキスト数
+    HF_EMBEDDING_POOLING: str = "mean"              # 埋め込みのプーリング方法（mean: 全トークンの平均、last: 最後のトークン）
+    HF_BATCHING_ENABLED: bool = True                # 同時リクエストを連続バッチングでまとめてデコードする
+    HF_MAX_BATCH_SIZE: int = 8                      # 同時にデコードする最大リクエスト数
+    HF_BATCH_MAX_WAIT_MS: int = 10                  # バッチが空のとき後続のリクエストを待つ最大時間（ミリ秒）
+    HF_GENERATION_WORKERS: int = 1                  # 連続バッチング無効時に同時に実行する生成の数
+    HF_GENERATION_QUEUE_SIZE: int = 16              # 実行枠の空きを待てるリクエストの数（超えた分は503）
+    HF_GENERATION_QUEUE_TIMEOUT: float = 30.0       # 実行枠の空きを待つ最大時間（秒）
+    HF_GENERATION_RETRY_AFTER: int = 5              # 503応答のRetry-Afterヘッダーの秒数
+    HF_PREFIX_CACHE_ENABLED: bool = True            # 登録した固定プロンプト（システムプロンプトなど）のKVキャッシュを再利用する
+    HF_PREFIX_CACHE_MAX_MB: int = 1024              # 保持するプレフィックスKVキャッシュの合計サイズの上限（MB、超えたらLRUで破棄）
+    HF_PREFIX_CACHE_MIN_TOKENS: int = 16            # 再利用するプレフィックスの最小トークン数
     
     # Ollama設定 (USE_OLLAMA=Trueの場合に使用)
     OLLAMA_BASE_URL: str = "http://localhost:11434"
+    OLLAMA_BASE_URLS: List[str] = []                # 複数のOllamaインスタンスに振り分ける場合のURL（指定するとOLLAMA_BASE_URLより優先）
+    OLLAMA_HEALTH_CHECK_INTERVAL: float = 10.0      # 複数インスタンス時のヘルスチェック間隔（秒、0で無効）
+    OLLAMA_SESSION_AFFINITY_SLACK: int = 2          # セッションの前回のインスタンスを優先する、処理中リクエスト数の差の上限
+    OLLAMA_SESSION_AFFINITY_SIZE: int = 10000       # インスタンスを記録しておくセッションの最大数
     OLLAMA_MODEL_NAME: str = "gemma3:12b"
+    OLLAMA_REQUEST_TIMEOUT: float = 300.0           # 1リクエストあたりのタイムアウト（秒）
+    OLLAMA_MAX_CONNECTIONS: int = 32                # 共有コネクションプールの最大接続数
+    OLLAMA_MAX_KEEPALIVE_CONNECTIONS: int = 16      # キープアライブで保持する接続数
+    OLLAMA_KEEP_ALIVE: str = "30m"                  # 最後のリクエスト後にモデルをメモリに保持する時間（"-1"で無期限）
+    
+    # ヘッジ（最初のトークンが遅い場合に、同じリクエストを副のバックエンドにも送り、先に応答した方を使う）
+    HEDGE_ENABLED: bool = False
+    HEDGE_DELAY_SECONDS: float = 3.0                # 副のバックエンドにも送るまで最初のトークンを待つ秒数
+    HEDGE_SECONDARY: str = "ollama"                 # 副のバックエンド（ollama: 別のOllamaインスタンス、hf: Hugging Faceモデル）
+    
+    # 起動時にモデルを読み込み、小さな生成を1回実行してから受付を開始する
+    MODEL_WARMUP_ON_STARTUP: bool = True
+    
+    # 会話を構造化メッセージのまま送信する（Ollamaは /api/chat、HFはチャットテンプレートを使用）
+    # Falseの場合は従来どおり会話履歴を1つのプロンプト文字列に展開して送信する
+    USE_CHAT_API: bool = True
+    
+    # トークン数の計算に使うトークナイザー（ローカルにキャッシュがない場合は概算で計算）
+    TOKENIZER_ID: Optional[str] = "google/gemma-3-12b-it"
+    TOKENIZER_ALLOW_DOWNLOAD: bool = False          # キャッシュにない場合にHugging Faceからダウンロードする
+    
+    # 埋め込みキャッシュ（(モデル, 正規化テキスト) のハッシュをキーにメモリとSQLiteに保存）
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_MEMORY_ITEMS: int = 10000       # メモリ上のLRUに保持する最大件数
+    EMBEDDING_CACHE_MAX_DISK_ITEMS: int = 200000    # SQLiteに保持する最大件数（0で永続化しない）
+    
+    # 応答キャッシュ（temperature=0 またはシード指定の生成結果を、モデル・整形済みプロンプト・サンプリング設定のハッシュで保存）
+    RESPONSE_CACHE_ENABLED: bool = True
+    RESPONSE_CACHE_TTL_SECONDS: int = 3600          # 応答を保持する秒数（0で無期限）
+    RESPONSE_CACHE_MAX_MB: int = 64                 # メモリ上のLRUに保持する応答の合計サイズの上限（MB）
+    RESPONSE_CACHE_PERSIST: bool = False            # SQLiteにも保存し、再起動後も再利用する
+    RESPONSE_CACHE_MAX_DISK_ITEMS: int = 50000      # SQLiteに保持する最大件数
+    
+    # 意味的な回答キャッシュ（最後のユーザーメッセージの埋め込みが近い過去の質問があれば、モデルを呼ばずにその回答を返す）
+    # 会話の文脈を持たない単独の質問（Web検索を使った回答を含む）のみが対象
+    SEMANTIC_CACHE_ENABLED: bool = False
+    SEMANTIC_CACHE_THRESHOLD: float = 0.95          # 同じ質問とみなすコサイン類似度の下限
+    SEMANTIC_CACHE_TTL_SECONDS: int = 3600          # 回答を保持する秒数（0で無期限）
+    SEMANTIC_CACHE_MAX_ITEMS: int = 5000            # 保持する質問の最大件数
+    
+    # 意図の判定（ファイル操作・推論・Web検索・GitHub操作の意図を1回のモデル呼び出しでまとめて判定する）
+    # Falseの場合は従来どおり意図ごとの検出器を順に呼ぶ
+    INTENT_ROUTER_ENABLED: bool = True
+    INTENT_ROUTER_MAX_TOKENS: int = 256             # 判定のJSONを生成する最大トークン数
+    INTENT_CLASSIFIER_ENABLED: bool = True          # 学習済みの分類器（data/intent_classifier.npz）があれば、先にそれで判定する
+    INTENT_CLASSIFIER_THRESHOLD: float = 0.9        # 分類器の判定をそのまま使う確信度の下限（未満ならモデルで判定）
+    INTENT_LOG_ENABLED: bool = False                # モデルによる判定を data/intent_decisions.jsonl に記録する（分類器の学習データ）
+    # 意図の判定結果のキャッシュ（正規化したメッセージが同じなら、判定器ごとに前回の結果を返す）
+    INTENT_CACHE_ENABLED: bool = True
+    INTENT_CACHE_MAX_ITEMS: int = 10000             # メモリ上のLRUに保持する最大件数
+    INTENT_CACHE_TTL_SECONDS: int = 3600            # 判定結果を保持する秒数（0で無期限）
+    # 意図の判定と並行して通常のチャットの生成を開始し、ツールを使わない場合はそのまま返す（使う場合は中止する）
+    # バックエンドが同時に処理できるリクエストが1つの場合は、判定と生成が順番待ちになるため効果がない
+    SPECULATIVE_CHAT_ENABLED: bool = False
     
     # 現在の日付 (推論などに使用)
     CURRENT_DATE: str = datetime.now().strftime("%Y年%m月%d日")
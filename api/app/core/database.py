@@ -5,6 +5,8 @@ import logging
 from datetime import datetime
 from typing import List, Dict, Any, Optional
 
+from .tokenizer import count_tokens, MESSAGE_OVERHEAD_TOKENS
+
 logger = logging.getLogger(__name__)
 
 # データベースファイルのパス
@@ -45,10 +47,16 @@ def init_db():
             content TEXT NOT NULL,
             created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
             metadata TEXT,
+            token_count INTEGER,
             FOREIGN KEY (session_id) REFERENCES sessions (session_id) ON DELETE CASCADE
         )
         """)
         
+        # 既存のデータベースにはトークン数の列を追加（既存の行は取得時に計算して保存する）
+        message_columns = [row["name"] for row in conn.execute("PRAGMA table_info(messages)").fetchall()]
+        if "token_count" not in message_columns:
+            conn.execute("ALTER TABLE messages ADD COLUMN token_count INTEGER")
+        
         # トレーニング・事後学習用データテーブル
         conn.execute("""
         CREATE TABLE IF NOT EXISTS training_data (
@@ -89,6 +97,7 @@ def init_db():
         # デフォルト設定の挿入
         default_settings = [
             ("max_context_messages", "20", "会話履歴で保持する最大メッセージ数"),
+            ("max_context_tokens", "6144", "システムメッセージと会話履歴を含むプロンプト全体の最大トークン数"),
             ("memory_enabled", "true", "メモリ機能の有効・無効"),
             ("auto_save_for_training", "true", "質の高い会話を自動的にトレーニングデータとして保存するか"),
             ("quality_threshold", "7", "会話品質の閾値（1-10、高いほど良質）"),
@@ -237,11 +246,11 @@ def add_message(session_id: str, role: str, content: str, metadata: Optional[Dic
             # セッションが存在しない場合は新規作成
             create_session(session_id)
         
-        # メッセージを追加
+        # メッセージを追加（トークン数は挿入時に一度だけ計算して保存する）
         cursor = conn.cursor()
         cursor.execute(
-            "INSERT INTO messages (session_id, role, content, metadata) VALUES (?, ?, ?, ?)",
-            (session_id, role, content, json.dumps(metadata or {}))
+            "INSERT INTO messages (session_id, role, content, metadata, token_count) VALUES (?, ?, ?, ?, ?)",
+            (session_id, role, content, json.dumps(metadata or {}), count_tokens(content))
         )
         
         # セッションの更新日時を更新
@@ -292,6 +301,44 @@ def get_messages(session_id: str, limit: Optional[int] = None) -> List[Dict[str,
     finally:
         conn.close()
 
+def get_recent_messages(session_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """セッション内の新しいメッセージから順に取得（トークン数が未計算の行は計算して保存）"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        
+        if limit:
+            cursor.execute(
+                "SELECT id, role, content, token_count FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (session_id, limit)
+            )
+        else:
+            cursor.execute(
+                "SELECT id, role, content, token_count FROM messages WHERE session_id = ? ORDER BY id DESC",
+                (session_id,)
+            )
+        
+        messages = [dict(row) for row in cursor.fetchall()]
+        
+        # トークン数の列を追加する前に保存されたメッセージ
+        missing = [message for message in messages if message["token_count"] is None]
+        if missing:
+            for message in missing:
+                message["token_count"] = count_tokens(message["content"])
+            cursor.executemany(
+                "UPDATE messages SET token_count = ? WHERE id = ?",
+                [(message["token_count"], message["id"]) for message in missing]
+            )
+            conn.commit()
+        
+        return messages
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"メッセージ取得中にエラーが発生しました: {str(e)}")
+        raise
+    finally:
+        conn.close()
+
 def delete_messages(session_id: str) -> bool:
     """セッションのメッセージをすべて削除"""
     conn = get_db_connection()
@@ -538,15 +585,33 @@ def get_all_memory_settings() -> Dict[str, str]:
         conn.close()
 
 # コンテキスト管理のユーティリティ関数
-def get_conversation_context(session_id: str, max_messages: Optional[int] = None) -> List[Dict[str, str]]:
-    """会話コンテキストを取得"""
+def get_conversation_context(
+    session_id: str,
+    max_messages: Optional[int] = None,
+    max_tokens: Optional[int] = None,
+) -> List[Dict[str, str]]:
+    """
+    会話コンテキストを取得
+    
+    新しいメッセージから順に、保存済みのトークン数の合計が max_tokens に収まるところまでを
+    古い順に並べて返す
+    """
     if max_messages is None:
         # デフォルト値の取得
         max_messages_str = get_memory_setting("max_context_messages")
         max_messages = int(max_messages_str) if max_messages_str else 20
     
-    messages = get_messages(session_id, max_messages)
-    return [{"role": msg["role"], "content": msg["content"]} for msg in messages]
+    context = []
+    total_tokens = 0
+    for msg in get_recent_messages(session_id, max_messages):
+        message_tokens = msg["token_count"] + MESSAGE_OVERHEAD_TOKENS
+        if max_tokens is not None and total_tokens + message_tokens > max_tokens:
+            break
+        total_tokens += message_tokens
+        context.append({"role": msg["role"], "content": msg["content"]})
+    
+    context.reverse()
+    return context
 
 def save_conversation_to_training(session_id: str, quality_score: Optional[int] = None) -> int:
     """会話をトレーニングデータとして保存"""
@@ -0,0 +1,340 @@
+import os
+import re
+import sqlite3
+import hashlib
+import logging
+import threading
+import asyncio
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Callable, Awaitable, Tuple
+
+import numpy as np
+
+from .config import settings
+from .database import DB_DIR
+
+logger = logging.getLogger(__name__)
+
+# 埋め込みキャッシュのデータベースファイルのパス（会話データとは別ファイルに保存）
+EMBEDDING_CACHE_DB_PATH = os.path.join(DB_DIR, "embedding_cache.db")
+
+class EmbeddingCache:
+    """
+    内容アドレス方式の埋め込みキャッシュ
+    
+    (モデル名, 正規化したテキスト) のハッシュをキーとして、プロセス内のLRUと
+    SQLiteの永続ストアの2段でベクトルを保持する
+    """
+    _instance = None
+    
+    def __new__(cls):
+        """シングルトンパターンを使用"""
+        if cls._instance is None:
+            cls._instance = super(EmbeddingCache, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+    
+    def __init__(self):
+        """
+        EmbeddingCacheを初期化する
+        """
+        if self._initialized:
+            return
+        
+        self._initialized = True
+        self.enabled = settings.EMBEDDING_CACHE_ENABLED
+        self.max_memory_items = settings.EMBEDDING_CACHE_MEMORY_ITEMS
+        self.max_disk_items = settings.EMBEDDING_CACHE_MAX_DISK_ITEMS
+        self.db_path = EMBEDDING_CACHE_DB_PATH
+        
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        
+        if self.enabled:
+            self._init_db()
+    
+    def _get_connection(self) -> sqlite3.Connection:
+        """データベース接続を取得"""
+        return sqlite3.connect(self.db_path)
+    
+    def _init_db(self) -> None:
+        """キャッシュテーブルを初期化"""
+        conn = self._get_connection()
+        try:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                last_used_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used ON embedding_cache (last_used_at)")
+            conn.commit()
+        except Exception as e:
+            logger.error(f"埋め込みキャッシュの初期化中にエラーが発生しました: {str(e)}")
+            # 永続ストアが使えなくてもメモリ上のキャッシュは使い続ける
+            self.max_disk_items = 0
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """
+        キャッシュキー用にテキストを正規化する（全角・半角の統一、空白の畳み込み）
+        """
+        text = unicodedata.normalize("NFKC", text)
+        return re.sub(r"\s+", " ", text).strip()
+    
+    @classmethod
+    def make_key(cls, model: str, text: str) -> str:
+        """
+        モデル名と正規化したテキストからキャッシュキーを作成する
+        """
+        payload = f"{model}\x00{cls.normalize_text(text)}".encode("utf-8")
+        return hashlib.sha256(payload).hexdigest()
+    
+    def _lookup(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """
+        メモリ、次にSQLiteの順にベクトルを検索する
+        """
+        found: Dict[str, np.ndarray] = {}
+        missing: List[str] = []
+        
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+                    self.memory_hits += 1
+                else:
+                    missing.append(key)
+        
+        if missing and self.max_disk_items > 0:
+            disk_found = self._lookup_disk(missing)
+            with self._lock:
+                for key, vector in disk_found.items():
+                    found[key] = vector
+                    self._remember(key, vector)
+                self.disk_hits += len(disk_found)
+        
+        with self._lock:
+            self.misses += len(set(keys) - set(found))
+        
+        return found
+    
+    def _lookup_disk(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """
+        SQLiteからベクトルを取得し、最終使用日時を更新する
+        """
+        found: Dict[str, np.ndarray] = {}
+        conn = self._get_connection()
+        try:
+            # SQLiteのパラメータ数上限を超えないよう分割して検索
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embedding_cache WHERE key IN ({placeholders})",
+                    chunk,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype="<f4")
+                
+                if rows:
+                    conn.execute(
+                        f"UPDATE embedding_cache SET last_used_at = ? WHERE key IN ({','.join('?' * len(rows))})",
+                        [datetime.now().isoformat()] + [row[0] for row in rows],
+                    )
+            conn.commit()
+        except Exception as e:
+            logger.warning(f"埋め込みキャッシュの読み込み中にエラーが発生しました: {str(e)}")
+        finally:
+            conn.close()
+        return found
+    
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        """
+        メモリ上のLRUにベクトルを追加する（ロックを保持した状態で呼び出すこと）
+        """
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+    
+    def _store(self, model: str, items: List[Tuple[str, np.ndarray]]) -> None:
+        """
+        計算したベクトルをメモリとSQLiteに保存する
+        """
+        with self._lock:
+            for key, vector in items:
+                self._remember(key, vector)
+        
+        if self.max_disk_items <= 0:
+            return
+        
+        conn = self._get_connection()
+        try:
+            now = datetime.now().isoformat()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (key, model, dim, vector, created_at, last_used_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (key, model, int(vector.shape[0]), np.asarray(vector, dtype="<f4").tobytes(), now, now)
+                    for key, vector in items
+                ],
+            )
+            
+            # 上限を超えた分は最終使用日時の古い順に削除
+            count = conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+            if count > self.max_disk_items:
+                conn.execute(
+                    "DELETE FROM embedding_cache WHERE key IN (SELECT key FROM embedding_cache ORDER BY last_used_at ASC LIMIT ?)",
+                    (count - self.max_disk_items,),
+                )
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.warning(f"埋め込みキャッシュの保存中にエラーが発生しました: {str(e)}")
+        finally:
+            conn.close()
+    
+    def _plan(self, model: str, texts: List[str]) -> Tuple[List[str], Dict[str, np.ndarray], List[str]]:
+        """
+        キャッシュを検索し、計算が必要なテキスト（重複を除く）を求める
+        
+        Returns:
+            (各テキストのキー, キャッシュから見つかったベクトル, 計算が必要なテキスト)
+        """
+        keys = [self.make_key(model, text) for text in texts]
+        found = self._lookup(list(dict.fromkeys(keys)))
+        
+        to_compute: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in to_compute:
+                to_compute[key] = text
+        
+        return keys, found, list(to_compute.values())
+    
+    def _assemble(
+        self,
+        model: str,
+        keys: List[str],
+        found: Dict[str, np.ndarray],
+        computed_texts: List[str],
+        computed: np.ndarray,
+    ) -> Tuple[np.ndarray, List[Tuple[str, np.ndarray]]]:
+        """
+        キャッシュ済みのベクトルと新しく計算したベクトルを入力順に並べる
+        """
+        new_items = [
+            (self.make_key(model, text), np.asarray(vector, dtype=np.float32))
+            for text, vector in zip(computed_texts, computed)
+        ]
+        vectors = dict(found)
+        vectors.update(new_items)
+        return np.stack([vectors[key] for key in keys]).astype(np.float32, copy=False), new_items
+    
+    def get_or_compute(
+        self,
+        model: str,
+        texts: List[str],
+        compute: Callable[[List[str]], np.ndarray],
+    ) -> np.ndarray:
+        """
+        キャッシュにないテキストだけを compute で計算し、入力順のベクトル配列を返す
+        
+        Args:
+            model: キャッシュキーに含めるモデル名
+            texts: 入力テキストのリスト
+            compute: キャッシュにないテキストの埋め込みを計算する関数
+            
+        Returns:
+            (テキスト数, 次元数) のfloat32配列
+        """
+        if not self.enabled or not texts:
+            return compute(texts)
+        
+        keys, found, to_compute = self._plan(model, texts)
+        computed = compute(to_compute) if to_compute else np.zeros((0, 0), dtype=np.float32)
+        vectors, new_items = self._assemble(model, keys, found, to_compute, computed)
+        if new_items:
+            self._store(model, new_items)
+        return vectors
+    
+    async def aget_or_compute(
+        self,
+        model: str,
+        texts: List[str],
+        compute: Callable[[List[str]], Awaitable[np.ndarray]],
+    ) -> np.ndarray:
+        """
+        get_or_compute の非同期版（SQLiteへのアクセスはワーカースレッドで行う）
+        """
+        if not self.enabled or not texts:
+            return await compute(texts)
+        
+        keys, found, to_compute = await asyncio.to_thread(self._plan, model, texts)
+        computed = await compute(to_compute) if to_compute else np.zeros((0, 0), dtype=np.float32)
+        vectors, new_items = self._assemble(model, keys, found, to_compute, computed)
+        if new_items:
+            await asyncio.to_thread(self._store, model, new_items)
+        return vectors
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        キャッシュのヒット・ミスの統計を返す
+        """
+        disk_items = 0
+        if self.enabled and self.max_disk_items > 0:
+            conn = self._get_connection()
+            try:
+                disk_items = conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+            except Exception as e:
+                logger.warning(f"埋め込みキャッシュの件数取得中にエラーが発生しました: {str(e)}")
+            finally:
+                conn.close()
+        
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "memory_items": len(self._memory),
+                "max_memory_items": self.max_memory_items,
+                "disk_items": disk_items,
+                "max_disk_items": self.max_disk_items,
+            }
+    
+    def clear(self) -> None:
+        """
+        メモリとSQLiteのキャッシュをすべて削除する
+        """
+        with self._lock:
+            self._memory.clear()
+        
+        if self.enabled and self.max_disk_items > 0:
+            conn = self._get_connection()
+            try:
+                conn.execute("DELETE FROM embedding_cache")
+                conn.commit()
+            finally:
+                conn.close()
+
+# シングルトンインスタンスを取得する関数
+def get_embedding_cache() -> EmbeddingCache:
+    """
+    EmbeddingCacheのインスタンスを取得する
+    """
+    return EmbeddingCache()
@@ -0,0 +1,187 @@
+import copy
+import time
+import logging
+import threading
+import functools
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Any, Callable, Optional, Tuple
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# キャッシュキーで読み飛ばす文末・文中の句読点（全角・半角）
+# ファイル名やパス、リポジトリ名に使われる . _ - / : などは判定結果のパラメータを変えるため残す
+SENTENCE_PUNCTUATION = "。、！？!?…｡､"
+
+def normalize_message(text: str) -> str:
+    """
+    意図の判定結果のキャッシュキーに使うため、メッセージの表記の揺れをそろえる
+    
+    句読点（SENTENCE_PUNCTUATION）を空白に置き換え、全角・半角（NFKC）、大文字・小文字をそろえ、連続する空白を1つにまとめる
+    """
+    text = text.translate({ord(ch): " " for ch in SENTENCE_PUNCTUATION})
+    text = unicodedata.normalize("NFKC", text).lower()
+    return " ".join(text.split())
+
+class IntentCache:
+    """
+    意図の判定結果のキャッシュ
+    
+    同じ短い指示（「ファイル一覧を表示して」「記憶一覧」など）が繰り返し送られるため、
+    (判定器の名前, 正規化したメッセージ) をキーに判定結果をメモリ上のLRUに保持し、
+    期限内であればモデルを呼ばずに同じ結果を返す。すべての判定器で1つのキャッシュを共有する
+    """
+    _instance = None
+    
+    def __new__(cls):
+        """シングルトンパターンを使用"""
+        if cls._instance is None:
+            cls._instance = super(IntentCache, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+    
+    def __init__(self):
+        """
+        IntentCacheを初期化する
+        """
+        if self._initialized:
+            return
+        
+        self._initialized = True
+        self.enabled = settings.INTENT_CACHE_ENABLED
+        self.max_items = max(1, settings.INTENT_CACHE_MAX_ITEMS)
+        self.ttl = settings.INTENT_CACHE_TTL_SECONDS
+        
+        # キー -> (期限, 判定結果)
+        self._items: "OrderedDict[Tuple[str, str], Tuple[Optional[float], Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        
+        # 統計情報（判定器ごとのヒット・ミス数）
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+        self.evictions = 0
+        self.expirations = 0
+    
+    def get(self, detector: str, message: str) -> Tuple[bool, Any]:
+        """
+        判定結果を取得する
+        
+        Returns:
+            見つかったかどうかと、判定結果のコピーのタプル
+        """
+        key = (detector, normalize_message(message))
+        now = time.time()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[0] is not None and item[0] <= now:
+                del self._items[key]
+                self.expirations += 1
+                item = None
+            if item is None:
+                self.misses[detector] = self.misses.get(detector, 0) + 1
+                return False, None
+            self._items.move_to_end(key)
+            self.hits[detector] = self.hits.get(detector, 0) + 1
+        # 呼び出し元がパラメータの辞書を書き換えても、キャッシュの値が変わらないようにする
+        return True, copy.deepcopy(item[1])
+    
+    def put(self, detector: str, message: str, value: Any) -> None:
+        """
+        判定結果を保存する（正規化すると空になるメッセージは保存しない）
+        """
+        normalized = normalize_message(message)
+        if not normalized:
+            return
+        
+        expires_at = time.time() + self.ttl if self.ttl > 0 else None
+        with self._lock:
+            self._items[(detector, normalized)] = (expires_at, copy.deepcopy(value))
+            self._items.move_to_end((detector, normalized))
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+                self.evictions += 1
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        判定器ごとと全体のヒット率、保持件数を返す
+        """
+        with self._lock:
+            hits = sum(self.hits.values())
+            misses = sum(self.misses.values())
+            detectors = {}
+            for detector in sorted(set(self.hits) | set(self.misses)):
+                detector_hits = self.hits.get(detector, 0)
+                lookups = detector_hits + self.misses.get(detector, 0)
+                detectors[detector] = {
+                    "hits": detector_hits,
+                    "misses": self.misses.get(detector, 0),
+                    "hit_rate": round(detector_hits / lookups, 4) if lookups else 0.0,
+                }
+            return {
+                "enabled": self.enabled,
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+                "detectors": detectors,
+                "items": len(self._items),
+                "max_items": self.max_items,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "ttl_seconds": self.ttl,
+            }
+    
+    def clear(self) -> None:
+        """
+        保持しているすべての判定結果を削除する
+        """
+        with self._lock:
+            self._items.clear()
+
+class FailedDetection(tuple):
+    """
+    モデルの出力を解析できなかったなど、判定に失敗した場合の「意図なし」の結果
+    
+    通常の結果のタプルと同じように展開できるが、detection_succeeded で区別してキャッシュには保存しない
+    """
+
+def detection_succeeded(value: Any) -> bool:
+    """
+    判定に成功した結果かどうかを返す（memoize_intent の cacheable に使う）
+    """
+    return not isinstance(value, FailedDetection)
+
+# シングルトンインスタンスを取得する関数
+def get_intent_cache() -> IntentCache:
+    """
+    IntentCacheのインスタンスを取得する
+    """
+    return IntentCache()
+
+def memoize_intent(detector: str, cacheable: Optional[Callable[[Any], bool]] = None) -> Callable:
+    """
+    意図の判定メソッド（第1引数がユーザーメッセージ）の結果を IntentCache に保存するデコレータ
+    
+    Args:
+        detector: 判定器の名前（キャッシュキーと統計に使う）
+        cacheable: 判定結果を保存するかどうかを返す関数（モデルの出力を解析できなかった場合などを除く）
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(self: Any, user_message: str) -> Any:
+            cache = get_intent_cache()
+            if not cache.enabled:
+                return func(self, user_message)
+            
+            found, value = cache.get(detector, user_message)
+            if found:
+                logger.debug(f"意図の判定結果をキャッシュから返します（{detector}）: '{user_message[:50]}'")
+                return value
+            
+            value = func(self, user_message)
+            if cacheable is None or cacheable(value):
+                cache.put(detector, user_message, value)
+            return value
+        return wrapper
+    return decorator
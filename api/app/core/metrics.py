@@ -0,0 +1,280 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Any, Optional, Iterator, Tuple
+
+# 生成の呼び出し元（chat, intent, reasoning, search, generate など）
+# ルーターや各アシスタントで設定し、バックエンドの計測値にラベルとして付ける
+_call_site: ContextVar[str] = ContextVar("generation_call_site", default="other")
+
+# 秒単位の計測値のバケット境界
+SECONDS_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0]
+# デコード速度（トークン/秒）のバケット境界
+TOKENS_PER_SECOND_BUCKETS = [1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 50.0, 75.0, 100.0, 150.0, 200.0, 300.0, 500.0]
+
+# 計測する値の名前、説明、バケット境界
+GENERATION_METRICS = {
+    "queue_wait_seconds": ("生成が始まるまでの待ち時間（実行枠・バッチ・Ollama側のスケジューラ待ち）", SECONDS_BUCKETS),
+    "ttft_seconds": ("呼び出しから最初のトークンが生成されるまでの時間", SECONDS_BUCKETS),
+    "decode_tokens_per_second": ("最初のトークン以降のデコード速度", TOKENS_PER_SECOND_BUCKETS),
+    "total_seconds": ("呼び出しから生成が終わるまでの時間", SECONDS_BUCKETS),
+}
+
+@contextmanager
+def generation_call_site(name: str) -> Iterator[None]:
+    """
+    この中で行われる生成の呼び出し元を設定する（デコレータとしても使える）
+    
+    ワーカースレッドに渡した処理（run_in_threadpool、asyncio.to_thread）にも引き継がれる
+    """
+    token = _call_site.set(name)
+    try:
+        yield
+    finally:
+        _call_site.reset(token)
+
+def current_call_site() -> str:
+    """
+    現在の生成の呼び出し元を返す
+    """
+    return _call_site.get()
+
+class Histogram:
+    """
+    累積バケット形式のヒストグラム（Prometheus の histogram と同じ形式）
+    """
+    
+    def __init__(self, buckets: List[float]):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+    
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+    
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """
+        各バケットの上限（le）とその値以下の件数を返す
+        """
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + [float("inf")], self.counts):
+            total += count
+            result.append(("+Inf" if bound == float("inf") else f"{bound:g}", total))
+        return result
+    
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        バケット内を線形補間して分位点を推定する
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        total = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if count and total + count >= rank:
+                return round(lower + (bound - lower) * (rank - total) / count, 4)
+            total += count
+            lower = bound
+        # 最大のバケットを超えた値は上限がないため、最大のバケット境界を返す
+        return self.buckets[-1]
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 4),
+            "mean": round(self.sum / self.count, 4) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": dict(self.cumulative()),
+        }
+
+class GenerationMetrics:
+    """
+    生成ごとの待ち時間、最初のトークンまでの時間、デコード速度、合計時間のヒストグラム
+    
+    値は (計測値, 呼び出し元, バックエンド) ごとに集計する
+    """
+    _instance = None
+    
+    def __new__(cls):
+        """シングルトンパターンを使用"""
+        if cls._instance is None:
+            cls._instance = super(GenerationMetrics, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+    
+    def __init__(self):
+        """
+        GenerationMetricsを初期化する
+        """
+        if self._initialized:
+            return
+        
+        self._initialized = True
+        self._histograms: Dict[Tuple[str, str, str], Histogram] = {}
+        self._lock = threading.Lock()
+    
+    def record(self, call_site: str, backend: str, values: Dict[str, Optional[float]]) -> None:
+        """
+        1回の生成の計測値を記録する（Noneの値は記録しない）
+        """
+        with self._lock:
+            for name, value in values.items():
+                if value is None or name not in GENERATION_METRICS:
+                    continue
+                key = (name, call_site, backend)
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(GENERATION_METRICS[name][1])
+                histogram.observe(value)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        計測値ごとに、呼び出し元とバックエンド別のヒストグラムを返す
+        """
+        with self._lock:
+            stats: Dict[str, Any] = {name: [] for name in GENERATION_METRICS}
+            for (name, call_site, backend), histogram in sorted(self._histograms.items()):
+                stats[name].append({"call_site": call_site, "backend": backend, **histogram.snapshot()})
+            return stats
+    
+    def render_prometheus(self) -> str:
+        """
+        Prometheus のテキスト形式でヒストグラムを出力する
+        """
+        lines: List[str] = []
+        with self._lock:
+            for name, (description, _) in GENERATION_METRICS.items():
+                metric = f"generation_{name}"
+                lines.append(f"# HELP {metric} {description}")
+                lines.append(f"# TYPE {metric} histogram")
+                for (key_name, call_site, backend), histogram in sorted(self._histograms.items()):
+                    if key_name != name:
+                        continue
+                    labels = f'call_site="{call_site}",backend="{backend}"'
+                    for bound, count in histogram.cumulative():
+                        lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {count}')
+                    lines.append(f"{metric}_sum{{{labels}}} {histogram.sum:.6f}")
+                    lines.append(f"{metric}_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+
+class GenerationTiming:
+    """
+    1回の生成の計測
+    
+    作成した時点を呼び出しの開始とし、生成の開始（待ちの終わり）と最初のトークンの時刻を記録して、
+    finish で計測値を求めてヒストグラムに記録する。時刻は time.perf_counter() の値
+    """
+    
+    def __init__(self, backend: str):
+        """
+        Args:
+            backend: バックエンドの種類（"ollama" または "hf"）
+        """
+        self.backend = backend
+        self.call_site = current_call_site()
+        self.start = time.perf_counter()
+        self.started_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.values: Optional[Dict[str, Optional[float]]] = None
+    
+    def mark_started(self, at: Optional[float] = None) -> None:
+        """
+        待ちが終わり、生成（プレフィル）が始まった時刻を記録する
+        """
+        if self.started_at is None:
+            self.started_at = at if at is not None else time.perf_counter()
+    
+    def mark_first_token(self, at: Optional[float] = None) -> None:
+        """
+        最初のトークンが生成された時刻を記録する（2回目以降の呼び出しは無視する）
+        """
+        if self.first_token_at is None:
+            self.first_token_at = at if at is not None else time.perf_counter()
+    
+    def finish(self, completion_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """
+        記録した時刻から計測値を求めて記録する
+        
+        Args:
+            completion_tokens: 生成したトークン数（デコード速度の計算に使う）
+        
+        Returns:
+            usage に付ける計測値の辞書
+        """
+        end = time.perf_counter()
+        decode_tokens_per_second = None
+        if completion_tokens and completion_tokens > 1 and self.first_token_at is not None and end > self.first_token_at:
+            decode_tokens_per_second = (completion_tokens - 1) / (end - self.first_token_at)
+        
+        return self._record({
+            "queue_wait_seconds": self.started_at - self.start if self.started_at is not None else 0.0,
+            "ttft_seconds": self.first_token_at - self.start if self.first_token_at is not None else None,
+            "decode_tokens_per_second": decode_tokens_per_second,
+            "total_seconds": end - self.start,
+        })
+    
+    def finish_ollama(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Ollamaの最終レスポンスに含まれる処理時間（ナノ秒）から計測値を求めて記録する
+        
+        Ollamaが報告しない待ち時間は、クライアントから見た時間からモデルの読み込み・プロンプト処理・デコードの時間を
+        差し引いて求める。最初のトークンの時刻を記録していない場合（非ストリーミング）は、待ち時間に読み込みと
+        プロンプト処理の時間を足したものを最初のトークンまでの時間とする
+        """
+        end = time.perf_counter()
+        load = data.get("load_duration", 0) / 1e9
+        prompt_eval = data.get("prompt_eval_duration", 0) / 1e9
+        eval_duration = data.get("eval_duration", 0) / 1e9
+        eval_count = data.get("eval_count", 0)
+        
+        if self.first_token_at is not None:
+            ttft = self.first_token_at - self.start
+            queue_wait = max(0.0, ttft - load - prompt_eval)
+        else:
+            queue_wait = max(0.0, end - self.start - load - prompt_eval - eval_duration)
+            ttft = queue_wait + load + prompt_eval
+        
+        return self._record({
+            "queue_wait_seconds": queue_wait,
+            "ttft_seconds": ttft,
+            "decode_tokens_per_second": eval_count / eval_duration if eval_count and eval_duration > 0 else None,
+            "total_seconds": end - self.start,
+        })
+    
+    def _record(self, values: Dict[str, Optional[float]]) -> Dict[str, Any]:
+        """
+        計測値をヒストグラムに記録し、usage に付ける形式で返す（2回目以降の呼び出しでは記録しない）
+        """
+        if self.values is None:
+            self.values = values
+            get_generation_metrics().record(self.call_site, self.backend, values)
+        return self.to_dict()
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        usage に付ける計測値を返す
+        """
+        timing: Dict[str, Any] = {"call_site": self.call_site, "backend": self.backend}
+        for name, value in (self.values or {}).items():
+            timing[name] = round(value, 4) if value is not None else None
+        return timing
+
+# シングルトンインスタンスを取得する関数
+def get_generation_metrics() -> GenerationMetrics:
+    """
+    GenerationMetricsのインスタンスを取得する
+    """
+    return GenerationMetrics()
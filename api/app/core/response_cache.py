@@ -0,0 +1,404 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import asyncio
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Union, AsyncIterator
+
+from .config import settings
+from .database import DB_DIR
+
+logger = logging.getLogger(__name__)
+
+# 応答キャッシュのデータベースファイルのパス（会話データとは別ファイルに保存）
+RESPONSE_CACHE_DB_PATH = os.path.join(DB_DIR, "response_cache.db")
+
+class CachedResponse:
+    """
+    キャッシュされた1件の応答
+    
+    ストリーミングで生成した応答は、再生時に同じ区切りで送れるようチャンクのまま保持する
+    """
+    def __init__(self, chunks: List[str], usage: Dict[str, Any], expires_at: Optional[float]):
+        self.chunks = chunks
+        self.usage = usage
+        self.expires_at = expires_at
+        self.size = sum(len(chunk.encode("utf-8")) for chunk in chunks)
+    
+    @property
+    def text(self) -> str:
+        return "".join(self.chunks)
+    
+    def expired(self, now: float) -> bool:
+        return self.expires_at is not None and self.expires_at <= now
+
+class ResponseCache:
+    """
+    決定的な生成（temperature=0 またはシード指定）の応答キャッシュ
+    
+    (モデル, 整形済みプロンプト, サンプリング設定) のハッシュをキーとして、
+    合計サイズで上限を設けたプロセス内のLRUと、任意のSQLiteの永続ストアの2段で応答を保持する
+    """
+    _instance = None
+    
+    def __new__(cls):
+        """シングルトンパターンを使用"""
+        if cls._instance is None:
+            cls._instance = super(ResponseCache, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+    
+    def __init__(self):
+        """
+        ResponseCacheを初期化する
+        """
+        if self._initialized:
+            return
+        
+        self._initialized = True
+        self.enabled = settings.RESPONSE_CACHE_ENABLED
+        self.ttl = settings.RESPONSE_CACHE_TTL_SECONDS
+        self.max_bytes = max(0, settings.RESPONSE_CACHE_MAX_MB) * 1024 * 1024
+        self.max_disk_items = settings.RESPONSE_CACHE_MAX_DISK_ITEMS if settings.RESPONSE_CACHE_PERSIST else 0
+        self.db_path = RESPONSE_CACHE_DB_PATH
+        
+        self._memory: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        
+        # 統計情報
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.bytes_saved = 0
+        self.tokens_saved = 0
+        
+        if self.enabled and self.max_disk_items > 0:
+            self._init_db()
+    
+    def _get_connection(self) -> sqlite3.Connection:
+        """データベース接続を取得"""
+        return sqlite3.connect(self.db_path)
+    
+    def _init_db(self) -> None:
+        """キャッシュテーブルを初期化"""
+        conn = self._get_connection()
+        try:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                chunks TEXT NOT NULL,
+                usage TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL,
+                last_used_at REAL NOT NULL
+            )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_last_used ON response_cache (last_used_at)")
+            conn.commit()
+        except Exception as e:
+            logger.error(f"応答キャッシュの初期化中にエラーが発生しました: {str(e)}")
+            # 永続ストアが使えなくてもメモリ上のキャッシュは使い続ける
+            self.max_disk_items = 0
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def model_id() -> str:
+        """
+        キャッシュキーに含める、使用中のモデルの識別子を返す
+        """
+        return settings.OLLAMA_MODEL_NAME if settings.USE_OLLAMA else settings.HF_MODEL_ID
+    
+    @staticmethod
+    def sampling_params(
+        max_tokens: Optional[int],
+        temperature: Optional[float],
+        top_p: Optional[float],
+        top_k: Optional[int],
+        stop: Optional[List[str]] = None,
+        seed: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        キャッシュキーに含めるサンプリング設定を、省略された値をデフォルト値で補って返す
+        （省略した場合と同じ値を明示した場合が同じキーになる）
+        """
+        return {
+            "max_tokens": max_tokens if max_tokens is not None else settings.MAX_NEW_TOKENS,
+            "temperature": temperature if temperature is not None else settings.DEFAULT_TEMPERATURE,
+            "top_p": top_p if top_p is not None else settings.DEFAULT_TOP_P,
+            "top_k": top_k if top_k is not None else settings.DEFAULT_TOP_K,
+            "stop": stop or [],
+            "seed": seed,
+        }
+    
+    def is_cacheable(self, params: Dict[str, Any]) -> bool:
+        """
+        同じ入力から同じ出力が得られる設定（temperature=0 またはシード指定）かどうかを返す
+        """
+        return self.enabled and (params["temperature"] <= 0 or params["seed"] is not None)
+    
+    def make_key(self, kind: str, prompt: Union[str, List[Dict[str, str]]], params: Dict[str, Any]) -> str:
+        """
+        モデル、エンドポイントの種類、整形済みのプロンプト（またはメッセージ）とサンプリング設定からキャッシュキーを作成する
+        """
+        payload = json.dumps(
+            {"model": self.model_id(), "kind": kind, "prompt": prompt, "params": params},
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """
+        メモリ、次にSQLiteの順に応答を検索する
+        
+        Returns:
+            キャッシュされた応答（見つからない場合や期限切れの場合はNone）
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry.expired(now):
+                self._forget(key)
+                self.expirations += 1
+                entry = None
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                self._record_hit(entry)
+                return entry
+        
+        entry = self._get_disk(key, now) if self.max_disk_items > 0 else None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self._remember(key, entry)
+            self.disk_hits += 1
+            self._record_hit(entry)
+        return entry
+    
+    def _record_hit(self, entry: CachedResponse) -> None:
+        """
+        ヒットによって節約できた量を記録する（ロックを保持した状態で呼び出すこと）
+        """
+        self.bytes_saved += entry.size
+        self.tokens_saved += int(entry.usage.get("completion_tokens") or 0)
+    
+    def _get_disk(self, key: str, now: float) -> Optional[CachedResponse]:
+        """
+        SQLiteから応答を取得し、最終使用日時を更新する
+        """
+        conn = self._get_connection()
+        try:
+            row = conn.execute(
+                "SELECT chunks, usage, expires_at FROM response_cache WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            
+            chunks, usage, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                conn.commit()
+                with self._lock:
+                    self.expirations += 1
+                return None
+            
+            conn.execute("UPDATE response_cache SET last_used_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+            return CachedResponse(json.loads(chunks), json.loads(usage), expires_at)
+        except Exception as e:
+            logger.warning(f"応答キャッシュの読み込み中にエラーが発生しました: {str(e)}")
+            return None
+        finally:
+            conn.close()
+    
+    def _remember(self, key: str, entry: CachedResponse) -> None:
+        """
+        メモリ上のLRUに応答を追加し、合計サイズが上限を超えた分を古い順に破棄する（ロックを保持した状態で呼び出すこと）
+        """
+        if entry.size > self.max_bytes:
+            return
+        
+        self._forget(key)
+        self._memory[key] = entry
+        self._bytes += entry.size
+        while self._bytes > self.max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._bytes -= evicted.size
+            self.evictions += 1
+    
+    def _forget(self, key: str) -> None:
+        """
+        メモリ上のLRUから応答を取り除く（ロックを保持した状態で呼び出すこと）
+        """
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+    
+    def put(self, key: str, chunks: List[str], usage: Optional[Dict[str, Any]] = None) -> None:
+        """
+        生成した応答をメモリと（有効な場合は）SQLiteに保存する
+        
+        Args:
+            key: make_key で作成したキャッシュキー
+            chunks: 応答のテキスト（ストリーミングの場合はチャンクのリスト）
+            usage: 生成時のトークン使用量
+        """
+        if not any(chunks):
+            return
+        
+        now = time.time()
+        usage = {k: v for k, v in (usage or {}).items() if k in ("prompt_tokens", "completion_tokens")}
+        entry = CachedResponse(list(chunks), usage, now + self.ttl if self.ttl > 0 else None)
+        with self._lock:
+            self._remember(key, entry)
+            self.stores += 1
+        
+        if self.max_disk_items <= 0:
+            return
+        
+        conn = self._get_connection()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, model, chunks, usage, size, expires_at, last_used_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    self.model_id(),
+                    json.dumps(entry.chunks, ensure_ascii=False),
+                    json.dumps(entry.usage),
+                    entry.size,
+                    entry.expires_at,
+                    now,
+                ),
+            )
+            
+            # 期限切れの応答を削除し、上限を超えた分は最終使用日時の古い順に削除
+            conn.execute("DELETE FROM response_cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+            count = conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+            if count > self.max_disk_items:
+                conn.execute(
+                    "DELETE FROM response_cache WHERE key IN (SELECT key FROM response_cache ORDER BY last_used_at ASC LIMIT ?)",
+                    (count - self.max_disk_items,),
+                )
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.warning(f"応答キャッシュの保存中にエラーが発生しました: {str(e)}")
+        finally:
+            conn.close()
+    
+    async def aget(self, key: str) -> Optional[CachedResponse]:
+        """
+        get の非同期版（SQLiteへのアクセスはワーカースレッドで行う）
+        """
+        if self.max_disk_items > 0:
+            return await asyncio.to_thread(self.get, key)
+        return self.get(key)
+    
+    async def aput(self, key: str, chunks: List[str], usage: Optional[Dict[str, Any]] = None) -> None:
+        """
+        put の非同期版（SQLiteへのアクセスはワーカースレッドで行う）
+        """
+        if self.max_disk_items > 0:
+            await asyncio.to_thread(self.put, key, chunks, usage)
+        else:
+            self.put(key, chunks, usage)
+    
+    @staticmethod
+    async def replay(entry: CachedResponse) -> AsyncIterator[str]:
+        """
+        キャッシュされた応答を、生成時と同じチャンクの区切りで返すストリーム
+        """
+        for chunk in entry.chunks:
+            yield chunk
+    
+    async def record(
+        self,
+        key: str,
+        chunks: AsyncIterator[str],
+        usage: Optional[Dict[str, Any]] = None,
+    ) -> AsyncIterator[str]:
+        """
+        ストリームのチャンクをそのまま返し、最後まで読み出された場合だけ応答を保存する
+        
+        読み出し側が途中で終了した場合（クライアントの切断など）やエラーの場合は保存しない
+        """
+        received: List[str] = []
+        try:
+            async for chunk in chunks:
+                received.append(chunk)
+                yield chunk
+        finally:
+            await chunks.aclose()
+        await self.aput(key, received, usage)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        キャッシュのヒット率と節約できた量の統計を返す
+        """
+        disk_items = 0
+        if self.enabled and self.max_disk_items > 0:
+            conn = self._get_connection()
+            try:
+                disk_items = conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+            except Exception as e:
+                logger.warning(f"応答キャッシュの件数取得中にエラーが発生しました: {str(e)}")
+            finally:
+                conn.close()
+        
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "stores": self.stores,
+                "bytes_saved": self.bytes_saved,
+                "tokens_saved": self.tokens_saved,
+                "memory_items": len(self._memory),
+                "memory_bytes": self._bytes,
+                "max_memory_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "disk_items": disk_items,
+                "max_disk_items": self.max_disk_items,
+                "ttl_seconds": self.ttl,
+            }
+    
+    def clear(self) -> None:
+        """
+        メモリとSQLiteのキャッシュをすべて削除する
+        """
+        with self._lock:
+            self._memory.clear()
+            self._bytes = 0
+        
+        if self.enabled and self.max_disk_items > 0:
+            conn = self._get_connection()
+            try:
+                conn.execute("DELETE FROM response_cache")
+                conn.commit()
+            finally:
+                conn.close()
+
+# シングルトンインスタンスを取得する関数
+def get_response_cache() -> ResponseCache:
+    """
+    ResponseCacheのインスタンスを取得する
+    """
+    return ResponseCache()
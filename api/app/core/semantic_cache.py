@@ -0,0 +1,247 @@
+import time
+import logging
+import threading
+from typing import Dict, List, Any, Optional, AsyncIterator
+
+import numpy as np
+
+from .config import settings
+from .response_cache import CachedResponse
+
+logger = logging.getLogger(__name__)
+
+class SemanticCache:
+    """
+    質問の埋め込みの類似度で引く回答キャッシュ
+    
+    言い換えられた同じ質問に、モデルを呼ばずに過去の回答を返す。
+    正規化した質問ベクトルを事前に確保した (max_items, 次元数) の行列に保持し、
+    行列とクエリの積で全件のコサイン類似度を一度に求め、期限内で最も近い質問が閾値以上ならヒットとする。
+    満杯の場合は期限切れの行、なければ最後に使われたのが最も古い行を置き換える
+    """
+    _instance = None
+    
+    def __new__(cls):
+        """シングルトンパターンを使用"""
+        if cls._instance is None:
+            cls._instance = super(SemanticCache, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+    
+    def __init__(self):
+        """
+        SemanticCacheを初期化する
+        """
+        if self._initialized:
+            return
+        
+        self._initialized = True
+        self.enabled = settings.SEMANTIC_CACHE_ENABLED
+        self.threshold = settings.SEMANTIC_CACHE_THRESHOLD
+        self.ttl = settings.SEMANTIC_CACHE_TTL_SECONDS
+        self.max_items = max(1, settings.SEMANTIC_CACHE_MAX_ITEMS)
+        
+        # 行列は最初の登録時に埋め込みの次元数が分かってから確保する
+        self._vectors: Optional[np.ndarray] = None
+        self._expires_at = np.full(self.max_items, np.inf)
+        self._last_used = np.zeros(self.max_items)
+        self._used = np.zeros(self.max_items, dtype=bool)
+        self._questions: List[Optional[str]] = [None] * self.max_items
+        self._entries: List[Optional[CachedResponse]] = [None] * self.max_items
+        self._lock = threading.Lock()
+        
+        # 統計情報
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.embed_failures = 0
+        self.tokens_saved = 0
+        self.hit_similarity_sum = 0.0
+    
+    async def embed(self, question: str) -> Optional[np.ndarray]:
+        """
+        質問の正規化した埋め込みベクトルを求める（埋め込みキャッシュを経由する）
+        
+        Returns:
+            L2正規化したfloat32のベクトル（無効な場合や計算に失敗した場合はNone）
+        """
+        if not self.enabled or not question.strip():
+            return None
+        
+        from ..models.model_factory import get_model
+        
+        try:
+            vector = np.asarray((await get_model().embed_batch([question]))[0], dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"意味的キャッシュ用の埋め込み計算中にエラーが発生しました: {str(e)}")
+            with self._lock:
+                self.embed_failures += 1
+            return None
+        
+        norm = float(np.linalg.norm(vector))
+        if norm == 0.0:
+            return None
+        return vector / norm
+    
+    def _similarities(self, vector: np.ndarray, now: float) -> Optional[np.ndarray]:
+        """
+        保持しているすべての質問とのコサイン類似度を返す（空の行と期限切れの行は -inf、ロックを保持した状態で呼び出すこと）
+        """
+        if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+            return None
+        
+        expired = self._used & (self._expires_at <= now)
+        if expired.any():
+            self._release(np.flatnonzero(expired))
+            self.expirations += int(expired.sum())
+        
+        similarities = self._vectors @ vector
+        similarities[~self._used] = -np.inf
+        return similarities
+    
+    def _release(self, rows: np.ndarray) -> None:
+        """
+        行を空きにする（ロックを保持した状態で呼び出すこと）
+        """
+        self._used[rows] = False
+        for row in rows:
+            self._questions[row] = None
+            self._entries[row] = None
+    
+    def lookup(self, vector: Optional[np.ndarray]) -> Optional[CachedResponse]:
+        """
+        類似度が閾値以上で最も近い、期限内の質問の回答を返す
+        
+        Args:
+            vector: embed で求めた質問のベクトル
+        
+        Returns:
+            キャッシュされた回答（見つからない場合はNone）
+        """
+        if vector is None:
+            return None
+        
+        now = time.time()
+        with self._lock:
+            similarities = self._similarities(vector, now)
+            best = int(np.argmax(similarities)) if similarities is not None else -1
+            if best < 0 or similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            
+            entry = self._entries[best]
+            self._last_used[best] = now
+            self.hits += 1
+            self.hit_similarity_sum += float(similarities[best])
+            self.tokens_saved += int(entry.usage.get("completion_tokens") or 0)
+            logger.info(f"意味的キャッシュにヒットしました（類似度: {similarities[best]:.4f}、元の質問: '{self._questions[best][:50]}'）")
+            return entry
+    
+    def store(
+        self,
+        vector: Optional[np.ndarray],
+        question: str,
+        chunks: List[str],
+        usage: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """
+        質問と回答を保存する
+        
+        閾値以上に近い質問がすでにある場合はその行を置き換え、言い換えの重複で行を使い切らないようにする
+        
+        Args:
+            vector: embed で求めた質問のベクトル
+            question: 質問のテキスト
+            chunks: 回答のテキスト（ストリーミングの場合はチャンクのリスト）
+            usage: 生成時のトークン使用量
+        """
+        if vector is None or not any(chunks):
+            return
+        
+        now = time.time()
+        usage = {k: v for k, v in (usage or {}).items() if k in ("prompt_tokens", "completion_tokens")}
+        entry = CachedResponse(list(chunks), usage, now + self.ttl if self.ttl > 0 else None)
+        
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+                if self._vectors is not None:
+                    logger.warning(f"埋め込みの次元数が変わったため（{self._vectors.shape[1]} → {vector.shape[0]}）、意味的キャッシュを作り直します")
+                    self._release(np.flatnonzero(self._used))
+                self._vectors = np.zeros((self.max_items, vector.shape[0]), dtype=np.float32)
+            
+            similarities = self._similarities(vector, now)
+            nearest = int(np.argmax(similarities))
+            if similarities[nearest] >= self.threshold:
+                row = nearest
+            elif not self._used.all():
+                row = int(np.argmin(self._used))
+            else:
+                row = int(np.argmin(self._last_used))
+                self.evictions += 1
+            
+            self._vectors[row] = vector
+            self._expires_at[row] = entry.expires_at if entry.expires_at is not None else np.inf
+            self._last_used[row] = now
+            self._used[row] = True
+            self._questions[row] = question
+            self._entries[row] = entry
+            self.stores += 1
+    
+    async def record(
+        self,
+        vector: Optional[np.ndarray],
+        question: str,
+        chunks: AsyncIterator[str],
+        usage: Optional[Dict[str, Any]] = None,
+    ) -> AsyncIterator[str]:
+        """
+        ストリームのチャンクをそのまま返し、最後まで読み出された場合だけ回答を保存する
+        """
+        received: List[str] = []
+        try:
+            async for chunk in chunks:
+                received.append(chunk)
+                yield chunk
+        finally:
+            await chunks.aclose()
+        self.store(vector, question, received, usage)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        キャッシュのヒット率と保持件数の統計を返す
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "average_hit_similarity": round(self.hit_similarity_sum / self.hits, 4) if self.hits else None,
+                "stores": self.stores,
+                "tokens_saved": self.tokens_saved,
+                "items": int(self._used.sum()),
+                "max_items": self.max_items,
+                "dim": self._vectors.shape[1] if self._vectors is not None else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "embed_failures": self.embed_failures,
+                "ttl_seconds": self.ttl,
+            }
+    
+    def clear(self) -> None:
+        """
+        保持しているすべての質問と回答を削除する
+        """
+        with self._lock:
+            self._release(np.flatnonzero(self._used))
+
+# シングルトンインスタンスを取得する関数
+def get_semantic_cache() -> SemanticCache:
+    """
+    SemanticCacheのインスタンスを取得する
+    """
+    return SemanticCache()
@@ -0,0 +1,203 @@
+import re
+import math
+import logging
+import threading
+from typing import Dict, List, Any, Optional
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# 日本語（ひらがな・カタカナ・漢字・半角カナ）の文字
+_CJK_PATTERN = r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff66-\uff9f]"
+
+# 概算用のトークン分割（日本語は1文字、英単語は4文字ごと、数字と記号は1文字ずつ）
+_APPROX_PATTERN = re.compile(rf"({_CJK_PATTERN})|([A-Za-z]+)|(\S)")
+
+# チャットテンプレートで1メッセージごとに追加されるトークン数（<start_of_turn>role\n ... <end_of_turn>\n）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 長すぎるメッセージを切り詰めた箇所に入れる目印
+TRUNCATION_MARKER = "\n…（長すぎるため省略しました）…\n"
+
+class TokenCounter:
+    """
+    プロンプトや応答のトークン数を数えるクラス
+    
+    Gemmaのトークナイザーが利用できればそれを使い、利用できない場合は
+    文字種ごとの概算で数える。モデルへの問い合わせは行わない
+    """
+    _instance = None
+    
+    def __new__(cls):
+        """シングルトンパターンを使用"""
+        if cls._instance is None:
+            cls._instance = super(TokenCounter, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+    
+    def __init__(self):
+        """
+        TokenCounterを初期化する（トークナイザーは初回使用時に読み込む）
+        """
+        if self._initialized:
+            return
+        
+        self._initialized = True
+        self._tokenizer = None
+        self._load_attempted = False
+        self._lock = threading.Lock()
+    
+    def set_tokenizer(self, tokenizer: Any) -> None:
+        """
+        読み込み済みのトークナイザーを使用する（Hugging Faceバックエンドのモデルと共有する）
+        """
+        self._tokenizer = tokenizer
+        self._load_attempted = True
+    
+    def load(self) -> bool:
+        """
+        ローカルにキャッシュされたGemmaのトークナイザーを読み込む
+        
+        Returns:
+            トークナイザーが利用できるかどうか
+        """
+        with self._lock:
+            if self._load_attempted:
+                return self._tokenizer is not None
+            self._load_attempted = True
+            
+            if not settings.TOKENIZER_ID:
+                return False
+            
+            try:
+                from transformers import AutoTokenizer
+            except ImportError:
+                logger.info("transformersがインストールされていないため、トークン数は概算で計算します")
+                return False
+            
+            try:
+                self._tokenizer = AutoTokenizer.from_pretrained(
+                    settings.TOKENIZER_ID,
+                    cache_dir=settings.HF_MODEL_CACHE_DIR,
+                    token=settings.HF_TOKEN or None,
+                    local_files_only=not settings.TOKENIZER_ALLOW_DOWNLOAD,
+                )
+                logger.info(f"トークナイザー {settings.TOKENIZER_ID} を読み込みました")
+            except Exception as e:
+                logger.info(f"トークナイザー {settings.TOKENIZER_ID} を読み込めないため、トークン数は概算で計算します: {str(e)}")
+                self._tokenizer = None
+            
+            return self._tokenizer is not None
+    
+    @staticmethod
+    def approximate(text: str) -> int:
+        """
+        トークナイザーを使わずにトークン数を概算する
+        """
+        count = 0
+        for _, word, _ in _APPROX_PATTERN.findall(text):
+            count += math.ceil(len(word) / 4) if word else 1
+        return count
+    
+    def count(self, text: str) -> int:
+        """
+        テキストのトークン数を数える
+        
+        Args:
+            text: 入力テキスト
+        
+        Returns:
+            トークン数（特殊トークンを含まない）
+        """
+        if not text:
+            return 0
+        
+        if self.load():
+            try:
+                return len(self._tokenizer.encode(text, add_special_tokens=False))
+            except Exception as e:
+                logger.warning(f"トークン化に失敗したため概算で計算します: {str(e)}")
+        
+        return self.approximate(text)
+    
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """
+        テキストを max_tokens 以内に切り詰める
+        
+        貼り付けたファイルなどの長いメッセージでも、冒頭（内容の説明）と末尾（質問）が残るよう、
+        前後を半分ずつ残して間を TRUNCATION_MARKER に置き換える
+        
+        Args:
+            text: 入力テキスト
+            max_tokens: 切り詰めた後の最大トークン数（省略の目印を含む）
+        
+        Returns:
+            切り詰めたテキスト（収まる場合はそのまま）
+        """
+        if self.count(text) <= max_tokens:
+            return text
+        
+        keep = max_tokens - self.count(TRUNCATION_MARKER)
+        if keep <= 0:
+            return ""
+        head_tokens = keep - keep // 2
+        tail_tokens = keep // 2
+        
+        if self.load():
+            try:
+                ids = self._tokenizer.encode(text, add_special_tokens=False)
+                head = self._tokenizer.decode(ids[:head_tokens])
+                tail = self._tokenizer.decode(ids[len(ids) - tail_tokens:]) if tail_tokens else ""
+                return head + TRUNCATION_MARKER + tail
+            except Exception as e:
+                logger.warning(f"トークン化に失敗したため概算で切り詰めます: {str(e)}")
+        
+        # 概算と同じ分割で、前後から予算に収まる位置を探す
+        spans = [
+            (match.start(), match.end(), math.ceil(len(match.group(2)) / 4) if match.group(2) else 1)
+            for match in _APPROX_PATTERN.finditer(text)
+        ]
+        head_end = 0
+        used = 0
+        for start, end, tokens in spans:
+            if used + tokens > head_tokens:
+                break
+            used += tokens
+            head_end = end
+        tail_start = len(text)
+        used = 0
+        for start, end, tokens in reversed(spans):
+            if used + tokens > tail_tokens or start < head_end:
+                break
+            used += tokens
+            tail_start = start
+        return text[:head_end] + TRUNCATION_MARKER + text[tail_start:]
+    
+    def count_messages(self, messages: List[Dict[str, str]]) -> int:
+        """
+        チャットメッセージ全体のトークン数を数える（テンプレートの区切りトークンを含む）
+        """
+        return sum(self.count(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+    
+    def get_info(self) -> Dict[str, Optional[str]]:
+        """
+        使用しているトークン数の計算方法を返す
+        """
+        return {
+            "method": "tokenizer" if self._tokenizer is not None else "approximate",
+            "tokenizer": self._tokenizer.__class__.__name__ if self._tokenizer is not None else None,
+        }
+
+# シングルトンインスタンスを取得する関数
+def get_token_counter() -> TokenCounter:
+    """
+    TokenCounterのインスタンスを取得する
+    """
+    return TokenCounter()
+
+def count_tokens(text: str) -> int:
+    """
+    テキストのトークン数を数える
+    """
+    return get_token_counter().count(text)
@@ -1,5 +1,7 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Request, status
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 import os
 import logging
 from typing import List, Optional, Dict, Any, Tuple, Generator
@@ -7,7 +9,9 @@ from typing import List, Optional, Dict, Any, Tuple, Generator
 from .core.config import settings
 from .core.dependencies import get_token_header
 from .core.check_env import check_api_keys
-from .routers import text_generation, embeddings, health, chat, file_operations, reasoning, web_search, github_operations, memory, user_memory
+from .models.model_factory import warmup_model, close_model
+from .models.generation_pool import ModelBusyError
+from .routers import text_generation, embeddings, health, chat, file_operations, reasoning, web_search, github_operations, memory, user_memory, cache
 
 # ロギングの設定
 logging.basicConfig(
@@ -19,10 +23,22 @@ logger = logging.getLogger(__name__)
 # 環境変数が正しく読み込まれているか確認
 check_api_keys()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    アプリケーションの起動・終了時の処理
+    """
+    # 最初のリクエストがモデルの読み込み時間を負担しないよう、受付開始前にウォームアップする
+    await warmup_model()
+    yield
+    # 共有HTTPクライアントなどの接続を閉じる
+    await close_model()
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
     description="Google Gemma 3 12B モデルのローカル API",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 # CORSミドルウェアの追加
@@ -34,6 +50,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(ModelBusyError)
+async def model_busy_handler(request: Request, exc: ModelBusyError):
+    """
+    生成の実行枠を確保できなかったリクエストに、再試行までの秒数を付けて503を返す
+    """
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 # ルーターの登録
 app.include_router(health.router, prefix="/health", tags=["health"])
 app.include_router(
@@ -90,6 +117,12 @@ app.include_router(
     tags=["user memories"],
     dependencies=[Depends(get_token_header)] if settings.API_AUTH_REQUIRED else [],
 )
+app.include_router(
+    cache.router,
+    prefix="/api/v1/cache",
+    tags=["cache"],
+    dependencies=[Depends(get_token_header)] if settings.API_AUTH_REQUIRED else [],
+)
 
 @app.get("/", tags=["root"])
 async def root():
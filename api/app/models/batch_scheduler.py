@@ -0,0 +1,547 @@
+import logging
+import queue
+import threading
+import time
+import torch
+from typing import Dict, List, Optional, Any, Iterator, Tuple, Callable
+
+from .stop_sequences import StopSequenceFilter
+
+logger = logging.getLogger(__name__)
+
+def to_legacy_cache(past: Any) -> Tuple:
+    """
+    Cacheオブジェクトを (key, value) のタプル形式に変換する
+    """
+    if hasattr(past, "to_legacy_cache"):
+        return past.to_legacy_cache()
+    if hasattr(past, "layers"):
+        return tuple((layer.keys, layer.values) for layer in past.layers)
+    return past
+
+def from_legacy_cache(past: Tuple) -> Any:
+    """
+    タプル形式のKVキャッシュをモデルに渡せるCacheオブジェクトに変換する
+    
+    モデルの設定を渡さないため、スライディングウィンドウ層も含め全層のKVを切り詰めずに保持する
+    """
+    from transformers import DynamicCache
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(past)
+    return DynamicCache(past)
+
+class GenerationRequest:
+    """
+    スケジューラに投入された1件の生成リクエスト
+    
+    生成されたテキストは queue に順次入り、イテレーションで取り出せる。
+    cancel を呼ぶと次のトークンの境界でバッチから外される。
+    停止文字列を指定した場合は、その直前までのテキストを返してバッチから外される
+    """
+    _END = object()
+    
+    def __init__(
+        self,
+        input_ids: List[int],
+        max_new_tokens: int,
+        temperature: float,
+        top_p: float,
+        top_k: int,
+        prefix_past: Optional[Tuple] = None,
+        stop: Optional[List[str]] = None,
+        seed: Optional[int] = None,
+    ):
+        self.input_ids = input_ids
+        self.prefix_past = prefix_past
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.top_k = top_k
+        self.generated: List[int] = []
+        self.emitted_text = ""
+        self.stop_filter = StopSequenceFilter(stop) if stop else None
+        # シードを指定したリクエストは専用の乱数生成器でサンプリングし、同じバッチの他のリクエストの影響を受けない
+        self.generator = torch.Generator().manual_seed(seed) if seed is not None else None
+        self.error: Optional[BaseException] = None
+        self.queue: "queue.Queue" = queue.Queue()
+        self.finished = threading.Event()
+        self.cancelled = False
+        self._callbacks: List[Callable[["GenerationRequest"], None]] = []
+        
+        # 計測用の時刻（time.perf_counter の値）: プレフィルの開始時刻と最初のトークンの時刻
+        self.started_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+    
+    def add_done_callback(self, callback: Callable[["GenerationRequest"], None]) -> None:
+        """
+        生成の終了時（エラーを含む）に呼び出す関数を登録する
+        """
+        self._callbacks.append(callback)
+        if self.finished.is_set():
+            callback(self)
+    
+    def _emit(self, text: str) -> None:
+        if text:
+            self.queue.put(text)
+    
+    def _finish(self, error: Optional[BaseException] = None) -> None:
+        # 停止文字列の先頭部分と一致して保留していたテキストを送る
+        if self.stop_filter is not None:
+            self._emit(self.stop_filter.flush())
+        self.error = error
+        self.finished.set()
+        self.queue.put(self._END)
+        for callback in self._callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                logger.error(f"生成終了時のコールバックでエラーが発生しました: {str(e)}")
+    
+    def __iter__(self) -> Iterator[str]:
+        return self
+    
+    def __next__(self) -> str:
+        if self.finished.is_set() and self.queue.empty():
+            raise StopIteration
+        item = self.queue.get()
+        if item is self._END:
+            if self.error is not None:
+                raise self.error
+            raise StopIteration
+        return item
+    
+    def cancel(self) -> None:
+        """
+        生成を中止する（読み出し側には生成済みのテキストまでが返る）
+        """
+        self.cancelled = True
+    
+    def result(self) -> str:
+        """
+        生成の完了を待ち、生成されたテキスト全体を返す
+        """
+        return "".join(self)
+
+class ContinuousBatchScheduler:
+    """
+    複数の生成リクエストをまとめてデコードする連続バッチングスケジューラ
+    
+    1つのワーカースレッドが左パディングしたバッチを1トークンずつデコードする。
+    新しいリクエストはトークンの境界でプレフィルしてKVキャッシュごとバッチに合流させ、
+    生成を終えたリクエストはその場でバッチから外す
+    """
+    
+    def __init__(self, model: Any, tokenizer: Any, max_batch_size: int, max_wait_ms: int):
+        """
+        Args:
+            model: Hugging Face の CausalLM モデル
+            tokenizer: モデルのトークナイザー
+            max_batch_size: 同時にデコードする最大リクエスト数
+            max_wait_ms: バッチが空のとき、後続のリクエストを待つ最大時間（ミリ秒）
+        """
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0, max_wait_ms) / 1000.0
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        self.eos_token_ids = self._get_eos_token_ids()
+        
+        self._pending: "queue.Queue[GenerationRequest]" = queue.Queue()
+        self._rows: List[GenerationRequest] = []
+        self._past: Optional[Tuple[Tuple[torch.Tensor, torch.Tensor], ...]] = None
+        self._attention_mask: Optional[torch.Tensor] = None
+        self._next_tokens: Optional[torch.Tensor] = None
+        
+        # 統計情報
+        self.steps = 0
+        self.generated_tokens = 0
+        self.batch_size_total = 0
+        self.max_observed_batch = 0
+        self.busy_seconds = 0.0
+        self.cancelled_requests = 0
+        
+        self._thread = threading.Thread(target=self._run, name="gemma-batch-scheduler", daemon=True)
+        self._thread.start()
+    
+    def _get_eos_token_ids(self) -> set:
+        """
+        生成を終了するトークンIDの集合を求める（Gemmaのターン終了トークンを含む）
+        """
+        eos_ids = set()
+        config_eos = getattr(getattr(self.model, "generation_config", None), "eos_token_id", None)
+        if isinstance(config_eos, (list, tuple)):
+            eos_ids.update(config_eos)
+        elif config_eos is not None:
+            eos_ids.add(config_eos)
+        if self.tokenizer.eos_token_id is not None:
+            eos_ids.add(self.tokenizer.eos_token_id)
+        
+        end_of_turn = self.tokenizer.convert_tokens_to_ids("<end_of_turn>")
+        if isinstance(end_of_turn, int) and end_of_turn != self.tokenizer.unk_token_id:
+            eos_ids.add(end_of_turn)
+        return eos_ids
+    
+    def submit(
+        self,
+        input_ids: List[int],
+        max_new_tokens: int,
+        temperature: float,
+        top_p: float,
+        top_k: int,
+        prefix_past: Optional[Tuple] = None,
+        stop: Optional[List[str]] = None,
+        seed: Optional[int] = None,
+    ) -> GenerationRequest:
+        """
+        生成リクエストをキューに追加する
+        
+        Args:
+            prefix_past: プロンプト先頭部分の計算済みKVキャッシュ（指定した場合は残りの部分だけをプレフィルする）
+            stop: 生成を止める文字列のリスト（出力には含まれない）
+            seed: 乱数シード（指定した場合、同じ入力からは同じ出力を生成する）
+        
+        Returns:
+            生成結果を受け取るためのGenerationRequest
+        """
+        request = GenerationRequest(input_ids, max_new_tokens, temperature, top_p, top_k, prefix_past, stop, seed)
+        if max_new_tokens <= 0:
+            request._finish()
+        else:
+            self._pending.put(request)
+        return request
+    
+    def _run(self) -> None:
+        """
+        ワーカースレッドのメインループ
+        """
+        while True:
+            new_requests: List[GenerationRequest] = []
+            try:
+                new_requests = self._collect_requests()
+                self._drop_cancelled()
+                start_time = time.time()
+                if new_requests:
+                    self._prefill(new_requests)
+                if self._rows:
+                    self._decode_step()
+                self.busy_seconds += time.time() - start_time
+            except Exception as e:
+                logger.error(f"バッチ生成中にエラーが発生しました: {str(e)}")
+                for request in self._rows + [r for r in new_requests if r not in self._rows]:
+                    if not request.finished.is_set():
+                        request._finish(e)
+                self._reset()
+    
+    def _collect_requests(self) -> List[GenerationRequest]:
+        """
+        バッチに合流させるリクエストを取り出す
+        
+        デコード中のリクエストがある場合は待たずに取り出し、
+        バッチが空の場合は最初の1件を待ってから max_wait の間だけ後続を待つ
+        """
+        capacity = self.max_batch_size - len(self._rows)
+        requests: List[GenerationRequest] = []
+        
+        if not self._rows:
+            requests.append(self._pending.get())
+            deadline = time.time() + self.max_wait
+            while len(requests) < capacity:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    requests.append(self._pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+        
+        while len(requests) < capacity:
+            try:
+                requests.append(self._pending.get_nowait())
+            except queue.Empty:
+                break
+        
+        # バッチに入る前に中止されたリクエストはプレフィルせずに終了する
+        for request in requests:
+            if request.cancelled:
+                self.cancelled_requests += 1
+                request._finish()
+        return [request for request in requests if not request.cancelled]
+    
+    def _drop_cancelled(self) -> None:
+        """
+        中止されたリクエストをトークンの境界でバッチから外す
+        """
+        cancelled_rows = [row for row, request in enumerate(self._rows) if request.cancelled]
+        if cancelled_rows:
+            for row in cancelled_rows:
+                self._rows[row]._finish()
+            self.cancelled_requests += len(cancelled_rows)
+            self._evict(cancelled_rows)
+    
+    def _prefill(self, requests: List[GenerationRequest]) -> None:
+        """
+        新しいリクエストのプロンプトを処理し、最初のトークンをサンプリングしてバッチに合流させる
+        
+        計算済みのプレフィックスKVを持つリクエストは残りの部分だけを1件ずつプレフィルし、
+        それ以外のリクエストはまとめてプレフィルする
+        """
+        started_at = time.perf_counter()
+        for request in requests:
+            request.started_at = started_at
+        
+        plain = [request for request in requests if request.prefix_past is None]
+        groups = [([request], *self._prefill_suffix(request)) for request in requests if request.prefix_past is not None]
+        if plain:
+            groups.insert(0, (plain, *self._prefill_batch(plain)))
+        
+        for group, past, attention_mask, logits in groups:
+            next_tokens = self._sample(logits, group)
+            if self._rows:
+                self._past, self._attention_mask = self._merge(self._past, self._attention_mask, past, attention_mask)
+                self._next_tokens = torch.cat([self._next_tokens, next_tokens])
+            else:
+                self._past, self._attention_mask, self._next_tokens = past, attention_mask, next_tokens
+            self._rows.extend(group)
+            
+            self._accept_tokens(next_tokens, len(self._rows) - len(group))
+    
+    def _prefill_batch(self, requests: List[GenerationRequest]) -> Tuple[Tuple, torch.Tensor, torch.Tensor]:
+        """
+        複数のリクエストのプロンプトを左パディングしたバッチでプレフィルする
+        
+        Returns:
+            KVキャッシュ、アテンションマスク、最後の位置のロジットのタプル
+        """
+        device = self.model.device
+        max_length = max(len(request.input_ids) for request in requests)
+        input_ids = torch.full((len(requests), max_length), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(requests), max_length), dtype=torch.long)
+        for i, request in enumerate(requests):
+            length = len(request.input_ids)
+            input_ids[i, max_length - length:] = torch.tensor(request.input_ids, dtype=torch.long)
+            attention_mask[i, max_length - length:] = 1
+        input_ids = input_ids.to(device)
+        attention_mask = attention_mask.to(device)
+        
+        position_ids = attention_mask.cumsum(-1) - 1
+        position_ids.masked_fill_(attention_mask == 0, 1)
+        
+        with torch.no_grad():
+            outputs = self.model(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                # スライディングウィンドウ層も含め全層のKVを切り詰めずに保持し、バッチ間で長さを揃えられるようにする
+                past_key_values=from_legacy_cache(()),
+                use_cache=True,
+            )
+        
+        return to_legacy_cache(outputs.past_key_values), attention_mask, outputs.logits[:, -1, :]
+    
+    def _prefill_suffix(self, request: GenerationRequest) -> Tuple[Tuple, torch.Tensor, torch.Tensor]:
+        """
+        計算済みのプレフィックスKVに続けて、プロンプトの残りの部分だけをプレフィルする
+        
+        Returns:
+            KVキャッシュ、アテンションマスク、最後の位置のロジットのタプル
+        """
+        device = self.model.device
+        prefix_length = request.prefix_past[0][0].size(2)
+        length = len(request.input_ids)
+        input_ids = torch.tensor([request.input_ids[prefix_length:]], dtype=torch.long, device=device)
+        attention_mask = torch.ones((1, length), dtype=torch.long, device=device)
+        position_ids = torch.arange(prefix_length, length, dtype=torch.long, device=device).unsqueeze(0)
+        
+        with torch.no_grad():
+            outputs = self.model(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=from_legacy_cache(request.prefix_past),
+                use_cache=True,
+            )
+        
+        # バッチに合流した後はプレフィックスの参照を保持しない
+        request.prefix_past = None
+        return to_legacy_cache(outputs.past_key_values), attention_mask, outputs.logits[:, -1, :]
+    
+    def _decode_step(self) -> None:
+        """
+        バッチ内の全リクエストについて1トークンずつデコードする
+        """
+        attention_mask = torch.cat(
+            [self._attention_mask, self._attention_mask.new_ones((self._attention_mask.size(0), 1))],
+            dim=-1,
+        )
+        position_ids = self._attention_mask.sum(dim=-1, keepdim=True)
+        
+        with torch.no_grad():
+            outputs = self.model(
+                input_ids=self._next_tokens.unsqueeze(-1),
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=from_legacy_cache(self._past),
+                use_cache=True,
+            )
+        
+        self._past = to_legacy_cache(outputs.past_key_values)
+        self._attention_mask = attention_mask
+        self._next_tokens = self._sample(outputs.logits[:, -1, :], self._rows)
+        
+        self.steps += 1
+        self.batch_size_total += len(self._rows)
+        self.max_observed_batch = max(self.max_observed_batch, len(self._rows))
+        self._accept_tokens(self._next_tokens, 0)
+    
+    def _accept_tokens(self, tokens: torch.Tensor, offset: int) -> None:
+        """
+        サンプリングしたトークンを各リクエストに追加し、終了したリクエストをバッチから外す
+        
+        Args:
+            tokens: サンプリングしたトークン（offset 行目以降のリクエストに対応）
+            offset: tokens の先頭に対応するバッチ内の行番号
+        """
+        finished_rows = []
+        for i, token in enumerate(tokens.tolist()):
+            row = offset + i
+            request = self._rows[row]
+            if token in self.eos_token_ids:
+                finished_rows.append(row)
+                continue
+            
+            if not request.generated:
+                request.first_token_at = time.perf_counter()
+            request.generated.append(token)
+            self.generated_tokens += 1
+            self._emit_text(request)
+            if request.stop_filter is not None and request.stop_filter.stopped:
+                finished_rows.append(row)
+            elif len(request.generated) >= request.max_new_tokens:
+                finished_rows.append(row)
+        
+        if finished_rows:
+            for row in finished_rows:
+                self._rows[row]._finish()
+            self._evict(finished_rows)
+    
+    def _emit_text(self, request: GenerationRequest) -> None:
+        """
+        デコード済みテキストのうち未送信の部分をリクエストに送る
+        
+        マルチバイト文字の途中で切れている場合は次のトークンまで送信を保留する。
+        停止文字列を指定したリクエストは、フィルタを通して停止文字列以降を送らない
+        """
+        text = self.tokenizer.decode(request.generated, skip_special_tokens=True)
+        if text.endswith("�"):
+            return
+        new_text = text[len(request.emitted_text):]
+        request.emitted_text = text
+        if request.stop_filter is not None:
+            new_text = request.stop_filter.feed(new_text)
+        request._emit(new_text)
+    
+    def _evict(self, rows: List[int]) -> None:
+        """
+        指定した行をバッチから外し、全行で不要になった左側のパディングを切り詰める
+        """
+        removed = set(rows)
+        keep = [i for i in range(len(self._rows)) if i not in removed]
+        self._rows = [self._rows[i] for i in keep]
+        if not self._rows:
+            self._reset()
+            return
+        
+        index = torch.tensor(keep, dtype=torch.long, device=self._attention_mask.device)
+        attention_mask = self._attention_mask.index_select(0, index)
+        start = int((attention_mask.sum(dim=0) > 0).long().argmax())
+        self._attention_mask = attention_mask[:, start:]
+        self._next_tokens = self._next_tokens.index_select(0, index)
+        self._past = tuple(
+            tuple(tensor.index_select(0, index.to(tensor.device))[:, :, start:, :] for tensor in layer)
+            for layer in self._past
+        )
+    
+    def _reset(self) -> None:
+        """
+        バッチの状態を破棄する
+        """
+        self._rows = []
+        self._past = None
+        self._attention_mask = None
+        self._next_tokens = None
+    
+    @staticmethod
+    def _merge(
+        past_a: Tuple,
+        mask_a: torch.Tensor,
+        past_b: Tuple,
+        mask_b: torch.Tensor,
+    ) -> Tuple[Tuple, torch.Tensor]:
+        """
+        2つのバッチのKVキャッシュとアテンションマスクを、短い方を左パディングして結合する
+        """
+        length = max(mask_a.size(1), mask_b.size(1))
+        
+        def pad_mask(mask: torch.Tensor) -> torch.Tensor:
+            return torch.nn.functional.pad(mask, (length - mask.size(1), 0), value=0)
+        
+        def pad_kv(tensor: torch.Tensor, mask_length: int) -> torch.Tensor:
+            # (batch, heads, seq, dim) のseq次元の左側をゼロで埋める
+            return torch.nn.functional.pad(tensor, (0, 0, length - mask_length, 0), value=0)
+        
+        past = tuple(
+            tuple(
+                torch.cat([pad_kv(a, mask_a.size(1)), pad_kv(b, mask_b.size(1)).to(a.device)], dim=0)
+                for a, b in zip(layer_a, layer_b)
+            )
+            for layer_a, layer_b in zip(past_a, past_b)
+        )
+        return past, torch.cat([pad_mask(mask_a), pad_mask(mask_b)], dim=0)
+    
+    @staticmethod
+    def _sample(logits: torch.Tensor, requests: List[GenerationRequest]) -> torch.Tensor:
+        """
+        リクエストごとのサンプリングパラメータで次のトークンを選ぶ
+        """
+        tokens = []
+        for row, request in zip(logits.float(), requests):
+            if request.temperature <= 0:
+                tokens.append(row.argmax())
+                continue
+            
+            row = row / request.temperature
+            if request.top_k and request.top_k > 0:
+                threshold = torch.topk(row, min(request.top_k, row.size(-1))).values[-1]
+                row = row.masked_fill(row < threshold, float("-inf"))
+            if request.top_p is not None and request.top_p < 1.0:
+                sorted_logits, sorted_indices = torch.sort(row, descending=True)
+                cumulative = sorted_logits.softmax(dim=-1).cumsum(dim=-1)
+                remove = cumulative > request.top_p
+                # 閾値を超える最初のトークンは残す
+                remove[1:] = remove[:-1].clone()
+                remove[0] = False
+                row = row.masked_fill(remove.scatter(0, sorted_indices, remove), float("-inf"))
+            if request.generator is not None:
+                # 乱数生成器はCPU上にあるため、確率もCPUに移してからサンプリングする
+                token = torch.multinomial(row.softmax(dim=-1).cpu(), 1, generator=request.generator)[0]
+                tokens.append(token.to(row.device))
+            else:
+                tokens.append(torch.multinomial(row.softmax(dim=-1), 1)[0])
+        return torch.stack(tokens)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        スケジューラの統計情報を返す
+        """
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": int(self.max_wait * 1000),
+            "active": len(self._rows),
+            "queued": self._pending.qsize(),
+            "steps": self.steps,
+            "generated_tokens": self.generated_tokens,
+            "average_batch_size": round(self.batch_size_total / self.steps, 2) if self.steps else 0.0,
+            "max_observed_batch_size": self.max_observed_batch,
+            "cancelled_requests": self.cancelled_requests,
+            "tokens_per_second": round(self.generated_tokens / self.busy_seconds, 2) if self.busy_seconds else 0.0,
+        }
@@ -1,8 +1,12 @@
 import logging
 import uuid
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Optional, Union, AsyncGenerator, Tuple
 
 from .model_factory import get_model
+from .stop_sequences import ROLE_STOP_SEQUENCES, merge_stop_sequences
+from ..core.config import settings
+from ..core.tokenizer import get_token_counter, MESSAGE_OVERHEAD_TOKENS
+from ..core.metrics import generation_call_site
 from ..core.database import (
     get_memory_setting, get_conversation_context, 
     add_message, get_session, create_session
@@ -10,6 +14,12 @@ from ..core.database import (
 
 logger = logging.getLogger(__name__)
 
+# コンテキストが足りない場合でも、最新のメッセージに残す最小のトークン数
+MIN_LATEST_MESSAGE_TOKENS = 256
+
+# デフォルトのシステムメッセージ
+DEFAULT_SYSTEM_MESSAGE = "あなたは役立つAIアシスタントです。以下の会話を元に最新の質問に回答してください。"
+
 class Message:
     """
     チャットメッセージの表現
@@ -59,14 +69,38 @@ class ChatModel:
         # コンテキストに含めるメッセージの最大数
         max_context_messages_str = get_memory_setting("max_context_messages")
         self.max_context_messages = int(max_context_messages_str) if max_context_messages_str else 20
+        
+        # システムメッセージと会話履歴を含むプロンプト全体の最大トークン数
+        max_context_tokens_str = get_memory_setting("max_context_tokens")
+        self.max_context_tokens = int(max_context_tokens_str) if max_context_tokens_str else 6144
+        
+        # すべての会話の先頭に来るデフォルトのシステムメッセージはKVキャッシュを再利用する
+        self.register_prompt_prefix(DEFAULT_SYSTEM_MESSAGE)
 
-    def format_prompt(self, messages: List[Message], session_id: Optional[str] = None) -> str:
+    def register_prompt_prefix(self, system_prefix: str) -> None:
+        """
+        繰り返し使うシステムプロンプトの先頭部分を登録し、バックエンドにそのKVキャッシュを再利用させる
+        """
+        try:
+            self.model.register_prompt_prefix(system_prefix)
+        except Exception as e:
+            logger.warning(f"プレフィックスの登録中にエラーが発生しました: {str(e)}")
+
+    def format_prompt(
+        self,
+        messages: List[Message],
+        session_id: Optional[str] = None,
+        system_suffix: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+    ) -> str:
         """
         メッセージのリストからプロンプト文字列を作成する
 
         Args:
             messages: メッセージのリスト
             session_id: セッションID（メモリ機能使用時）
+            system_suffix: システムメッセージの後、会話の前に追加するテキスト（ユーザー定義記憶など）
+            max_tokens: 生成する最大トークン数（この分をコンテキストの予算から差し引く）
 
         Returns:
             フォーマットされたプロンプト文字列
@@ -75,39 +109,19 @@ class ChatModel:
             return ""
 
         # システムメッセージがある場合は最初に配置、なければデフォルトのシステムメッセージを使用
-        system_message = "あなたは役立つAIアシスタントです。以下の会話を元に最新の質問に回答してください。\n\n"
+        system_message = self._get_system_message(messages) + "\n\n"
+        if system_suffix:
+            system_message += system_suffix
         
         # 会話履歴の構築
         conversation = ""
         
-        # メモリ機能が有効かつセッションIDが指定されている場合は、
-        # データベースから過去の会話履歴を取得して追加
-        if self.memory_enabled and session_id:
-            try:
-                # セッションが存在するか確認し、なければ作成
-                session = get_session(session_id)
-                if not session:
-                    create_session(session_id)
-                
-                # 会話履歴を取得
-                context_messages = get_conversation_context(session_id, self.max_context_messages)
-                
-                # 履歴があれば、それを会話に追加
-                for msg in context_messages:
-                    if msg["role"] == "user":
-                        conversation += f"ユーザー: {msg['content']}\n"
-                    elif msg["role"] == "assistant":
-                        conversation += f"アシスタント: {msg['content']}\n"
-            except Exception as e:
-                logger.warning(f"会話履歴の取得中にエラーが発生しました: {str(e)}")
-                # エラーがあっても、現在のメッセージは処理を続ける
-        
-        # 現在のメッセージを追加（重複を避けるため、メモリから取得した分はスキップ）
-        for message in messages:
-            if message.role == "user":
-                conversation += f"ユーザー: {message.content}\n"
-            elif message.role == "assistant":
-                conversation += f"アシスタント: {message.content}\n"
+        system_message, assembled = self._assemble_conversation(messages, session_id, system_message, max_tokens)
+        for msg in assembled:
+            if msg["role"] == "user":
+                conversation += f"ユーザー: {msg['content']}\n"
+            elif msg["role"] == "assistant":
+                conversation += f"アシスタント: {msg['content']}\n"
         
         # 最後のメッセージがユーザーからのものである場合は、応答を開始する
         if messages[-1].role == "user":
@@ -118,6 +132,140 @@ class ChatModel:
         
         return prompt
 
+    def build_messages(
+        self,
+        messages: List[Message],
+        session_id: Optional[str] = None,
+        system_suffix: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+    ) -> List[Dict[str, str]]:
+        """
+        メッセージのリストから /api/chat 形式の構造化メッセージを作成する
+        
+        会話履歴を毎回同じ形で先頭に並べるため、バックエンドは前回のターンと共通する
+        プレフィックスのKVキャッシュを再利用でき、履歴が長くなっても再計算が発生しない
+
+        Args:
+            messages: メッセージのリスト
+            session_id: セッションID（メモリ機能使用時）
+            system_suffix: システムメッセージの末尾に追加するテキスト（ユーザー定義記憶など）
+            max_tokens: 生成する最大トークン数（この分をコンテキストの予算から差し引く）
+
+        Returns:
+            {"role", "content"} 形式のメッセージのリスト
+        """
+        if not messages:
+            return []
+        
+        system_message = self._get_system_message(messages)
+        if system_suffix:
+            system_message += "\n\n" + system_suffix
+        
+        system_message, assembled = self._assemble_conversation(messages, session_id, system_message, max_tokens)
+        chat_messages = [{"role": "system", "content": system_message}]
+        chat_messages.extend(assembled)
+        
+        return chat_messages
+    
+    def _get_system_message(self, messages: List[Message]) -> str:
+        """
+        メッセージ中のシステムメッセージを返す（なければデフォルトのシステムメッセージ）
+        """
+        system_contents = [message.content for message in messages if message.role == "system"]
+        if system_contents:
+            return "\n\n".join(system_contents)
+        return DEFAULT_SYSTEM_MESSAGE
+    
+    def _assemble_conversation(
+        self,
+        messages: List[Message],
+        session_id: Optional[str],
+        system_message: str,
+        max_tokens: Optional[int] = None,
+    ) -> Tuple[str, List[Dict[str, str]]]:
+        """
+        システムメッセージと生成するトークンと合わせて max_context_tokens に収まるよう、新しいメッセージから順に会話を組み立てる
+        
+        リクエストのメッセージを優先して収め、残りの予算で過去の会話履歴を新しいものから追加する。
+        予算を超える古いメッセージはバックエンドに送る前に切り捨て、最新のメッセージだけで予算を超える場合は
+        その内容を予算に収まるよう切り詰める。
+        最新のメッセージには少なくとも MIN_LATEST_MESSAGE_TOKENS（短い場合はその長さ）を残すため、
+        足りない場合は生成する分の確保を減らし、それでも足りない場合はシステムメッセージを切り詰める
+        
+        Returns:
+            システムメッセージ（切り詰めた場合は切り詰めたもの）と会話のタプル
+        """
+        counter = get_token_counter()
+        current = [message.to_dict() for message in messages if message.role in ("user", "assistant")]
+        
+        # システムメッセージと最新のメッセージの区切りを除いた、入力と生成に使えるトークン数
+        available = self.max_context_tokens - 2 * MESSAGE_OVERHEAD_TOKENS
+        latest_minimum = min(counter.count(current[-1]["content"]), MIN_LATEST_MESSAGE_TOKENS) if current else 0
+        if available < latest_minimum:
+            raise RuntimeError(
+                f"コンテキストの最大トークン数（{self.max_context_tokens}）が小さすぎるため、最新のメッセージを送れません"
+            )
+        
+        # 生成する分を確保する（大きな max_tokens で入力がなくならないよう、確保はコンテキストの半分まで）
+        system_tokens = counter.count(system_message)
+        output_reserve = min(max_tokens if max_tokens is not None else settings.MAX_NEW_TOKENS, self.max_context_tokens // 2)
+        output_reserve = max(min(output_reserve, available - system_tokens - latest_minimum), 0)
+        
+        # 生成する分をなくしても最新のメッセージが入らない場合は、システムメッセージを切り詰める
+        if system_tokens > available - latest_minimum:
+            system_message = counter.truncate(system_message, available - latest_minimum)
+            logger.warning(
+                f"システムメッセージ（{system_tokens}トークン）がトークン予算を超えるため、{counter.count(system_message)}トークンに切り詰めました"
+            )
+            system_tokens = counter.count(system_message)
+        
+        budget = self.max_context_tokens - output_reserve - system_tokens - MESSAGE_OVERHEAD_TOKENS
+        
+        kept: List[Dict[str, str]] = []
+        for msg in reversed(current):
+            message_tokens = counter.count(msg["content"]) + MESSAGE_OVERHEAD_TOKENS
+            if message_tokens > budget:
+                if kept:
+                    break
+                # 最新のメッセージだけで予算を超える場合（長いファイルの貼り付けなど）は、内容を切り詰めて残す
+                content = counter.truncate(msg["content"], max(budget - MESSAGE_OVERHEAD_TOKENS, 0))
+                logger.info(f"最新のメッセージ（{message_tokens}トークン）がトークン予算を超えるため、{counter.count(content)}トークンに切り詰めました")
+                if not content:
+                    raise RuntimeError("トークン予算が足りないため、最新のメッセージを送れません")
+                msg = {**msg, "content": content}
+                message_tokens = counter.count(content) + MESSAGE_OVERHEAD_TOKENS
+            kept.insert(0, msg)
+            budget -= message_tokens
+        
+        if len(kept) < len(current):
+            logger.info(f"トークン予算（{self.max_context_tokens}）を超えるため、古いメッセージを{len(current) - len(kept)}件切り捨てました")
+            return system_message, kept
+        
+        if budget <= 0:
+            return system_message, kept
+        return system_message, self._get_history(session_id, budget) + kept
+    
+    def _get_history(self, session_id: Optional[str], max_tokens: Optional[int] = None) -> List[Dict[str, str]]:
+        """
+        データベースから過去の会話履歴を取得する（保存済みのトークン数で max_tokens に収める）
+        """
+        # メモリ機能が有効かつセッションIDが指定されている場合のみ履歴を使用
+        if not (self.memory_enabled and session_id):
+            return []
+        
+        try:
+            # セッションが存在するか確認し、なければ作成
+            session = get_session(session_id)
+            if not session:
+                create_session(session_id)
+            
+            # 会話履歴を取得
+            return get_conversation_context(session_id, self.max_context_messages, max_tokens)
+        except Exception as e:
+            logger.warning(f"会話履歴の取得中にエラーが発生しました: {str(e)}")
+            # エラーがあっても、現在のメッセージは処理を続ける
+            return []
+
     def generate_response(
         self,
         messages: List[Message],
@@ -127,9 +275,12 @@ class ChatModel:
         top_p: Optional[float] = None,
         top_k: Optional[int] = None,
         stream: bool = False,
+        stop: Optional[List[str]] = None,
     ) -> Union[str, Any]:
         """
         メッセージのリストに基づいて応答を生成する
+        
+        モデルが次のユーザーの発話を書き始めないよう、役割の目印（"ユーザー:" など）で常に生成を止める
 
         Args:
             messages: メッセージのリスト
@@ -139,30 +290,34 @@ class ChatModel:
             top_p: top-p サンプリングのパラメータ
             top_k: top-k サンプリングのパラメータ
             stream: ストリーミング生成を行うかどうか
+            stop: 役割の目印に加えて生成を止める文字列のリスト
 
         Returns:
             生成された応答テキスト
         """
-        prompt = self.format_prompt(messages, session_id)
+        stop = merge_stop_sequences(ROLE_STOP_SEQUENCES, stop)
         
-        response = None
-        if stream:
-            response = self.model.generate_text(
-                prompt=prompt,
+        if settings.USE_CHAT_API and hasattr(self.model, "generate_chat"):
+            response = self.model.generate_chat(
+                messages=self.build_messages(messages, session_id, max_tokens=max_tokens),
                 max_tokens=max_tokens,
                 temperature=temperature,
                 top_p=top_p,
                 top_k=top_k,
-                stream=True,
+                stream=stream,
+                session_id=session_id,
+                stop=stop,
             )
         else:
             response = self.model.generate_text(
-                prompt=prompt,
+                prompt=self.format_prompt(messages, session_id, max_tokens=max_tokens),
                 max_tokens=max_tokens,
                 temperature=temperature,
                 top_p=top_p,
                 top_k=top_k,
-                stream=False,
+                stream=stream,
+                session_id=session_id,
+                stop=stop,
             )
         
         # メモリ機能が有効かつセッションIDが指定され、かつストリーミングモードでない場合は、
@@ -172,6 +327,45 @@ class ChatModel:
             
         return response
     
+    def stream_response(
+        self,
+        messages: List[Message],
+        usage: Optional[Dict[str, Any]] = None,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        top_p: Optional[float] = None,
+        top_k: Optional[int] = None,
+        stop: Optional[List[str]] = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        generate_response と同じ入力から、応答を非同期のストリームで生成する
+        
+        会話履歴は使わず、応答の保存も行わない（保存は呼び出し元で行う）
+
+        Args:
+            messages: メッセージのリスト
+            usage: バックエンドがトークン使用量と計測値を書き込む辞書
+            max_tokens: 生成する最大トークン数
+            temperature: 温度パラメータ
+            top_p: top-p サンプリングのパラメータ
+            top_k: top-k サンプリングのパラメータ
+            stop: 役割の目印に加えて生成を止める文字列のリスト
+
+        Returns:
+            テキストのチャンクを返す非同期ジェネレータ
+        """
+        params = {
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+            "top_k": top_k,
+            "usage": usage,
+            "stop": merge_stop_sequences(ROLE_STOP_SEQUENCES, stop),
+        }
+        if settings.USE_CHAT_API:
+            return self.model.stream_chat(self.build_messages(messages, max_tokens=max_tokens), **params)
+        return self.model.stream(self.format_prompt(messages, max_tokens=max_tokens), **params)
+    
     def _save_conversation_to_memory(self, session_id: str, messages: List[Message], response: str) -> None:
         """会話をメモリに保存する"""
         try:
@@ -194,6 +388,7 @@ class ChatModel:
             logger.error(f"会話の保存中にエラーが発生しました: {str(e)}")
             # エラーがあっても、生成処理自体は続行する
 
+    @generation_call_site("chat")
     def generate_with_new_session(
         self,
         messages: List[Message],
@@ -5,6 +5,8 @@ from typing import List, Dict, Any, Optional, Tuple
 import re
 
 from .chat_model import get_chat_model, Message
+from ..core.metrics import generation_call_site
+from ..core.intent_cache import FailedDetection, detection_succeeded, memoize_intent
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +24,8 @@ class FilesAssistant:
         self.api_base_url = api_base_url
         self.chat_model = get_chat_model()
         
+    @memoize_intent("file_operation", cacheable=detection_succeeded)
+    @generation_call_site("intent")
     def detect_file_operation(self, user_message: str) -> Tuple[bool, str, Dict[str, Any]]:
         """
         ユーザーメッセージからファイル操作の意図を検出する
@@ -68,7 +72,7 @@ class FilesAssistant:
         # JSONを抽出
         json_match = re.search(r'\{.*\}', response, re.DOTALL)
         if not json_match:
-            return False, "", {}
+            return FailedDetection((False, "", {}))
             
         json_str = json_match.group(0)
         
@@ -85,7 +89,7 @@ class FilesAssistant:
             
         except Exception as e:
             logger.error(f"JSONのパース中にエラーが発生しました: {str(e)}")
-            return False, "", {}
+            return FailedDetection((False, "", {}))
     
     def execute_file_operation(self, operation_type: str, parameters: Dict[str, Any]) -> Dict[str, Any]:
         """
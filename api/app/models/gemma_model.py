@@ -1,19 +1,123 @@
 import os
 import logging
+import asyncio
+import time
 import torch
-from typing import Dict, List, Optional, Union, Any, Tuple, Generator
+import numpy as np
+from typing import Dict, List, Optional, Union, Any, Tuple, Generator, AsyncGenerator, Iterator
 from transformers import (
     AutoTokenizer, 
     AutoModelForCausalLM,
     BitsAndBytesConfig,
     TextIteratorStreamer,
+    StoppingCriteria,
+    StoppingCriteriaList,
 )
-from threading import Thread
+from concurrent.futures import Future
+from threading import Event
 
 from ..core.config import settings
+from ..core.embedding_cache import get_embedding_cache
+from ..core.tokenizer import get_token_counter
+from ..core.metrics import GenerationTiming
+from .batch_scheduler import ContinuousBatchScheduler, from_legacy_cache
+from .generation_pool import GenerationWorkerPool
+from .prefix_cache import PrefixKVCache
+from .speculative import SpeculativeDecoder
+from .stop_sequences import StopSequenceFilter, truncate_at_stop
 
 logger = logging.getLogger(__name__)
 
+class CancelCriteria(StoppingCriteria):
+    """
+    イベントがセットされたら次のトークンで生成を止める停止条件
+    """
+    def __init__(self, event: Event):
+        self.event = event
+    
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+class FirstTokenCriteria(StoppingCriteria):
+    """
+    最初のトークンが生成された時刻を記録する停止条件（生成は止めない）
+    """
+    def __init__(self, timing: GenerationTiming):
+        self.timing = timing
+    
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        self.timing.mark_first_token()
+        return torch.zeros((input_ids.shape[0],), dtype=torch.bool, device=input_ids.device)
+
+class StopStringCriteria(StoppingCriteria):
+    """
+    生成したテキストの末尾に停止文字列が現れたら生成を止める停止条件
+    
+    停止文字列がトークンの境界と一致しない場合や、語彙にない文字を含む場合も判定できるよう、
+    末尾のトークンをデコードしたテキストで判定する
+    """
+    def __init__(self, tokenizer: Any, prompt_length: int, stop: List[str]):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.stop = stop
+        # 1トークンは1バイト以上にデコードされるため、最長の停止文字列のバイト数+1トークンを見れば足りる
+        self.window = max(len(s.encode("utf-8")) for s in stop) + 1
+    
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        start = max(self.prompt_length, input_ids.shape[1] - self.window)
+        texts = self.tokenizer.batch_decode(input_ids[:, start:], skip_special_tokens=True)
+        return torch.tensor([any(s in text for s in self.stop) for text in texts], dtype=torch.bool, device=input_ids.device)
+
+class GenerationStream:
+    """
+    ストリーミング生成のテキストを順次返すイテレータ
+    
+    cancel を呼ぶと停止条件によって次のトークンで生成が止まる。
+    停止文字列を指定した場合は、その直前までを返して生成を止める
+    """
+    def __init__(
+        self,
+        streamer: TextIteratorStreamer,
+        future: Future,
+        cancel_event: Event,
+        stop: Optional[List[str]] = None,
+    ):
+        self.streamer = streamer
+        self.future = future
+        self.cancel_event = cancel_event
+        self.stop_filter = StopSequenceFilter(stop) if stop else None
+        self._done = False
+    
+    def __iter__(self) -> "GenerationStream":
+        return self
+    
+    def __next__(self) -> str:
+        while not self._done:
+            try:
+                chunk = next(self.streamer)
+            except StopIteration:
+                error = self.future.exception()
+                if error is not None:
+                    raise error
+                self._done = True
+                text = self.stop_filter.flush() if self.stop_filter is not None else ""
+            else:
+                if self.stop_filter is None:
+                    return chunk
+                text = self.stop_filter.feed(chunk)
+                if self.stop_filter.stopped:
+                    self.cancel()
+                    self._done = True
+            if text:
+                return text
+        raise StopIteration
+    
+    def cancel(self) -> None:
+        """
+        生成を中止する
+        """
+        self.cancel_event.set()
+
 class GemmaModel:
     """
     Gemma 3 12B モデルのラッパークラス
@@ -39,20 +143,27 @@ class GemmaModel:
         self._initialized = True
         self.model = None
         self.tokenizer = None
+        self.warm = False
+        self.warmup_seconds: Optional[float] = None
+        self.scheduler: Optional[ContinuousBatchScheduler] = None
+        self.pool: Optional[GenerationWorkerPool] = None
+        self.prefix_cache: Optional[PrefixKVCache] = None
+        self.speculative: Optional[SpeculativeDecoder] = None
+        self._registered_prefixes: set = set()
         self._load_model()
         
     def _load_model(self):
         """
         モデルとトークナイザーを読み込む
         """
-        logger.info(f"モデル {settings.MODEL_ID} を読み込んでいます...")
+        logger.info(f"モデル {settings.HF_MODEL_ID} を読み込んでいます...")
         
         # HuggingFace の認証トークンを設定
         os.environ["HF_TOKEN"] = settings.HF_TOKEN or ""
         
         # 量子化設定
         quantization_config = None
-        if settings.USE_4BIT_QUANTIZATION:
+        if settings.HF_USE_4BIT_QUANTIZATION:
             logger.info("4bit量子化を使用します")
             quantization_config = BitsAndBytesConfig(
                 load_in_4bit=True,
@@ -60,7 +171,7 @@ class GemmaModel:
                 bnb_4bit_quant_type="nf4",
                 bnb_4bit_use_double_quant=True,
             )
-        elif settings.USE_8BIT_QUANTIZATION:
+        elif settings.HF_USE_8BIT_QUANTIZATION:
             logger.info("8bit量子化を使用します")
             quantization_config = BitsAndBytesConfig(
                 load_in_8bit=True,
@@ -69,25 +180,106 @@ class GemmaModel:
         # モデルの読み込み
         try:
             self.model = AutoModelForCausalLM.from_pretrained(
-                settings.MODEL_ID,
+                settings.HF_MODEL_ID,
                 device_map="auto",
                 torch_dtype=torch.float16,
-                cache_dir=settings.MODEL_CACHE_DIR,
+                cache_dir=settings.HF_MODEL_CACHE_DIR,
                 quantization_config=quantization_config,
                 token=settings.HF_TOKEN or True,
-                attn_implementation="flash_attention_2" if settings.USE_FLASH_ATTENTION else "eager",
+                attn_implementation="flash_attention_2" if settings.HF_USE_FLASH_ATTENTION else "eager",
             )
             
             self.tokenizer = AutoTokenizer.from_pretrained(
-                settings.MODEL_ID,
-                cache_dir=settings.MODEL_CACHE_DIR,
+                settings.HF_MODEL_ID,
+                cache_dir=settings.HF_MODEL_CACHE_DIR,
                 token=settings.HF_TOKEN or True,
             )
             
+            # トークン数の計算にもモデルと同じトークナイザーを使う
+            get_token_counter().set_tokenizer(self.tokenizer)
+            
+            # 左パディングでバッチを組むため、パディングトークンがなければEOSで代用する
+            self.tokenizer.padding_side = "left"
+            if self.tokenizer.pad_token is None:
+                self.tokenizer.pad_token = self.tokenizer.eos_token
+            
+            if settings.HF_DRAFT_MODEL_ID:
+                self._load_draft_model(quantization_config)
+            
+            # 投機的デコーディングは1件ずつの生成でのみ使えるため、連続バッチングとは併用しない
+            if settings.HF_BATCHING_ENABLED and self.speculative is not None:
+                logger.info("投機的デコーディングを使用するため、連続バッチングは無効にします")
+            elif settings.HF_BATCHING_ENABLED:
+                logger.info(f"連続バッチングを使用します（最大バッチサイズ: {settings.HF_MAX_BATCH_SIZE}）")
+                self.scheduler = ContinuousBatchScheduler(
+                    self.model,
+                    self.tokenizer,
+                    max_batch_size=settings.HF_MAX_BATCH_SIZE,
+                    max_wait_ms=settings.HF_BATCH_MAX_WAIT_MS,
+                )
+            
+            # 同時に実行する生成の数を制限する（連続バッチング時はバッチサイズまで）
+            self.pool = GenerationWorkerPool(
+                workers=settings.HF_MAX_BATCH_SIZE if self.scheduler is not None else settings.HF_GENERATION_WORKERS,
+                max_queue=settings.HF_GENERATION_QUEUE_SIZE,
+                queue_timeout=settings.HF_GENERATION_QUEUE_TIMEOUT,
+                retry_after=settings.HF_GENERATION_RETRY_AFTER,
+            )
+            
+            if settings.HF_PREFIX_CACHE_ENABLED:
+                self.prefix_cache = PrefixKVCache(
+                    self.model,
+                    self.tokenizer,
+                    max_bytes=settings.HF_PREFIX_CACHE_MAX_MB * 1024 * 1024,
+                    min_tokens=settings.HF_PREFIX_CACHE_MIN_TOKENS,
+                )
+            
             logger.info("モデルの読み込みが完了しました")
         except Exception as e:
             logger.error(f"モデルの読み込み中にエラーが発生しました: {str(e)}")
             raise
+    
+    def _load_draft_model(self, quantization_config: Optional[BitsAndBytesConfig]) -> None:
+        """
+        投機的デコーディングに使う小さなドラフトモデルを読み込む
+        """
+        logger.info(f"ドラフトモデル {settings.HF_DRAFT_MODEL_ID} を読み込んでいます...")
+        draft_model = AutoModelForCausalLM.from_pretrained(
+            settings.HF_DRAFT_MODEL_ID,
+            device_map="auto",
+            torch_dtype=torch.float16,
+            cache_dir=settings.HF_MODEL_CACHE_DIR,
+            quantization_config=quantization_config,
+            token=settings.HF_TOKEN or True,
+            attn_implementation="flash_attention_2" if settings.HF_USE_FLASH_ATTENTION else "eager",
+        )
+        draft_tokenizer = AutoTokenizer.from_pretrained(
+            settings.HF_DRAFT_MODEL_ID,
+            cache_dir=settings.HF_MODEL_CACHE_DIR,
+            token=settings.HF_TOKEN or True,
+        )
+        self.speculative = SpeculativeDecoder(
+            self.model,
+            draft_model,
+            self.tokenizer,
+            draft_tokenizer,
+            num_assistant_tokens=settings.HF_DRAFT_NUM_TOKENS,
+            baseline_interval=settings.HF_DRAFT_BASELINE_INTERVAL,
+        )
+        logger.info("投機的デコーディングを使用します")
+    
+    def _run_generate(self, seed: Optional[int] = None, **kwargs: Any) -> torch.Tensor:
+        """
+        model.generate を実行する（ドラフトモデルがあれば投機的デコーディングで生成する）
+        
+        seed を指定した場合は生成の直前に乱数を初期化する
+        （乱数生成器はプロセス全体で共有されるため、同時に実行中の他の生成があると再現性は保証されない）
+        """
+        if seed is not None:
+            torch.manual_seed(seed)
+        if self.speculative is not None:
+            return self.speculative.generate(**kwargs)
+        return self.model.generate(**kwargs)
             
     def generate_text(
         self,
@@ -97,7 +289,11 @@ class GemmaModel:
         top_p: float = None,
         top_k: int = None,
         stream: bool = False,
-    ) -> Union[str, Generator[str, None, None]]:
+        usage: Optional[Dict[str, int]] = None,
+        session_id: Optional[str] = None,
+        stop: Optional[List[str]] = None,
+        seed: Optional[int] = None,
+    ) -> Union[str, Iterator[str]]:
         """
         テキストを生成する
         
@@ -108,9 +304,13 @@ class GemmaModel:
             top_p: top-p サンプリングのパラメータ
             top_k: top-k サンプリングのパラメータ
             stream: ストリーミング生成を行うかどうか
+            usage: 指定した場合、実際のトークン数（prompt_tokens, completion_tokens）と計測値（timing）を生成の終了時に書き込む
+            session_id: セッションID（Ollamaバックエンドとの互換性のために受け取るが、使用しない）
+            stop: 生成を止める文字列のリスト（出力には含まれない）
+            seed: 乱数シード（指定した場合、同じ入力からは同じ出力を生成する）
             
         Returns:
-            生成されたテキスト、またはストリーミングの場合はジェネレータ
+            生成されたテキスト、またはストリーミングの場合は cancel で中止できるイテレータ
         """
         if not self.model or not self.tokenizer:
             raise RuntimeError("モデルが初期化されていません")
@@ -122,47 +322,372 @@ class GemmaModel:
         top_k = top_k if top_k is not None else settings.DEFAULT_TOP_K
         
         # 入力をトークン化
-        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
+        timing = GenerationTiming("hf")
+        inputs = self.tokenizer(prompt, return_tensors="pt")
+        prompt_tokens = inputs["input_ids"].shape[1]
+        if usage is not None:
+            usage.update({"prompt_tokens": prompt_tokens, "completion_tokens": 0})
         
-        # ストリーミング生成
-        if stream:
-            streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
-            generation_kwargs = {
-                "input_ids": inputs["input_ids"],
-                "attention_mask": inputs["attention_mask"],
-                "max_new_tokens": max_tokens,
-                "temperature": temperature,
-                "top_p": top_p,
-                "top_k": top_k,
-                "streamer": streamer,
-                "do_sample": temperature > 0,
-            }
-            
-            # 別スレッドで生成を開始
-            thread = Thread(target=self.model.generate, kwargs=generation_kwargs)
-            thread.start()
-            
-            # ストリームからテキストを生成
-            for text in streamer:
-                yield text
-        else:
-            # 通常の生成
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    **inputs,
+        # 実行枠を確保する（空きがなければ待ち、待機キューが満杯なら ModelBusyError を送出）
+        self.pool.acquire()
+        
+        # 登録済みのプレフィックスと一致する部分は計算済みのKVキャッシュを使い、残りだけをプレフィルする
+        prefix_past = None
+        if self.prefix_cache is not None:
+            try:
+                prefix_past, _ = self.prefix_cache.lookup(inputs["input_ids"][0].tolist())
+            except Exception:
+                self.pool.release()
+                raise
+        
+        # 連続バッチングが有効な場合は、他のリクエストと同じバッチでデコードする
+        if self.scheduler is not None:
+            try:
+                request = self.scheduler.submit(
+                    inputs["input_ids"][0].tolist(),
                     max_new_tokens=max_tokens,
                     temperature=temperature,
                     top_p=top_p,
                     top_k=top_k,
-                    do_sample=temperature > 0,
+                    prefix_past=prefix_past,
+                    stop=stop,
+                    seed=seed,
                 )
-                
-            # 生成されたテキストからプロンプト部分を除去
-            generated_text = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-            prompt_text = self.tokenizer.decode(inputs["input_ids"][0], skip_special_tokens=True)
+            except Exception:
+                self.pool.release()
+                raise
+            request.add_done_callback(lambda _: self.pool.release())
+            
+            def finish(r: Any) -> None:
+                if r.error is not None:
+                    return
+                # 実行枠とバッチへの合流を待った時間を待ち時間とする
+                timing.mark_started(r.started_at)
+                timing.mark_first_token(r.first_token_at)
+                self._finish_timing(timing, usage, len(r.generated))
+            
+            request.add_done_callback(finish)
+            return iter(request) if stream else request.result()
+        
+        # 実行枠を待った時間までを待ち時間とする
+        timing.mark_started()
+        
+        inputs = inputs.to(self.model.device)
+        generation_kwargs = {
+            "max_new_tokens": max_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+            "top_k": top_k,
+            "do_sample": temperature > 0,
+        }
+        if prefix_past is not None:
+            generation_kwargs["past_key_values"] = from_legacy_cache(prefix_past)
+        if seed is not None:
+            generation_kwargs["seed"] = seed
+        stopping_criteria = StoppingCriteriaList([FirstTokenCriteria(timing)])
+        if stop:
+            stopping_criteria.append(StopStringCriteria(self.tokenizer, prompt_tokens, stop))
+        generation_kwargs["stopping_criteria"] = stopping_criteria
+        
+        # ストリーミング生成
+        if stream:
+            return self._stream_generate(inputs, generation_kwargs, timing, usage, stop)
+        else:
+            # 通常の生成（プールのワーカーで実行し、終了時に実行枠を返却する）
+            outputs = self.pool.submit(self._run_generate, **inputs, **generation_kwargs).result()
             
-            # プロンプト部分を削除して返す
-            return generated_text[len(prompt_text):]
+            # プロンプト部分を除いた生成トークンだけをデコードする
+            generated_ids = outputs[0][prompt_tokens:]
+            self._finish_timing(timing, usage, int(generated_ids.shape[0]))
+            text = self.tokenizer.decode(generated_ids, skip_special_tokens=True)
+            return truncate_at_stop(text, stop)[0]
+    
+    def _apply_chat_template(self, messages: List[Dict[str, str]]) -> str:
+        """
+        構造化されたメッセージをトークナイザーのチャットテンプレートでプロンプトに変換する
+        
+        Gemmaのテンプレートはユーザーとアシスタントの交互の発話を要求するため、
+        同じ役割が連続する場合は1つのメッセージにまとめる
+        """
+        merged: List[Dict[str, str]] = []
+        for message in messages:
+            if merged and merged[-1]["role"] == message["role"]:
+                merged[-1] = {
+                    "role": message["role"],
+                    "content": merged[-1]["content"] + "\n\n" + message["content"],
+                }
+            else:
+                merged.append({"role": message["role"], "content": message["content"]})
+        
+        return self.tokenizer.apply_chat_template(merged, tokenize=False, add_generation_prompt=True)
+    
+    def register_prompt_prefix(self, system_prefix: str) -> None:
+        """
+        システムプロンプト（またはその先頭部分）を登録し、以降のリクエストでそのKVキャッシュを再利用する
+        
+        チャットテンプレートを適用した形式と、会話をプロンプト文字列に展開する従来の形式の両方を登録する。
+        KVキャッシュは最初に一致したリクエストの処理時に計算される
+        """
+        if self.prefix_cache is None or not system_prefix or system_prefix in self._registered_prefixes:
+            return
+        self._registered_prefixes.add(system_prefix)
+        
+        # テンプレートが末尾の空白を整形しても位置を特定できるよう、目印を付けて適用してから切り出す
+        marker = "<<prefix-end>>"
+        rendered = self._apply_chat_template([
+            {"role": "system", "content": system_prefix + marker},
+            {"role": "user", "content": "."},
+        ])
+        if marker in rendered:
+            self.prefix_cache.register(rendered[:rendered.index(marker)])
+        self.prefix_cache.register(system_prefix)
+    
+    def generate_chat(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = None,
+        temperature: float = None,
+        top_p: float = None,
+        top_k: int = None,
+        stream: bool = False,
+        session_id: Optional[str] = None,
+        stop: Optional[List[str]] = None,
+        seed: Optional[int] = None,
+    ) -> Union[str, Iterator[str]]:
+        """
+        構造化されたメッセージから応答を生成する
+        
+        Args:
+            messages: {"role", "content"} 形式のメッセージのリスト
+            max_tokens: 生成する最大トークン数
+            temperature: 温度パラメータ
+            top_p: top-p サンプリングのパラメータ
+            top_k: top-k サンプリングのパラメータ
+            stream: ストリーミング生成を行うかどうか
+            session_id: セッションID（Ollamaバックエンドとの互換性のために受け取るが、使用しない）
+            stop: 生成を止める文字列のリスト（出力には含まれない）
+            seed: 乱数シード（指定した場合、同じ入力からは同じ出力を生成する）
+            
+        Returns:
+            生成されたテキスト、またはストリーミングの場合はジェネレータ
+        """
+        if not self.model or not self.tokenizer:
+            raise RuntimeError("モデルが初期化されていません")
+        
+        return self.generate_text(
+            prompt=self._apply_chat_template(messages),
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            stream=stream,
+            stop=stop,
+            seed=seed,
+        )
+    
+    @staticmethod
+    def _finish_timing(timing: GenerationTiming, usage: Optional[Dict[str, Any]], completion_tokens: int) -> None:
+        """
+        生成の計測値を記録し、生成したトークン数と合わせて usage に書き込む
+        """
+        result = timing.finish(completion_tokens)
+        if usage is not None:
+            usage["completion_tokens"] = completion_tokens
+            usage["timing"] = result
+    
+    def _stream_generate(
+        self,
+        inputs: Dict[str, Any],
+        generation_kwargs: Dict[str, Any],
+        timing: GenerationTiming,
+        usage: Optional[Dict[str, int]] = None,
+        stop: Optional[List[str]] = None,
+    ) -> GenerationStream:
+        """
+        プールのワーカーで生成を開始し、生成されたテキストを順次返すイテレータを返す
+        """
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        cancel_event = Event()
+        stopping_criteria = generation_kwargs.pop("stopping_criteria", StoppingCriteriaList())
+        stopping_criteria.append(CancelCriteria(cancel_event))
+        future = self.pool.submit(
+            self._run_generate,
+            input_ids=inputs["input_ids"],
+            attention_mask=inputs["attention_mask"],
+            streamer=streamer,
+            stopping_criteria=stopping_criteria,
+            **generation_kwargs,
+        )
+        # 生成がエラーで終了した場合もストリームを閉じ、読み出し側が待ち続けないようにする
+        future.add_done_callback(lambda f: streamer.end() if f.exception() is not None else None)
+        prompt_tokens = inputs["input_ids"].shape[1]
+        future.add_done_callback(
+            lambda f: self._finish_timing(timing, usage, int(f.result().shape[1] - prompt_tokens)) if f.exception() is None else None
+        )
+        
+        return GenerationStream(streamer, future, cancel_event, stop)
+    
+    async def generate(
+        self,
+        prompt: str,
+        max_tokens: int = None,
+        temperature: float = None,
+        top_p: float = None,
+        top_k: int = None,
+        usage: Optional[Dict[str, int]] = None,
+        session_id: Optional[str] = None,
+        stop: Optional[List[str]] = None,
+        seed: Optional[int] = None,
+    ) -> str:
+        """
+        テキストを非同期に生成する（生成処理はワーカースレッドで実行）
+        """
+        return await asyncio.to_thread(
+            self.generate_text,
+            prompt=prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            stream=False,
+            usage=usage,
+            stop=stop,
+            seed=seed,
+        )
+    
+    async def stream(
+        self,
+        prompt: str,
+        max_tokens: int = None,
+        temperature: float = None,
+        top_p: float = None,
+        top_k: int = None,
+        usage: Optional[Dict[str, int]] = None,
+        session_id: Optional[str] = None,
+        stop: Optional[List[str]] = None,
+        seed: Optional[int] = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        テキストを非同期ストリーミングで生成する
+        
+        ストリーマーからの読み出しはブロッキングなため、チャンクごとにワーカースレッドで待機する。
+        読み出し側が途中で終了（クライアントの切断など）した場合は、次のトークンで生成を止める
+        """
+        iterator = await asyncio.to_thread(
+            self.generate_text,
+            prompt=prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            stream=True,
+            usage=usage,
+            stop=stop,
+            seed=seed,
+        )
+        sentinel = object()
+        try:
+            while True:
+                chunk = await asyncio.to_thread(next, iterator, sentinel)
+                if chunk is sentinel:
+                    break
+                yield chunk
+        finally:
+            iterator.cancel()
+    
+    async def chat(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = None,
+        temperature: float = None,
+        top_p: float = None,
+        top_k: int = None,
+        usage: Optional[Dict[str, int]] = None,
+        session_id: Optional[str] = None,
+        stop: Optional[List[str]] = None,
+        seed: Optional[int] = None,
+    ) -> str:
+        """
+        構造化されたメッセージから応答を非同期に生成する
+        """
+        return await self.generate(
+            prompt=self._apply_chat_template(messages),
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            usage=usage,
+            stop=stop,
+            seed=seed,
+        )
+    
+    async def stream_chat(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = None,
+        temperature: float = None,
+        top_p: float = None,
+        top_k: int = None,
+        usage: Optional[Dict[str, int]] = None,
+        session_id: Optional[str] = None,
+        stop: Optional[List[str]] = None,
+        seed: Optional[int] = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        構造化されたメッセージから応答を非同期ストリーミングで生成する
+        """
+        chunks = self.stream(
+            prompt=self._apply_chat_template(messages),
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            usage=usage,
+            stop=stop,
+            seed=seed,
+        )
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+    
+    async def embed(self, text: str) -> List[float]:
+        """
+        テキストの埋め込みベクトルを非同期に取得する
+        """
+        return await asyncio.to_thread(self.get_embeddings, text)
+    
+    async def embed_batch(self, texts: List[str]) -> np.ndarray:
+        """
+        複数テキストの埋め込みベクトルを非同期に取得する
+        """
+        return await asyncio.to_thread(self.get_embeddings_batch, texts)
+    
+    async def warmup(self) -> bool:
+        """
+        小さな生成を1回実行し、CUDAカーネルの初期化などを最初のリクエスト前に済ませる
+        
+        Returns:
+            ウォームアップに成功したかどうか
+        """
+        start_time = time.time()
+        try:
+            await self.generate("こんにちは", max_tokens=1, temperature=0.0)
+            self.warmup_seconds = round(time.time() - start_time, 2)
+            self.warm = True
+            logger.info(f"モデルのウォームアップが完了しました（{self.warmup_seconds}秒）")
+        except Exception as e:
+            self.warm = False
+            logger.error(f"モデルのウォームアップ中にエラーが発生しました: {str(e)}")
+        
+        return self.warm
+    
+    async def aclose(self) -> None:
+        """
+        非同期インターフェースをOllamaModelと揃えるためのメソッド（解放するリソースはない）
+        """
+        return None
             
     def get_embeddings(self, text: str) -> List[float]:
         """
@@ -174,20 +699,98 @@ class GemmaModel:
         Returns:
             埋め込みベクトル
         """
+        return self.get_embeddings_batch([text])[0].tolist()
+    
+    def _embedding_cache_model(self) -> str:
+        """
+        埋め込みキャッシュのキーに含めるモデル名（ベクトルの取り出し方も区別する）
+        """
+        return f"{settings.HF_MODEL_ID}#{self._embedding_pooling()}-l2"
+    
+    @staticmethod
+    def _embedding_pooling() -> str:
+        """
+        設定されたプーリング方法を返す（不明な値の場合は mean）
+        """
+        pooling = settings.HF_EMBEDDING_POOLING.lower()
+        return pooling if pooling in ("mean", "last") else "mean"
+        
+    def get_embeddings_batch(self, texts: List[str]) -> np.ndarray:
+        """
+        複数テキストの埋め込みベクトルを取得する（計算済みのテキストはキャッシュから返す）
+        
+        Args:
+            texts: 入力テキストのリスト
+            
+        Returns:
+            (テキスト数, 次元数) のL2正規化済みfloat32配列
+        """
         if not self.model or not self.tokenizer:
             raise RuntimeError("モデルが初期化されていません")
+        
+        return get_embedding_cache().get_or_compute(self._embedding_cache_model(), texts, self._compute_embeddings)
+        
+    def _compute_embeddings(self, texts: List[str]) -> np.ndarray:
+        """
+        複数テキストの埋め込みベクトルをパディング付きのバッチで計算する（キャッシュを通さない）
+        
+        言語モデルヘッドと中間層の出力を持たないデコーダー本体だけを実行し、
+        最終層の隠れ状態をプーリングしてL2正規化する。
+        パディングを減らすため、トークン数の近いテキスト同士で同じバッチを組む。
+        各バッチは生成と同じ実行枠（GenerationWorkerPool）を確保して計算し、生成と同時にGPUを使う数を制限する
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        
+        decoder = self.model.get_decoder()
+        pooling = self._embedding_pooling()
+        
+        # トークン数の順に並べてバッチを組み、最後に入力の順に戻す
+        lengths = [len(ids) for ids in self.tokenizer(texts)["input_ids"]]
+        order = sorted(range(len(texts)), key=lambda i: lengths[i])
+        result: Optional[np.ndarray] = None
+        batch_size = settings.HF_EMBEDDING_BATCH_SIZE
+        for start in range(0, len(order), batch_size):
+            indices = order[start:start + batch_size]
+            inputs = self.tokenizer(
+                [texts[i] for i in indices],
+                return_tensors="pt",
+                padding=True,
+            ).to(self.model.device)
             
-        # 入力をトークン化
-        inputs = self.tokenizer(text, return_tensors="pt").to(self.model.device)
+            # 生成と同じ実行枠を確保してから計算する（空きがなければ待ち、待機キューが満杯なら ModelBusyError を送出）
+            self.pool.acquire()
+            vectors = self.pool.submit(self._embed_batch, decoder=decoder, pooling=pooling, inputs=inputs).result()
+            if result is None:
+                result = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            result[indices] = vectors
         
-        # 埋め込みを計算
-        with torch.no_grad():
-            outputs = self.model(**inputs, output_hidden_states=True)
+        return result
+    
+    @staticmethod
+    def _embed_batch(decoder: Any, pooling: str, inputs: Any) -> np.ndarray:
+        """
+        1バッチ分の隠れ状態を計算し、プーリングしてL2正規化したベクトルを返す
+        """
+        with torch.inference_mode():
+            hidden = decoder(
+                input_ids=inputs["input_ids"],
+                attention_mask=inputs["attention_mask"],
+                use_cache=False,
+            ).last_hidden_state
             
-        # 最後の隠れ層の最初のトークンのベクトルを取得（[CLS]トークンに相当）
-        embeddings = outputs.hidden_states[-1][0, 0, :].cpu().numpy().tolist()
+            mask = inputs["attention_mask"]
+            if pooling == "last":
+                # パディングの向きに関係なく、各行の最後の有効トークンのベクトルを取得する
+                last_index = mask.size(1) - 1 - mask.flip(dims=[1]).argmax(dim=1)
+                rows = torch.arange(mask.size(0), device=mask.device)
+                pooled = hidden[rows, last_index].float()
+            else:
+                weights = mask.unsqueeze(-1).float()
+                pooled = (hidden.float() * weights).sum(dim=1) / weights.sum(dim=1).clamp(min=1.0)
+            pooled = torch.nn.functional.normalize(pooled, p=2, dim=-1)
         
-        return embeddings
+        return pooled.cpu().numpy()
         
     def get_model_info(self) -> Dict[str, Any]:
         """
@@ -199,20 +802,42 @@ class GemmaModel:
         if not self.model or not self.tokenizer:
             return {
                 "status": "not_loaded",
-                "model_id": settings.MODEL_ID,
+                "model_id": settings.HF_MODEL_ID,
             }
             
         return {
             "status": "loaded",
-            "model_id": settings.MODEL_ID,
+            "model_id": settings.HF_MODEL_ID,
             "model_type": self.model.__class__.__name__,
             "tokenizer_type": self.tokenizer.__class__.__name__,
             "device": str(self.model.device),
             "parameters": {
-                "quantization": "4bit" if settings.USE_4BIT_QUANTIZATION else "8bit" if settings.USE_8BIT_QUANTIZATION else "none",
-                "flash_attention": settings.USE_FLASH_ATTENTION,
-            }
+                "quantization": "4bit" if settings.HF_USE_4BIT_QUANTIZATION else "8bit" if settings.HF_USE_8BIT_QUANTIZATION else "none",
+                "flash_attention": settings.HF_USE_FLASH_ATTENTION,
+                "warmup_seconds": self.warmup_seconds,
+                "batching": self.scheduler.get_stats() if self.scheduler is not None else None,
+                "generation_pool": self.pool.get_stats(),
+                "speculative_decoding": self.speculative.get_stats() if self.speculative is not None else None,
+                "prefix_cache": self.prefix_cache.get_stats() if self.prefix_cache is not None else None,
+            },
+            "warm": self.warm,
+            "memory": {
+                "allocated": torch.cuda.memory_allocated(),
+                "reserved": torch.cuda.memory_reserved(),
+            } if torch.cuda.is_available() else None,
         }
+    
+    def get_backend_stats(self) -> List[Dict[str, Any]]:
+        """
+        バックエンドのインスタンスごとの状態を返す（モデルをプロセス内で実行するため常に空）
+        """
+        return []
+    
+    def get_hedge_stats(self) -> Optional[Dict[str, Any]]:
+        """
+        ヘッジの統計情報を返す（このモデル自体はヘッジを行わないため常にNone）
+        """
+        return None
         
 # シングルトンインスタンスを取得する関数
 def get_gemma_model() -> GemmaModel:
@@ -0,0 +1,139 @@
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Any, Callable, AsyncIterator
+
+logger = logging.getLogger(__name__)
+
+class ModelBusyError(RuntimeError):
+    """
+    生成の実行枠が空かず、リクエストを受け付けられない場合のエラー
+    """
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class GenerationWorkerPool:
+    """
+    固定数のワーカーで生成を実行し、実行枠を待つリクエストの数と待ち時間を制限するプール
+    
+    acquire で実行枠を確保してから生成を開始し、生成の終了時に release で枠を返す。
+    待機キューが満杯の場合や待ち時間が上限を超えた場合は ModelBusyError を送出する
+    """
+    
+    def __init__(self, workers: int, max_queue: int, queue_timeout: float, retry_after: int):
+        """
+        Args:
+            workers: 同時に実行できる生成の数
+            max_queue: 実行枠の空きを待てるリクエストの数
+            queue_timeout: 実行枠の空きを待つ最大時間（秒）
+            retry_after: 受け付けられなかった場合にクライアントへ返す再試行までの秒数
+        """
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="gemma-generate")
+        self._condition = threading.Condition()
+        self._running = 0
+        self._waiting = 0
+        
+        # 統計情報
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+    
+    def acquire(self) -> None:
+        """
+        実行枠を確保する（空きがなければ queue_timeout まで待つ）
+        
+        Raises:
+            ModelBusyError: 待機キューが満杯、または待ち時間が上限を超えた場合
+        """
+        with self._condition:
+            if self._running >= self.workers:
+                if self._waiting >= self.max_queue:
+                    self.rejected += 1
+                    logger.warning(f"生成の待機キューが満杯のためリクエストを拒否しました（実行中: {self._running}, 待機中: {self._waiting}）")
+                    raise ModelBusyError("生成の待機キューが満杯です。しばらくしてから再試行してください。", self.retry_after)
+                
+                self._waiting += 1
+                try:
+                    available = self._condition.wait_for(lambda: self._running < self.workers, timeout=self.queue_timeout)
+                finally:
+                    self._waiting -= 1
+                
+                if not available:
+                    self.timed_out += 1
+                    logger.warning(f"生成の実行枠を{self.queue_timeout}秒待っても確保できませんでした")
+                    raise ModelBusyError("生成の実行枠の待ち時間が上限を超えました。しばらくしてから再試行してください。", self.retry_after)
+            
+            self._running += 1
+            self.admitted += 1
+    
+    def release(self) -> None:
+        """
+        実行枠を返却し、待機中のリクエストを1件起こす
+        """
+        with self._condition:
+            self._running = max(0, self._running - 1)
+            self._condition.notify()
+    
+    def submit(self, fn: Callable[..., Any], **kwargs: Any) -> Future:
+        """
+        確保済みの実行枠で fn をワーカースレッドで実行し、終了時に枠を返却する
+        """
+        future = self._executor.submit(fn, **kwargs)
+        future.add_done_callback(lambda _: self.release())
+        return future
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        プールの統計情報を返す
+        """
+        with self._condition:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "queue_timeout": self.queue_timeout,
+                "running": self._running,
+                "waiting": self._waiting,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+            }
+
+
+async def prime_stream(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """
+    ストリームの最初のチャンクを先に取得し、同じ内容を返すストリームを返す
+    
+    StreamingResponse を返す前に呼び出すことで、実行枠を確保できない場合の ModelBusyError を
+    レスポンスの送信開始前に送出させる。それ以外のエラーは従来どおりストリームの中で送出する
+    """
+    first = None
+    finished = False
+    error = None
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        finished = True
+    except ModelBusyError:
+        raise
+    except Exception as e:
+        error = e
+    
+    async def replay() -> AsyncIterator[str]:
+        if error is not None:
+            raise error
+        if finished:
+            return
+        try:
+            yield first
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+    
+    return replay()
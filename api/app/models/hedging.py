@@ -0,0 +1,349 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional, AsyncGenerator, Callable, Iterator, Union
+
+logger = logging.getLogger(__name__)
+
+# 1回の試行を開始する関数（渡された辞書にトークン使用量を書き込み、テキストチャンクを返す）
+Attempt = Callable[[Dict[str, int]], AsyncGenerator[str, None]]
+
+async def _next_chunk(chunks: AsyncGenerator[str, None]) -> Optional[str]:
+    """
+    ストリームの次のチャンクを返す（終了した場合はNone）
+    """
+    try:
+        return await chunks.__anext__()
+    except StopAsyncIteration:
+        return None
+
+class HedgePolicy:
+    """
+    最初のトークンが遅い場合に、同じリクエストを副のバックエンドにも送るヘッジの方針
+    
+    主のバックエンドが delay 秒以内に最初のチャンクを返さない場合（または最初のチャンクの前に失敗した場合）、
+    副のバックエンドでも同じリクエストを開始し、先に最初のチャンクを返した方の出力を使う。
+    負けた方のストリームは閉じ、バックエンド側の生成も止めさせる
+    """
+    
+    def __init__(self, name: str, delay: float):
+        """
+        Args:
+            name: ログと統計に表示する名前
+            delay: 副のバックエンドにリクエストを送るまで最初のチャンクを待つ秒数
+        """
+        self.name = name
+        self.delay = max(0.0, delay)
+        
+        self._lock = threading.Lock()
+        
+        # 統計情報
+        self.requests = 0
+        self.hedged = 0
+        self.failovers = 0
+        self.primary_wins = 0
+        self.secondary_wins = 0
+        self.failures = 0
+        self.first_chunk_seconds = 0.0
+    
+    async def stream(
+        self,
+        primary: Attempt,
+        secondary: Optional[Attempt],
+        usage: Optional[Dict[str, int]] = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        主のバックエンドで生成を開始し、必要に応じて副のバックエンドと競わせて、勝った方のチャンクを返す
+        
+        Args:
+            primary: 主のバックエンドで試行を開始する関数
+            secondary: 副のバックエンドで試行を開始する関数（Noneの場合はヘッジしない）
+            usage: 指定した場合、勝った方のトークン使用量を書き込む
+        
+        Returns:
+            テキストチャンクの非同期ジェネレータ
+        """
+        with self._lock:
+            self.requests += 1
+        
+        start_time = time.time()
+        usages: List[Dict[str, int]] = [{}]
+        streams = [primary(usages[0])]
+        tasks = [asyncio.ensure_future(_next_chunk(streams[0]))]
+        winner: Optional[int] = None
+        
+        try:
+            if secondary is not None:
+                done, _ = await asyncio.wait(tasks, timeout=self.delay)
+                if not done or tasks[0].exception() is not None:
+                    failover = bool(done)
+                    with self._lock:
+                        if failover:
+                            self.failovers += 1
+                        else:
+                            self.hedged += 1
+                    if failover:
+                        logger.warning(f"{self.name}: 主のバックエンドが失敗したため、副のバックエンドに切り替えます: {tasks[0].exception()}")
+                    else:
+                        logger.info(f"{self.name}: {self.delay}秒以内に最初のトークンが返らないため、副のバックエンドにも同じリクエストを送ります")
+                    usages.append({})
+                    streams.append(secondary(usages[1]))
+                    tasks.append(asyncio.ensure_future(_next_chunk(streams[1])))
+            
+            winner = await self._race(tasks)
+            first_chunk = tasks[winner].result()
+        except BaseException:
+            with self._lock:
+                self.failures += 1
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for chunks in streams:
+                await chunks.aclose()
+            raise
+        
+        # 負けた方の試行を止める（ストリームを閉じるとバックエンドへの接続も閉じられる）
+        for index, task in enumerate(tasks):
+            if index != winner:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                await streams[index].aclose()
+        
+        with self._lock:
+            if winner == 0:
+                self.primary_wins += 1
+            else:
+                self.secondary_wins += 1
+            self.first_chunk_seconds += time.time() - start_time
+        if winner > 0:
+            logger.info(f"{self.name}: 副のバックエンドが先に応答しました")
+        
+        chunks = streams[winner]
+        try:
+            if first_chunk is not None:
+                yield first_chunk
+                async for text in chunks:
+                    yield text
+        finally:
+            await chunks.aclose()
+            if usage is not None:
+                usage.update(usages[winner])
+    
+    @staticmethod
+    async def _race(tasks: List["asyncio.Future[Optional[str]]"]) -> int:
+        """
+        最初に成功した試行の番号を返す（すべて失敗した場合は主の試行の例外を送出する）
+        """
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in tasks:
+                if task in done and task.exception() is None:
+                    return tasks.index(task)
+        raise tasks[0].exception()
+    
+    async def collect(
+        self,
+        primary: Attempt,
+        secondary: Optional[Attempt],
+        usage: Optional[Dict[str, int]] = None,
+    ) -> str:
+        """
+        stream と同じ方針で生成し、勝った方の出力を結合して返す
+        
+        非ストリーミングの生成も最初のトークンまでの時間でヘッジを判定するため、内部ではストリーミングで受け取る
+        """
+        return "".join([text async for text in self.stream(primary, secondary, usage)])
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        ヘッジの発生率と、主と副それぞれが勝った回数を返す
+        """
+        with self._lock:
+            wins = self.primary_wins + self.secondary_wins
+            return {
+                "name": self.name,
+                "delay_seconds": self.delay,
+                "requests": self.requests,
+                "hedged": self.hedged,
+                "failovers": self.failovers,
+                "hedge_rate": round((self.hedged + self.failovers) / self.requests, 4) if self.requests else 0.0,
+                "primary_wins": self.primary_wins,
+                "secondary_wins": self.secondary_wins,
+                "secondary_win_rate": round(self.secondary_wins / (self.hedged + self.failovers), 4) if self.hedged + self.failovers else 0.0,
+                "failures": self.failures,
+                "average_first_chunk_seconds": round(self.first_chunk_seconds / wins, 3) if wins else 0.0,
+            }
+
+def _close_sync_stream(chunks: Any) -> None:
+    """
+    同期の生成のストリームを閉じる（中止できるイテレータは中止し、ジェネレータは閉じて接続を解放する）
+    """
+    if hasattr(chunks, "cancel"):
+        chunks.cancel()
+    elif hasattr(chunks, "close"):
+        chunks.close()
+
+class HedgedModel:
+    """
+    別の種類のバックエンド（Ollama と Hugging Face モデル）を副として、生成をヘッジするモデルのラッパー
+    
+    生成（generate, stream, chat, stream_chat と、同期の generate_text, generate_chat）は HedgePolicy で主と副を競わせ、
+    それ以外の属性（埋め込み、モデル情報など）は主のモデルをそのまま使う
+    """
+    
+    def __init__(self, primary: Any, load_secondary: Callable[[], Any], policy: HedgePolicy):
+        """
+        Args:
+            primary: 主のモデル
+            load_secondary: 副のモデルを読み込んで返す関数（ブロッキング、最初に必要になったときに呼ぶ）
+            policy: ヘッジの方針
+        """
+        self.primary = primary
+        self.policy = policy
+        self._load_secondary = load_secondary
+        self._loading: Optional["asyncio.Future[Any]"] = None
+    
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.primary, name)
+    
+    async def get_secondary(self) -> Any:
+        """
+        副のモデルを返す（未読み込みの場合はワーカースレッドで読み込む）
+        """
+        # 読み込みを待っている試行が負けて取り消されても、読み込み自体は続けて次の試行で使う
+        if self._loading is None or (self._loading.done() and self._loading.exception() is not None):
+            self._loading = asyncio.ensure_future(asyncio.to_thread(self._load_secondary))
+        return await asyncio.shield(self._loading)
+    
+    def _secondary_attempt(self, method: str, *args: Any, **kwargs: Any) -> Attempt:
+        """
+        副のモデルで同じ生成を行う試行を作成する
+        """
+        async def attempt(usage: Dict[str, int]) -> AsyncGenerator[str, None]:
+            secondary = await self.get_secondary()
+            chunks = getattr(secondary, method)(*args, usage=usage, **kwargs)
+            try:
+                async for text in chunks:
+                    yield text
+            finally:
+                await chunks.aclose()
+        return attempt
+    
+    def _hedged_stream(self, method: str, *args: Any, usage: Optional[Dict[str, int]] = None, **kwargs: Any) -> AsyncGenerator[str, None]:
+        return self.policy.stream(
+            lambda attempt_usage: getattr(self.primary, method)(*args, usage=attempt_usage, **kwargs),
+            self._secondary_attempt(method, *args, **kwargs),
+            usage,
+        )
+    
+    async def generate(self, prompt: str, usage: Optional[Dict[str, int]] = None, **kwargs: Any) -> str:
+        return "".join([text async for text in self._hedged_stream("stream", prompt, usage=usage, **kwargs)])
+    
+    def stream(self, prompt: str, usage: Optional[Dict[str, int]] = None, **kwargs: Any) -> AsyncGenerator[str, None]:
+        return self._hedged_stream("stream", prompt, usage=usage, **kwargs)
+    
+    async def chat(self, messages: List[Dict[str, str]], usage: Optional[Dict[str, int]] = None, **kwargs: Any) -> str:
+        return "".join([text async for text in self._hedged_stream("stream_chat", messages, usage=usage, **kwargs)])
+    
+    def stream_chat(self, messages: List[Dict[str, str]], usage: Optional[Dict[str, int]] = None, **kwargs: Any) -> AsyncGenerator[str, None]:
+        return self._hedged_stream("stream_chat", messages, usage=usage, **kwargs)
+    
+    def _sync_attempt(self, model: Optional[Any], method: str, *args: Any, **kwargs: Any) -> Attempt:
+        """
+        同期の生成メソッドのストリーミングを、試行ごとのワーカースレッドで読む試行を作成する
+        
+        Args:
+            model: 生成に使うモデル（Noneの場合は副のモデルを読み込んで使う）
+            method: 同期の生成メソッドの名前（generate_text, generate_chat）
+        """
+        async def attempt(usage: Dict[str, int]) -> AsyncGenerator[str, None]:
+            loop = asyncio.get_running_loop()
+            # 同じイテレータへの呼び出しが重ならないよう、試行ごとに1つのスレッドで順番に実行する
+            executor = ThreadPoolExecutor(max_workers=1)
+            opened: List[Any] = []
+            
+            def open_stream() -> None:
+                target = model if model is not None else self._load_secondary()
+                opened.append(getattr(target, method)(*args, stream=True, **kwargs))
+            
+            def close_stream() -> None:
+                if opened:
+                    _close_sync_stream(opened[0])
+            
+            try:
+                await loop.run_in_executor(executor, open_stream)
+                while True:
+                    text = await loop.run_in_executor(executor, next, opened[0], None)
+                    if text is None:
+                        break
+                    yield text
+            finally:
+                # 負けた試行の読み込み中のチャンクは待たず、読み込みが終わり次第ワーカースレッドで閉じる
+                if opened and hasattr(opened[0], "cancel"):
+                    opened[0].cancel()
+                executor.submit(close_stream)
+                executor.shutdown(wait=False)
+        return attempt
+    
+    def _hedged_sync(self, method: str, *args: Any, stream: bool = False, **kwargs: Any) -> Union[str, Iterator[str]]:
+        """
+        同期の生成を主と副で競わせる
+        
+        ワーカースレッド（run_in_threadpool、asyncio.to_thread）から呼ばれることを前提に、
+        このスレッド専用のイベントループで HedgePolicy を動かす。
+        イベントループのスレッドから直接呼ばれた場合はループを入れ子にできないため、ヘッジせずに主のモデルを使う
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            logger.debug(f"{self.policy.name}: イベントループのスレッドから同期の生成が呼ばれたため、ヘッジせずに主のモデルを使います")
+            return getattr(self.primary, method)(*args, stream=stream, **kwargs)
+        
+        chunks = self._iterate_hedged_sync(method, *args, **kwargs)
+        return chunks if stream else "".join(chunks)
+    
+    def _iterate_hedged_sync(self, method: str, *args: Any, **kwargs: Any) -> Iterator[str]:
+        loop = asyncio.new_event_loop()
+        chunks = self.policy.stream(
+            self._sync_attempt(self.primary, method, *args, **kwargs),
+            self._sync_attempt(None, method, *args, **kwargs),
+        )
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(chunks.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            loop.run_until_complete(chunks.aclose())
+            loop.close()
+    
+    def generate_text(self, prompt: str, stream: bool = False, **kwargs: Any) -> Union[str, Iterator[str]]:
+        return self._hedged_sync("generate_text", prompt, stream=stream, **kwargs)
+    
+    def generate_chat(self, messages: List[Dict[str, str]], stream: bool = False, **kwargs: Any) -> Union[str, Iterator[str]]:
+        return self._hedged_sync("generate_chat", messages, stream=stream, **kwargs)
+    
+    async def warmup(self) -> bool:
+        """
+        主のモデルをウォームアップし、副のモデルも読み込んでウォームアップしておく
+        （最初のヘッジで副のモデルの読み込みを待たないようにする）
+        """
+        warm = await self.primary.warmup()
+        try:
+            secondary = await self.get_secondary()
+            await secondary.warmup()
+        except Exception as e:
+            logger.error(f"ヘッジ用の副のモデルの準備中にエラーが発生しました: {str(e)}")
+        return warm
+    
+    def get_hedge_stats(self) -> Optional[Dict[str, Any]]:
+        """
+        ヘッジの統計情報を返す
+        """
+        return self.policy.get_stats()
@@ -0,0 +1,253 @@
+"""
+文字n-gramの線形モデルによる、CPUのみで動く意図の分類器
+
+統合ルーター（モデル呼び出し）の判定ログから学習し、確信度が閾値以上の場合だけ
+ルーターの代わりに意図を判定する。特徴量は正規化したテキストの文字1〜3-gramをハッシュしたもので、
+重みは (特徴量数, ラベル数) の行列1つ（data/intent_classifier.npz）に保存する。
+
+使用例（api ディレクトリで実行）:
+    python -m app.models.intent_classifier train --holdout 0.2
+    python -m app.models.intent_classifier evaluate --data data/intent_decisions.jsonl
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import argparse
+import unicodedata
+from typing import Dict, List, Any, Tuple
+
+import numpy as np
+
+from ..core.database import DB_DIR
+
+# 学習済みの分類器のパス
+INTENT_CLASSIFIER_PATH = os.path.join(DB_DIR, "intent_classifier.npz")
+# 統合ルーターの判定ログ（分類器の学習データ）のパス
+INTENT_LOG_PATH = os.path.join(DB_DIR, "intent_decisions.jsonl")
+
+# 特徴量に使う文字n-gramの長さ
+NGRAM_SIZES = (1, 2, 3)
+# ハッシュする特徴量の次元数の既定値
+DEFAULT_NUM_FEATURES = 1 << 15
+
+def normalize_text(text: str) -> str:
+    """
+    全角・半角の違い、大文字・小文字、連続する空白をそろえる
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).lower().split())
+
+def extract_features(text: str, num_features: int) -> np.ndarray:
+    """
+    正規化したテキストの文字n-gramをハッシュした特徴量の番号を返す（重複なし）
+    """
+    text = f"\x02{normalize_text(text)}\x03"
+    indices = [
+        zlib.crc32(text[start:start + size].encode("utf-8")) % num_features
+        for size in NGRAM_SIZES
+        for start in range(len(text) - size + 1)
+    ]
+    return np.unique(np.asarray(indices, dtype=np.int64))
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    exp = np.exp(logits - logits.max())
+    return exp / exp.sum()
+
+class IntentClassifier:
+    """
+    ハッシュした文字n-gramを特徴量とする多クラスのロジスティック回帰
+    
+    特徴量は出現の有無（0/1）を n-gram 数の平方根で割ったもので、長いメッセージでも確信度が偏りすぎないようにする
+    """
+    
+    def __init__(self, labels: List[str], weights: np.ndarray, bias: np.ndarray):
+        """
+        Args:
+            labels: ラベルのリスト
+            weights: (特徴量数, ラベル数) の重み
+            bias: (ラベル数,) のバイアス
+        """
+        self.labels = list(labels)
+        self.weights = weights
+        self.bias = bias
+        self.num_features = weights.shape[0]
+    
+    def predict_proba(self, text: str) -> np.ndarray:
+        """
+        ラベルごとの確率を返す
+        """
+        indices = extract_features(text, self.num_features)
+        if len(indices) == 0:
+            return _softmax(self.bias)
+        return _softmax(self.weights[indices].sum(axis=0) / np.sqrt(len(indices)) + self.bias)
+    
+    def predict(self, text: str) -> Tuple[str, float]:
+        """
+        最も確率の高いラベルとその確率を返す
+        """
+        probabilities = self.predict_proba(text)
+        best = int(np.argmax(probabilities))
+        return self.labels[best], float(probabilities[best])
+    
+    @classmethod
+    def train(
+        cls,
+        texts: List[str],
+        labels: List[str],
+        num_features: int = DEFAULT_NUM_FEATURES,
+        epochs: int = 10,
+        learning_rate: float = 0.5,
+        l2: float = 1e-6,
+        seed: int = 0,
+    ) -> "IntentClassifier":
+        """
+        確率的勾配降下法で学習する
+        
+        Args:
+            texts: メッセージのリスト
+            labels: 各メッセージのラベル
+            num_features: ハッシュする特徴量の次元数
+            epochs: 学習データを繰り返す回数
+            learning_rate: 学習率（エポックごとに減衰させる）
+            l2: L2正則化の係数
+            seed: 学習データの順序を決める乱数シード
+        """
+        if not texts:
+            raise RuntimeError("学習データがありません")
+        
+        label_names = sorted(set(labels))
+        label_ids = {label: i for i, label in enumerate(label_names)}
+        targets = np.asarray([label_ids[label] for label in labels])
+        features = [extract_features(text, num_features) for text in texts]
+        
+        weights = np.zeros((num_features, len(label_names)), dtype=np.float32)
+        bias = np.zeros(len(label_names), dtype=np.float32)
+        rng = np.random.default_rng(seed)
+        
+        for epoch in range(epochs):
+            rate = learning_rate / (1.0 + epoch)
+            for i in rng.permutation(len(texts)):
+                indices = features[i]
+                scale = 1.0 / np.sqrt(len(indices)) if len(indices) else 0.0
+                gradient = _softmax(weights[indices].sum(axis=0) * scale + bias)
+                gradient[targets[i]] -= 1.0
+                # 1件の特徴量の番号は重複しないため、そのまま更新できる
+                weights[indices] -= rate * (scale * gradient + l2 * weights[indices])
+                bias -= rate * gradient
+        
+        return cls(label_names, weights, bias)
+    
+    def save(self, path: str = INTENT_CLASSIFIER_PATH) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # np.savez は拡張子 .npz を自動で付けるため、ファイルオブジェクトに書き込む
+        with open(path, "wb") as f:
+            np.savez_compressed(f, labels=np.asarray(self.labels), weights=self.weights, bias=self.bias)
+    
+    @classmethod
+    def load(cls, path: str = INTENT_CLASSIFIER_PATH) -> "IntentClassifier":
+        with np.load(path) as data:
+            return cls([str(label) for label in data["labels"]], data["weights"], data["bias"])
+
+def load_decisions(path: str = INTENT_LOG_PATH) -> Tuple[List[str], List[str], List[float]]:
+    """
+    統合ルーターの判定ログを読み込む
+    
+    Returns:
+        メッセージ、ラベル、ルーターの処理時間（秒）のリストのタプル
+    """
+    texts, labels, seconds = [], [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            texts.append(record["message"])
+            labels.append(record["label"])
+            seconds.append(float(record.get("seconds") or 0.0))
+    return texts, labels, seconds
+
+def split_holdout(count: int, holdout: float, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    学習用と評価用のインデックスに分ける
+    """
+    order = np.random.default_rng(seed).permutation(count)
+    size = int(round(count * holdout))
+    return order[size:], order[:size]
+
+def evaluate(
+    classifier: IntentClassifier,
+    texts: List[str],
+    labels: List[str],
+    threshold: float,
+) -> Dict[str, Any]:
+    """
+    ルーターのラベルとの一致率と、閾値以上で分類器が判定する割合（カバー率）を求める
+    
+    Returns:
+        全体の一致率、カバー率、カバーした分の一致率、1件あたりの判定時間（マイクロ秒）の辞書
+    """
+    agree = covered = covered_agree = 0
+    start = time.perf_counter()
+    predictions = [classifier.predict(text) for text in texts]
+    elapsed = time.perf_counter() - start
+    
+    for (label, confidence), expected in zip(predictions, labels):
+        agree += label == expected
+        if confidence >= threshold:
+            covered += 1
+            covered_agree += label == expected
+    
+    count = len(texts)
+    return {
+        "count": count,
+        "threshold": threshold,
+        "agreement": round(agree / count, 4) if count else None,
+        "coverage": round(covered / count, 4) if count else None,
+        "covered_agreement": round(covered_agree / covered, 4) if covered else None,
+        "microseconds_per_message": round(elapsed / count * 1e6, 1) if count else None,
+    }
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="統合ルーターの判定ログから意図の分類器を学習・評価する")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    train_parser = subparsers.add_parser("train", help="判定ログから学習して保存する")
+    train_parser.add_argument("--data", default=INTENT_LOG_PATH, help="判定ログ（JSONL）のパス")
+    train_parser.add_argument("--output", default=INTENT_CLASSIFIER_PATH, help="学習した分類器の保存先")
+    train_parser.add_argument("--features", type=int, default=DEFAULT_NUM_FEATURES, help="ハッシュする特徴量の次元数")
+    train_parser.add_argument("--epochs", type=int, default=10, help="学習データを繰り返す回数")
+    train_parser.add_argument("--learning-rate", type=float, default=0.5, help="学習率")
+    train_parser.add_argument("--holdout", type=float, default=0.0, help="評価用に取り分けるデータの割合")
+    train_parser.add_argument("--threshold", type=float, default=0.9, help="評価に使う確信度の閾値")
+    
+    eval_parser = subparsers.add_parser("evaluate", help="保存した分類器を判定ログで評価する")
+    eval_parser.add_argument("--data", default=INTENT_LOG_PATH, help="判定ログ（JSONL）のパス")
+    eval_parser.add_argument("--model", default=INTENT_CLASSIFIER_PATH, help="分類器のパス")
+    eval_parser.add_argument("--threshold", type=float, default=0.9, help="確信度の閾値")
+    
+    args = parser.parse_args()
+    texts, labels, _ = load_decisions(args.data)
+    
+    if args.command == "train":
+        train_indices, test_indices = split_holdout(len(texts), args.holdout)
+        classifier = IntentClassifier.train(
+            [texts[i] for i in train_indices],
+            [labels[i] for i in train_indices],
+            num_features=args.features,
+            epochs=args.epochs,
+            learning_rate=args.learning_rate,
+        )
+        classifier.save(args.output)
+        print(f"{len(train_indices)}件で学習し、{args.output} に保存しました（ラベル: {', '.join(classifier.labels)}）")
+        if len(test_indices):
+            report = evaluate(classifier, [texts[i] for i in test_indices], [labels[i] for i in test_indices], args.threshold)
+            print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        classifier = IntentClassifier.load(args.model)
+        print(json.dumps(evaluate(classifier, texts, labels, args.threshold), ensure_ascii=False, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
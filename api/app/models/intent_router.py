@@ -0,0 +1,376 @@
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, Any, Optional, Tuple
+
+from .chat_model import get_chat_model, Message
+from .intent_classifier import IntentClassifier, INTENT_CLASSIFIER_PATH, INTENT_LOG_PATH
+from .reasoning import detect_detail_level, get_reasoning_engine
+from ..core.config import settings
+from ..core.metrics import generation_call_site
+from ..core.intent_cache import memoize_intent
+
+logger = logging.getLogger(__name__)
+
+# 判定できる意図（none は通常のチャット）
+INTENTS = ("none", "file_operation", "reasoning", "web_search", "github_operation")
+
+# 意図ごとの操作の種類
+OPERATION_TYPES = {
+    "file_operation": ("list_files", "read_file", "write_file", "create_directory", "delete_file", "move_file", "copy_file"),
+    "reasoning": ("step_by_step", "evaluate_statement", "compare_options"),
+    "github_operation": ("list_repos", "create_repo", "search_repos", "get_file", "update_file", "create_issue", "create_pr"),
+}
+
+# 分類器の判定をそのまま使えるラベル（パラメータをメッセージから作れるもの）
+# それ以外のラベル（ファイルパスや選択肢などが必要な操作）は、確信度が高くてもルーターに判定させる
+LOCAL_LABELS = ("none", "web_search", "reasoning:step_by_step", "reasoning:evaluate_statement", "github_operation:list_repos")
+
+# 日付の質問はモデルに判定させず、検索の特殊クエリとして扱う
+DATE_KEYWORDS = ["今日の日付", "今日は何日", "今日は"]
+
+# 統合ルーターのシステムプロンプト（ユーザーメッセージはユーザーのターンとして送り、プロンプト全体のKVキャッシュを再利用できるようにする）
+INTENT_ROUTER_PROMPT = """あなたはユーザーメッセージの意図を判定するルーターです。
+メッセージが次のどれに当たるかを1つだけ選び、JSONだけを出力してください。説明は書かないでください。
+
+1. file_operation: ローカルのファイル操作
+   operation_type: list_files/read_file/write_file/create_directory/delete_file/move_file/copy_file
+   parameters: {"path": "ファイルパス", "content": "書き込む内容", "destination": "移動先・コピー先のパス"}
+   例「ファイル一覧を表示して」「example.txtの内容を見せて」「新しいフォルダを作って」
+2. reasoning: ステップバイステップの推論、理由の説明、論理的な分析や証明、文の真偽の評価、選択肢の比較
+   operation_type: step_by_step/evaluate_statement/compare_options
+   parameters: {"question": "推論のための質問・問題", "context": "追加コンテキスト", "detail_level": "low/medium/high", "options": ["選択肢1", "選択肢2"]}
+3. web_search: 検索の依頼、最新情報や外部の事実の質問
+   parameters: {"query": "検索クエリ"}
+   例「東京の天気を調べて」「最新のPythonのバージョンは?」
+4. github_operation: GitHubのリポジトリ、ファイル、イシュー、プルリクエストの操作
+   operation_type: list_repos/create_repo/search_repos/get_file/update_file/create_issue/create_pr
+   parameters: {"owner": "オーナー", "repo": "リポジトリ名", "path": "ファイルパス", "query": "検索クエリ", "name": "作成するリポジトリ名", "title": "タイトル", "body": "本文", "head": "ブランチ", "base": "マージ先"}
+5. none: 上記のどれでもない通常の会話や、モデルの知識で答えられる質問
+
+使わないパラメータは省略してください。出力形式:
+{"intent": "file_operation/reasoning/web_search/github_operation/none", "operation_type": "操作の種類（なければ空）", "parameters": {}}
+"""
+
+class IntentDecision:
+    """
+    統合ルーターの判定結果
+    """
+    
+    def __init__(
+        self,
+        intent: str = "none",
+        operation_type: str = "",
+        parameters: Optional[Dict[str, Any]] = None,
+        parse_failed: bool = False,
+    ):
+        """
+        Args:
+            intent: 意図（INTENTS のいずれか）
+            operation_type: 操作の種類（推論の場合は推論タイプ）
+            parameters: 操作のパラメータ
+            parse_failed: ルーターの出力を解析できず、"none" として扱った判定かどうか
+        """
+        self.intent = intent
+        self.operation_type = operation_type
+        self.parameters = parameters or {}
+        self.parse_failed = parse_failed
+    
+    @property
+    def label(self) -> str:
+        """
+        分類器のラベル（操作の種類がある意図は "意図:操作の種類"）
+        """
+        return f"{self.intent}:{self.operation_type}" if self.intent in OPERATION_TYPES else self.intent
+    
+    @classmethod
+    def from_label(cls, label: str, user_message: str) -> Optional["IntentDecision"]:
+        """
+        分類器のラベルから判定結果を作成する（パラメータをメッセージから作れないラベルの場合はNone）
+        """
+        if label not in LOCAL_LABELS:
+            return None
+        
+        intent, _, operation_type = label.partition(":")
+        if intent == "web_search":
+            parameters = {"query": user_message}
+        elif intent == "reasoning":
+            parameters = {"question": user_message, "detail_level": detect_detail_level(user_message)}
+        else:
+            parameters = {}
+        return cls(intent, operation_type, parameters)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "intent": self.intent,
+            "operation_type": self.operation_type,
+            "parameters": self.parameters,
+        }
+
+class IntentRouter:
+    """
+    ファイル操作・推論・Web検索・GitHub操作の意図を、1回のモデル呼び出しでまとめて判定するルーター
+    
+    意図ごとの検出器を順に呼ぶと、通常のチャットでも回答の前に最大4回の生成が行われる。
+    ルーターはすべての意図とパラメータを1つのJSONで返させ、temperature 0 と小さな最大トークン数で生成する。
+    学習済みの分類器（intent_classifier）がある場合は先にそれで判定し、確信度が閾値未満のときだけモデルを呼ぶ
+    """
+    _instance = None
+    
+    def __new__(cls):
+        """シングルトンパターンを使用"""
+        if cls._instance is None:
+            cls._instance = super(IntentRouter, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+    
+    def __init__(self):
+        """
+        IntentRouterを初期化する
+        """
+        if self._initialized:
+            return
+        
+        self._initialized = True
+        self.chat_model = get_chat_model()
+        self.max_tokens = settings.INTENT_ROUTER_MAX_TOKENS
+        self.threshold = settings.INTENT_CLASSIFIER_THRESHOLD
+        self.classifier = self._load_classifier()
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        
+        # ルーターの固定プロンプトはKVキャッシュを再利用する
+        self.chat_model.register_prompt_prefix(INTENT_ROUTER_PROMPT)
+        
+        # 統計情報
+        self.requests = 0
+        self.local_decisions = 0
+        self.model_calls = 0
+        self.model_seconds = 0.0
+        self.parse_failures = 0
+        self.intent_counts: Dict[str, int] = {intent: 0 for intent in INTENTS}
+    
+    @staticmethod
+    def _load_classifier() -> Optional[IntentClassifier]:
+        """
+        学習済みの分類器を読み込む（無効な場合や学習済みのファイルがない場合はNone）
+        """
+        if not settings.INTENT_CLASSIFIER_ENABLED or not os.path.exists(INTENT_CLASSIFIER_PATH):
+            return None
+        try:
+            classifier = IntentClassifier.load(INTENT_CLASSIFIER_PATH)
+        except Exception as e:
+            logger.error(f"意図の分類器の読み込み中にエラーが発生しました: {str(e)}")
+            return None
+        logger.info(f"意図の分類器を読み込みました（ラベル: {', '.join(classifier.labels)}）")
+        return classifier
+    
+    # 解析に失敗した判定は保存しない（次の同じメッセージではモデルで判定し直す）
+    @memoize_intent("router", cacheable=lambda decision: not decision.parse_failed)
+    @generation_call_site("intent")
+    def route(self, user_message: str) -> IntentDecision:
+        """
+        ユーザーメッセージの意図を判定する
+        
+        Args:
+            user_message: ユーザーのメッセージ
+        
+        Returns:
+            判定結果（判定できなかった場合は intent が "none"）
+        """
+        decision = None
+        
+        # 特殊な日付クエリのチェック
+        if any(keyword in user_message for keyword in DATE_KEYWORDS):
+            decision = IntentDecision("web_search", parameters={"query": "今日の日付"})
+        elif self.classifier is not None:
+            label, confidence = self.classifier.predict(user_message)
+            if confidence >= self.threshold:
+                decision = IntentDecision.from_label(label, user_message)
+            if decision is not None:
+                with self._lock:
+                    self.local_decisions += 1
+            else:
+                logger.debug(f"分類器の判定（{label}, 確信度: {confidence:.3f}）を使わず、モデルで判定します")
+        
+        if decision is None:
+            start_time = time.time()
+            response = self.chat_model.generate_response(
+                [
+                    # システムプロンプトは固定にしてKVキャッシュを再利用し、メッセージはユーザーのターンで1回だけ送る
+                    Message(role="system", content=INTENT_ROUTER_PROMPT),
+                    Message(role="user", content=user_message),
+                ],
+                max_tokens=self.max_tokens,
+                temperature=0.0,
+            )
+            seconds = time.time() - start_time
+            decision = self.parse(response, user_message)
+            
+            with self._lock:
+                self.model_calls += 1
+                self.model_seconds += seconds
+                if decision is None:
+                    self.parse_failures += 1
+            if decision is not None and settings.INTENT_LOG_ENABLED:
+                self._log_decision(user_message, decision, seconds)
+            decision = decision or IntentDecision(parse_failed=True)
+        
+        with self._lock:
+            self.requests += 1
+            self.intent_counts[decision.intent] += 1
+        
+        if decision.intent != "none":
+            logger.info(f"意図を判定: {decision.intent}, タイプ='{decision.operation_type}', パラメータ={decision.parameters}")
+        else:
+            logger.debug("ツールを使う意図なし")
+        return decision
+    
+    def parse(self, response: str, user_message: str) -> Optional[IntentDecision]:
+        """
+        ルーターの出力からJSONを取り出し、判定結果に変換する
+        
+        Returns:
+            判定結果（パースできない出力や、未知の意図・操作の種類の場合はNone）
+        """
+        result = None
+        json_match = re.search(r'\{.*\}', response, re.DOTALL)
+        if json_match:
+            json_str = json_match.group(0)
+            try:
+                result = json.loads(json_str)
+            except json.JSONDecodeError:
+                try:
+                    result = json.loads(get_reasoning_engine().clean_json_string(json_str))
+                except json.JSONDecodeError:
+                    result = None
+        
+        if not isinstance(result, dict):
+            logger.warning(f"意図の判定: JSONが見つかりませんでした: {response}")
+            return None
+        
+        intent = result.get("intent") or "none"
+        operation_type = result.get("operation_type") or ""
+        parameters = result.get("parameters")
+        if not isinstance(parameters, dict):
+            parameters = {}
+        
+        if intent not in INTENTS:
+            logger.warning(f"意図の判定: 不明な意図です: {intent}")
+            return None
+        if intent in OPERATION_TYPES and operation_type not in OPERATION_TYPES[intent]:
+            logger.warning(f"意図の判定: {intent} の不明な操作の種類です: {operation_type}")
+            return None
+        
+        if intent == "reasoning" and "detail_level" not in parameters:
+            # 詳細レベルが指定されていなければメッセージのキーワードから判定したものを適用
+            parameters["detail_level"] = detect_detail_level(user_message)
+        if intent == "web_search" and not parameters.get("query"):
+            return None
+        
+        return IntentDecision(intent, operation_type, parameters)
+    
+    def _log_decision(self, user_message: str, decision: IntentDecision, seconds: float) -> None:
+        """
+        モデルによる判定を分類器の学習データとして記録する
+        """
+        record = {"time": time.time(), "message": user_message, "label": decision.label, "seconds": round(seconds, 3)}
+        try:
+            with self._log_lock, open(INTENT_LOG_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except Exception as e:
+            logger.warning(f"意図の判定の記録中にエラーが発生しました: {str(e)}")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        判定回数、分類器で判定した割合、意図ごとの件数を返す
+        """
+        with self._lock:
+            return {
+                "enabled": settings.INTENT_ROUTER_ENABLED,
+                "classifier_loaded": self.classifier is not None,
+                "classifier_threshold": self.threshold,
+                "requests": self.requests,
+                "local_decisions": self.local_decisions,
+                "local_rate": round(self.local_decisions / self.requests, 4) if self.requests else 0.0,
+                "model_calls": self.model_calls,
+                "average_model_seconds": round(self.model_seconds / self.model_calls, 3) if self.model_calls else 0.0,
+                "intents": dict(self.intent_counts),
+                "parse_failures": self.parse_failures,
+            }
+
+class MessageIntents:
+    """
+    1件のユーザーメッセージについて、chat_completion の分岐の順に意図を問い合わせるためのクラス
+    
+    統合ルーターが有効な場合は最初の問い合わせで1回だけ判定してその結果を返し、
+    無効な場合は従来どおり意図ごとの検出器を呼ぶ。戻り値の形式は各検出器と同じ
+    """
+    
+    def __init__(self, user_message: str, router: Optional[IntentRouter] = None):
+        """
+        Args:
+            user_message: ユーザーのメッセージ
+            router: 統合ルーター（Noneの場合は意図ごとの検出器を使う）
+        """
+        self.user_message = user_message
+        self.router = router
+        self._decision: Optional[IntentDecision] = None
+    
+    async def decision(self) -> IntentDecision:
+        """
+        統合ルーターの判定結果を返す（最初の呼び出しでのみ判定する）
+        """
+        if self._decision is None:
+            self._decision = await asyncio.to_thread(self.router.route, self.user_message)
+        return self._decision
+    
+    async def file_operation(self) -> Tuple[bool, str, Dict[str, Any]]:
+        if self.router is None:
+            from .files_assistant import get_files_assistant
+            return await asyncio.to_thread(get_files_assistant().detect_file_operation, self.user_message)
+        return self._operation(await self.decision(), "file_operation")
+    
+    async def reasoning(self) -> Tuple[bool, str, Dict[str, Any]]:
+        if self.router is None:
+            from .smart_assistant import get_smart_assistant
+            return await asyncio.to_thread(get_smart_assistant().detect_reasoning_intent, self.user_message)
+        return self._operation(await self.decision(), "reasoning")
+    
+    async def web_search(self) -> Tuple[bool, str]:
+        if self.router is None:
+            from .smart_assistant import get_smart_assistant
+            return await asyncio.to_thread(get_smart_assistant().detect_web_search_intent, self.user_message)
+        decision = await self.decision()
+        if decision.intent != "web_search":
+            return False, ""
+        return True, decision.parameters.get("query", "")
+    
+    async def github_operation(self) -> Tuple[bool, str, Dict[str, Any]]:
+        if self.router is None:
+            from .smart_assistant import get_smart_assistant
+            return await asyncio.to_thread(get_smart_assistant().detect_github_operation_intent, self.user_message)
+        return self._operation(await self.decision(), "github_operation")
+    
+    @staticmethod
+    def _operation(decision: IntentDecision, intent: str) -> Tuple[bool, str, Dict[str, Any]]:
+        if decision.intent != intent:
+            return False, "", {}
+        return True, decision.operation_type, decision.parameters
+
+# シングルトンインスタンスを取得する関数
+def get_intent_router() -> IntentRouter:
+    """
+    IntentRouterのインスタンスを取得する
+    """
+    return IntentRouter()
+
+def get_message_intents(user_message: str) -> MessageIntents:
+    """
+    ユーザーメッセージの意図を問い合わせるオブジェクトを作成する（設定に応じて統合ルーターを使う）
+    """
+    return MessageIntents(user_message, get_intent_router() if settings.INTENT_ROUTER_ENABLED else None)
@@ -1,49 +1,82 @@
+import asyncio
 import logging
 from typing import Union, Any, Dict
 
 from ..core.config import settings
-from .gemma_model import get_gemma_model
-from .ollama_model import get_ollama_model
+from ..core.tokenizer import get_token_counter
+from ..core.metrics import generation_call_site
 
 logger = logging.getLogger(__name__)
 
+# 別の種類のバックエンドを副としてヘッジする場合のラッパー（最初の呼び出し時に作成）
+_hedged_model = None
+
+def _load_ollama_model():
+    from .ollama_model import get_ollama_model
+    
+    logger.info(f"Ollamaモデルを使用します: {settings.OLLAMA_MODEL_NAME}")
+    return get_ollama_model()
+
+def _load_gemma_model():
+    from .gemma_model import get_gemma_model
+    
+    logger.info(f"Hugging Faceモデルを使用します: {settings.HF_MODEL_ID}")
+    return get_gemma_model()
+
 def get_model():
     """
     設定に基づいて適切なモデルインスタンスを返す
     
+    バックエンドのモジュールは選択されたものだけを初回呼び出し時に読み込む
+    （Ollamaのみの構成では torch と transformers を読み込まない）
+    
     Returns:
         Hugging Face GemmaModel または Ollama Model のインスタンス
+        （HEDGE_SECONDARY に主と別の種類のバックエンドを指定した場合は、それを副としてヘッジする HedgedModel）
     """
-    if settings.USE_OLLAMA:
-        logger.info(f"Ollamaモデルを使用します: {settings.OLLAMA_MODEL_NAME}")
-        return get_ollama_model()
-    else:
-        logger.info(f"Hugging Faceモデルを使用します: {settings.HF_MODEL_ID}")
-        return get_gemma_model()
-
-# モデルのトークナイザーのモックアップ（Ollamaモデルには直接トークナイザーアクセスがないため）
-class DummyTokenizer:
-    """
-    Ollamaモデル用のダミートークナイザークラス
+    global _hedged_model
+    
+    if _hedged_model is not None:
+        return _hedged_model
+    
+    model = _load_ollama_model() if settings.USE_OLLAMA else _load_gemma_model()
+    
+    # 同じ種類のバックエンドの間のヘッジ（複数のOllamaインスタンス）はモデル自身が行う
+    secondary = "hf" if settings.USE_OLLAMA else "ollama"
+    if settings.HEDGE_ENABLED and settings.HEDGE_SECONDARY == secondary:
+        from .hedging import HedgePolicy, HedgedModel
+        
+        logger.info(f"最初のトークンが{settings.HEDGE_DELAY_SECONDS}秒以内に返らない場合は、{secondary} のモデルにも同じリクエストを送ります")
+        _hedged_model = HedgedModel(
+            model,
+            _load_gemma_model if secondary == "hf" else _load_ollama_model,
+            HedgePolicy(f"{'ollama' if settings.USE_OLLAMA else 'hf'}->{secondary}", settings.HEDGE_DELAY_SECONDS),
+        )
+        return _hedged_model
+    
+    return model
+
+async def warmup_model():
     """
-    def encode(self, text):
-        """
-        簡易的なトークン数推定（英語を想定）
-        """
-        if not text:
-            return []
-        # 非常に簡易的なトークン化（実際のトークナイザーとは異なります）
-        return text.split()
-
-def get_tokenizer():
+    起動時にモデルを読み込み、ウォームアップを実行する
     """
-    使用中のモデルに適したトークナイザーを返す
+    if not settings.MODEL_WARMUP_ON_STARTUP:
+        return
     
-    Returns:
-        トークナイザーオブジェクト
+    # モデルの初期化（接続確認や重みの読み込み）はブロッキングなのでワーカースレッドで行う
+    model = await asyncio.to_thread(get_model)
+    with generation_call_site("warmup"):
+        await model.warmup()
+    
+    # トークン数の計算に使うトークナイザーも最初のリクエスト前に読み込んでおく
+    await asyncio.to_thread(get_token_counter().load)
+
+async def close_model():
+    """
+    アプリケーション終了時にモデルが保持している接続を解放する
     """
-    if settings.USE_OLLAMA:
-        return DummyTokenizer()
-    else:
-        model = get_gemma_model()
-        return model.tokenizer
+    # ヘッジの副として使った場合も含め、作成済みのOllamaモデルの接続を閉じる
+    if settings.USE_OLLAMA or (settings.HEDGE_ENABLED and settings.HEDGE_SECONDARY == "ollama"):
+        from .ollama_model import close_ollama_model
+        
+        await close_ollama_model()
@@ -1,10 +1,16 @@
 import os
+import asyncio
 import logging
-import requests
 import json
-from typing import Dict, List, Optional, Union, Any, Tuple, Generator
+import numpy as np
+import time
+from typing import Dict, List, Optional, Union, Any, Tuple, Generator, AsyncGenerator
 
 from ..core.config import settings
+from ..core.embedding_cache import get_embedding_cache
+from ..core.metrics import GenerationTiming
+from .ollama_pool import OllamaBackend, OllamaBackendPool
+from .hedging import Attempt, HedgePolicy
 
 logger = logging.getLogger(__name__)
 
@@ -31,31 +37,171 @@ class OllamaModel:
             return
             
         self._initialized = True
-        self.base_url = settings.OLLAMA_BASE_URL
+        self.base_urls = settings.OLLAMA_BASE_URLS or [settings.OLLAMA_BASE_URL]
+        self.base_url = self.base_urls[0]
         self.model_name = settings.OLLAMA_MODEL_NAME
         
+        # インスタンスごとの接続（同期セッションと共有の非同期クライアント）と振り分け
+        self.pool = OllamaBackendPool(
+            self.base_urls,
+            health_check_interval=settings.OLLAMA_HEALTH_CHECK_INTERVAL,
+            affinity_slack=settings.OLLAMA_SESSION_AFFINITY_SLACK,
+            affinity_size=settings.OLLAMA_SESSION_AFFINITY_SIZE,
+        )
+        
+        # 最初のトークンが遅いインスタンスへのリクエストは、別のインスタンスにも送ってヘッジする
+        self.hedge: Optional[HedgePolicy] = None
+        if settings.HEDGE_ENABLED and settings.HEDGE_SECONDARY == "ollama" and len(self.base_urls) > 1:
+            self.hedge = HedgePolicy("ollama", settings.HEDGE_DELAY_SECONDS)
+        
+        # ウォームアップの状態
+        self.warm = False
+        self.warmup_seconds: Optional[float] = None
+        
         # Ollamaに接続できるか確認
         self._check_connection()
         
     def _check_connection(self):
         """
-        Ollamaに接続できるか確認する
+        各Ollamaインスタンスに接続できるか確認する
         """
-        try:
-            response = requests.get(f"{self.base_url}/api/tags")
-            if response.status_code == 200:
-                models = response.json().get("models", [])
-                model_names = [model.get("name") for model in models]
-                
-                if self.model_name in model_names:
-                    logger.info(f"Ollamaに接続し、モデル '{self.model_name}' を確認しました")
+        for backend in self.pool.backends:
+            try:
+                response = backend.session.get(f"{backend.url}/api/tags")
+                if response.status_code == 200:
+                    models = response.json().get("models", [])
+                    model_names = [model.get("name") for model in models]
+                    
+                    if self.model_name in model_names:
+                        logger.info(f"Ollamaに接続し、モデル '{self.model_name}' を確認しました: {backend.url}")
+                    else:
+                        logger.warning(f"モデル '{self.model_name}' がOllamaに見つかりません（{backend.url}）。利用可能なモデル: {model_names}")
                 else:
-                    logger.warning(f"モデル '{self.model_name}' がOllamaに見つかりません。利用可能なモデル: {model_names}")
-            else:
-                logger.warning(f"Ollamaサーバーからのレスポンスが異常です: {response.status_code}")
-        except Exception as e:
-            logger.error(f"Ollamaへの接続中にエラーが発生しました: {str(e)}")
-            logger.error(f"Ollamaサーバーが実行中であることを確認してください: {self.base_url}")
+                    logger.warning(f"Ollamaサーバーからのレスポンスが異常です（{backend.url}）: {response.status_code}")
+            except Exception as e:
+                logger.error(f"Ollamaへの接続中にエラーが発生しました: {str(e)}")
+                logger.error(f"Ollamaサーバーが実行中であることを確認してください: {backend.url}")
+                # 複数インスタンスの場合は、接続できないインスタンスをヘルスチェックが成功するまで使わない
+                if len(self.pool.backends) > 1:
+                    backend.healthy = False
+                    backend.last_error = str(e)
+            
+    def _build_options(
+        self,
+        max_tokens: Optional[int],
+        temperature: Optional[float],
+        top_p: Optional[float],
+        top_k: Optional[int],
+        stop: Optional[List[str]] = None,
+        seed: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Ollamaに送信するサンプリングオプションを組み立てる
+        
+        停止文字列はOllama側で判定され、見つかった時点で生成が止まる（出力には含まれない）
+        """
+        # デフォルト値の設定
+        max_tokens = max_tokens if max_tokens is not None else settings.MAX_NEW_TOKENS
+        temperature = temperature if temperature is not None else settings.DEFAULT_TEMPERATURE
+        top_p = top_p if top_p is not None else settings.DEFAULT_TOP_P
+        top_k = top_k if top_k is not None else settings.DEFAULT_TOP_K
+        
+        options = {
+            "num_predict": max_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+            "top_k": top_k,
+        }
+        if stop:
+            options["stop"] = stop
+        if seed is not None:
+            options["seed"] = seed
+        return options
+    
+    def _build_generate_params(
+        self,
+        prompt: str,
+        max_tokens: Optional[int],
+        temperature: Optional[float],
+        top_p: Optional[float],
+        top_k: Optional[int],
+        stream: bool,
+        stop: Optional[List[str]] = None,
+        seed: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        /api/generate に送信するリクエストパラメータを組み立てる
+        """
+        return {
+            "model": self.model_name,
+            "prompt": prompt,
+            "stream": stream,
+            "keep_alive": self._keep_alive(),
+            "options": self._build_options(max_tokens, temperature, top_p, top_k, stop, seed),
+        }
+    
+    def _build_chat_params(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: Optional[int],
+        temperature: Optional[float],
+        top_p: Optional[float],
+        top_k: Optional[int],
+        stream: bool,
+        stop: Optional[List[str]] = None,
+        seed: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        /api/chat に送信するリクエストパラメータを組み立てる
+        
+        メッセージを構造化したまま送ることで、Ollama側のチャットテンプレートが一度だけ適用され、
+        前回までの会話と共通するプレフィックスのKVキャッシュが再利用される
+        """
+        return {
+            "model": self.model_name,
+            "messages": messages,
+            "stream": stream,
+            "keep_alive": self._keep_alive(),
+            "options": self._build_options(max_tokens, temperature, top_p, top_k, stop, seed),
+        }
+    
+    @staticmethod
+    def _keep_alive() -> Union[str, int]:
+        """
+        リクエストに付与する keep_alive の値を返す
+        
+        Ollamaは数値（秒）と期間文字列（"30m" など）の両方を受け付けるため、数値のみの設定は整数に変換する
+        """
+        keep_alive = settings.OLLAMA_KEEP_ALIVE.strip()
+        try:
+            return int(keep_alive)
+        except ValueError:
+            return keep_alive
+    
+    @staticmethod
+    def _extract_text(data: Dict[str, Any]) -> Optional[str]:
+        """
+        /api/generate と /api/chat のレスポンスからテキスト部分を取り出す
+        """
+        if "response" in data:
+            return data["response"]
+        message = data.get("message")
+        if isinstance(message, dict):
+            return message.get("content", "")
+        return None
+    
+    async def aclose(self) -> None:
+        """
+        すべてのインスタンスの共有HTTPクライアントとセッションを閉じる
+        """
+        await self.pool.aclose()
+    
+    def register_prompt_prefix(self, system_prefix: str) -> None:
+        """
+        インターフェースをGemmaModelと揃えるためのメソッド
+        （Ollamaは直前のリクエストと共通するプレフィックスのKVキャッシュを自動で再利用する）
+        """
+        return None
             
     def generate_text(
         self,
@@ -65,6 +211,9 @@ class OllamaModel:
         top_p: float = None,
         top_k: int = None,
         stream: bool = False,
+        session_id: Optional[str] = None,
+        stop: Optional[List[str]] = None,
+        seed: Optional[int] = None,
     ) -> Union[str, Generator[str, None, None]]:
         """
         テキストを生成する
@@ -76,59 +225,94 @@ class OllamaModel:
             top_p: top-p サンプリングのパラメータ
             top_k: top-k サンプリングのパラメータ
             stream: ストリーミング生成を行うかどうか
+            session_id: セッションID（前回このセッションを処理したインスタンスを優先する）
+            stop: 生成を止める文字列のリスト（出力には含まれない）
+            seed: 乱数シード（指定した場合、同じ入力からは同じ出力を生成する）
             
         Returns:
             生成されたテキスト、またはストリーミングの場合はジェネレータ
         """
-        # デフォルト値の設定
-        max_tokens = max_tokens if max_tokens is not None else settings.MAX_NEW_TOKENS
-        temperature = temperature if temperature is not None else settings.DEFAULT_TEMPERATURE
-        top_p = top_p if top_p is not None else settings.DEFAULT_TOP_P
-        top_k = top_k if top_k is not None else settings.DEFAULT_TOP_K
-        
-        # リクエストパラメータ
-        params = {
-            "model": self.model_name,
-            "prompt": prompt,
-            "stream": stream,
-            "options": {
-                "num_predict": max_tokens,
-                "temperature": temperature,
-                "top_p": top_p,
-                "top_k": top_k,
-            }
-        }
+        params = self._build_generate_params(prompt, max_tokens, temperature, top_p, top_k, stream, stop, seed)
         
         # リクエストを送信
-        url = f"{self.base_url}/api/generate"
+        if stream:
+            return self._stream_response("/api/generate", params, session_id)
+        else:
+            return self._post_sync("/api/generate", params, session_id)
+    
+    def generate_chat(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = None,
+        temperature: float = None,
+        top_p: float = None,
+        top_k: int = None,
+        stream: bool = False,
+        session_id: Optional[str] = None,
+        stop: Optional[List[str]] = None,
+        seed: Optional[int] = None,
+    ) -> Union[str, Generator[str, None, None]]:
+        """
+        構造化されたメッセージから /api/chat で応答を生成する
+        
+        Args:
+            messages: {"role", "content"} 形式のメッセージのリスト
+            max_tokens: 生成する最大トークン数
+            temperature: 温度パラメータ
+            top_p: top-p サンプリングのパラメータ
+            top_k: top-k サンプリングのパラメータ
+            stream: ストリーミング生成を行うかどうか
+            session_id: セッションID（前回このセッションを処理したインスタンスを優先する）
+            stop: 生成を止める文字列のリスト（出力には含まれない）
+            seed: 乱数シード（指定した場合、同じ入力からは同じ出力を生成する）
+            
+        Returns:
+            生成されたテキスト、またはストリーミングの場合はジェネレータ
+        """
+        params = self._build_chat_params(messages, max_tokens, temperature, top_p, top_k, stream, stop, seed)
         
         if stream:
-            return self._stream_response(url, params)
+            return self._stream_response("/api/chat", params, session_id)
         else:
-            try:
-                response = requests.post(url, json=params)
+            return self._post_sync("/api/chat", params, session_id)
+    
+    def _post_sync(self, path: str, params: Dict[str, Any], session_id: Optional[str] = None) -> str:
+        """
+        非ストリーミングの生成リクエストを、選んだインスタンスに同期的に送信する
+        """
+        backend = self.pool.select(session_id)
+        timing = GenerationTiming("ollama")
+        try:
+            with self.pool.track(backend, session_id):
+                response = backend.session.post(f"{backend.url}{path}", json=params, timeout=settings.OLLAMA_REQUEST_TIMEOUT)
                 if response.status_code == 200:
-                    return response.json().get("response", "")
+                    data = response.json()
+                    self._fill_usage(data, None, timing)
+                    return self._extract_text(data) or ""
                 else:
                     logger.error(f"テキスト生成リクエストが失敗しました: {response.status_code}, {response.text}")
                     raise RuntimeError(f"テキスト生成リクエストが失敗しました: {response.status_code}")
-            except Exception as e:
-                logger.error(f"テキスト生成中にエラーが発生しました: {str(e)}")
-                raise
+        except Exception as e:
+            logger.error(f"テキスト生成中にエラーが発生しました: {str(e)}")
+            raise
     
-    def _stream_response(self, url: str, params: Dict[str, Any]) -> Generator[str, None, None]:
+    def _stream_response(self, path: str, params: Dict[str, Any], session_id: Optional[str] = None) -> Generator[str, None, None]:
         """
         ストリーミングレスポンスを処理する
         
         Args:
-            url: リクエストURL
+            path: リクエストのパス
             params: リクエストパラメータ
+            session_id: セッションID（インスタンスの選択に使う）
             
         Returns:
             テキストチャンクのジェネレータ
         """
+        backend = self.pool.select(session_id)
+        timing = GenerationTiming("ollama")
         try:
-            with requests.post(url, json=params, stream=True) as response:
+            with self.pool.track(backend, session_id), \
+                    backend.session.post(f"{backend.url}{path}", json=params, stream=True, timeout=settings.OLLAMA_REQUEST_TIMEOUT) as response:
                 if response.status_code != 200:
                     logger.error(f"ストリーミングリクエストが失敗しました: {response.status_code}, {response.text}")
                     raise RuntimeError(f"ストリーミングリクエストが失敗しました: {response.status_code}")
@@ -137,17 +321,31 @@ class OllamaModel:
                     if line:
                         try:
                             data = json.loads(line)
-                            if "response" in data:
-                                yield data["response"]
+                            self._fill_usage(data, None, timing)
+                            text = self._extract_text(data)
+                            if text:
+                                timing.mark_first_token()
+                            if text is not None:
+                                yield text
                         except json.JSONDecodeError:
                             logger.warning(f"JSON解析エラー: {line}")
         except Exception as e:
             logger.error(f"ストリーミング中にエラーが発生しました: {str(e)}")
             raise
             
+    def _build_embed_params(self, texts: List[str]) -> Dict[str, Any]:
+        """
+        /api/embed に送信するリクエストパラメータを組み立てる
+        """
+        return {
+            "model": self.model_name,
+            "input": texts,
+            "keep_alive": self._keep_alive(),
+        }
+    
     def get_embeddings(self, text: str) -> List[float]:
         """
-        テキストの埋め込みベクトルを取得する
+        テキストの埋め込みベクトルを取得する（同じテキストは埋め込みキャッシュから返す）
         
         Args:
             text: 入力テキスト
@@ -155,38 +353,410 @@ class OllamaModel:
         Returns:
             埋め込みベクトル
         """
-        url = f"{self.base_url}/api/embeddings"
-        params = {
-            "model": self.model_name,
-            "prompt": text
-        }
+        embeddings = get_embedding_cache().get_or_compute(self.model_name, [text], self._embed_sync)
+        return embeddings[0].tolist()
+    
+    def _embed_sync(self, texts: List[str]) -> np.ndarray:
+        """
+        /api/embed を同期的に呼び出し、キャッシュを通さずに埋め込みを計算する
+        """
+        params = self._build_embed_params(texts)
+        backend = self.pool.select()
         
         try:
-            response = requests.post(url, json=params)
-            if response.status_code == 200:
-                return response.json().get("embedding", [])
-            else:
-                logger.error(f"埋め込み生成リクエストが失敗しました: {response.status_code}, {response.text}")
-                raise RuntimeError(f"埋め込み生成リクエストが失敗しました: {response.status_code}")
+            with self.pool.track(backend):
+                response = backend.session.post(f"{backend.url}/api/embed", json=params, timeout=settings.OLLAMA_REQUEST_TIMEOUT)
+                if response.status_code == 200:
+                    embeddings = response.json().get("embeddings", [])
+                    if len(embeddings) != len(texts):
+                        raise RuntimeError(f"埋め込みの数が入力と一致しません: {len(embeddings)} != {len(texts)}")
+                    return np.asarray(embeddings, dtype=np.float32)
+                else:
+                    logger.error(f"埋め込み生成リクエストが失敗しました: {response.status_code}, {response.text}")
+                    raise RuntimeError(f"埋め込み生成リクエストが失敗しました: {response.status_code}")
+        except Exception as e:
+            logger.error(f"埋め込み生成中にエラーが発生しました: {str(e)}")
+            raise
+            
+    async def generate(
+        self,
+        prompt: str,
+        max_tokens: int = None,
+        temperature: float = None,
+        top_p: float = None,
+        top_k: int = None,
+        usage: Optional[Dict[str, int]] = None,
+        session_id: Optional[str] = None,
+        stop: Optional[List[str]] = None,
+        seed: Optional[int] = None,
+    ) -> str:
+        """
+        テキストを非同期に生成する
+        
+        Args:
+            prompt: 入力プロンプト
+            max_tokens: 生成する最大トークン数
+            temperature: 温度パラメータ
+            top_p: top-p サンプリングのパラメータ
+            top_k: top-k サンプリングのパラメータ
+            usage: 指定した場合、Ollamaが報告したトークン数（prompt_tokens, completion_tokens）と計測値（timing）を書き込む
+            session_id: セッションID（前回このセッションを処理したインスタンスを優先する）
+            stop: 生成を止める文字列のリスト（出力には含まれない）
+            seed: 乱数シード（指定した場合、同じ入力からは同じ出力を生成する）
+            
+        Returns:
+            生成されたテキスト
+        """
+        if self.hedge is not None:
+            # ヘッジは最初のトークンまでの時間で判定するため、ストリーミングで受け取って結合する
+            params = self._build_generate_params(prompt, max_tokens, temperature, top_p, top_k, True, stop, seed)
+            return await self.hedge.collect(*self._hedge_attempts("/api/generate", params, session_id), usage)
+        
+        params = self._build_generate_params(prompt, max_tokens, temperature, top_p, top_k, False, stop, seed)
+        return await self._apost("/api/generate", params, usage, session_id)
+    
+    async def stream(
+        self,
+        prompt: str,
+        max_tokens: int = None,
+        temperature: float = None,
+        top_p: float = None,
+        top_k: int = None,
+        usage: Optional[Dict[str, int]] = None,
+        session_id: Optional[str] = None,
+        stop: Optional[List[str]] = None,
+        seed: Optional[int] = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        テキストを非同期ストリーミングで生成する
+        
+        Args:
+            prompt: 入力プロンプト
+            max_tokens: 生成する最大トークン数
+            temperature: 温度パラメータ
+            top_p: top-p サンプリングのパラメータ
+            top_k: top-k サンプリングのパラメータ
+            usage: 指定した場合、Ollamaが報告したトークン数（prompt_tokens, completion_tokens）と計測値（timing）を書き込む
+            session_id: セッションID（前回このセッションを処理したインスタンスを優先する）
+            stop: 生成を止める文字列のリスト（出力には含まれない）
+            seed: 乱数シード（指定した場合、同じ入力からは同じ出力を生成する）
+            
+        Returns:
+            テキストチャンクの非同期ジェネレータ
+        """
+        params = self._build_generate_params(prompt, max_tokens, temperature, top_p, top_k, True, stop, seed)
+        if self.hedge is not None:
+            chunks = self.hedge.stream(*self._hedge_attempts("/api/generate", params, session_id), usage)
+        else:
+            chunks = self._astream("/api/generate", params, usage, session_id)
+        try:
+            async for text in chunks:
+                yield text
+        finally:
+            # 読み出し側が途中で終了した場合も、HTTPストリームをすぐに閉じてOllama側の生成を止める
+            await chunks.aclose()
+    
+    async def chat(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = None,
+        temperature: float = None,
+        top_p: float = None,
+        top_k: int = None,
+        usage: Optional[Dict[str, int]] = None,
+        session_id: Optional[str] = None,
+        stop: Optional[List[str]] = None,
+        seed: Optional[int] = None,
+    ) -> str:
+        """
+        構造化されたメッセージから /api/chat で応答を非同期に生成する
+        
+        Args:
+            messages: {"role", "content"} 形式のメッセージのリスト
+            max_tokens: 生成する最大トークン数
+            temperature: 温度パラメータ
+            top_p: top-p サンプリングのパラメータ
+            top_k: top-k サンプリングのパラメータ
+            usage: 指定した場合、Ollamaが報告したトークン数（prompt_tokens, completion_tokens）と計測値（timing）を書き込む
+            session_id: セッションID（前回このセッションを処理したインスタンスを優先する）
+            stop: 生成を止める文字列のリスト（出力には含まれない）
+            seed: 乱数シード（指定した場合、同じ入力からは同じ出力を生成する）
+            
+        Returns:
+            生成されたテキスト
+        """
+        if self.hedge is not None:
+            # ヘッジは最初のトークンまでの時間で判定するため、ストリーミングで受け取って結合する
+            params = self._build_chat_params(messages, max_tokens, temperature, top_p, top_k, True, stop, seed)
+            return await self.hedge.collect(*self._hedge_attempts("/api/chat", params, session_id), usage)
+        
+        params = self._build_chat_params(messages, max_tokens, temperature, top_p, top_k, False, stop, seed)
+        return await self._apost("/api/chat", params, usage, session_id)
+    
+    async def stream_chat(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = None,
+        temperature: float = None,
+        top_p: float = None,
+        top_k: int = None,
+        usage: Optional[Dict[str, int]] = None,
+        session_id: Optional[str] = None,
+        stop: Optional[List[str]] = None,
+        seed: Optional[int] = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        構造化されたメッセージから /api/chat で応答を非同期ストリーミングで生成する
+        
+        Args:
+            messages: {"role", "content"} 形式のメッセージのリスト
+            max_tokens: 生成する最大トークン数
+            temperature: 温度パラメータ
+            top_p: top-p サンプリングのパラメータ
+            top_k: top-k サンプリングのパラメータ
+            usage: 指定した場合、Ollamaが報告したトークン数（prompt_tokens, completion_tokens）と計測値（timing）を書き込む
+            session_id: セッションID（前回このセッションを処理したインスタンスを優先する）
+            stop: 生成を止める文字列のリスト（出力には含まれない）
+            seed: 乱数シード（指定した場合、同じ入力からは同じ出力を生成する）
+            
+        Returns:
+            テキストチャンクの非同期ジェネレータ
+        """
+        params = self._build_chat_params(messages, max_tokens, temperature, top_p, top_k, True, stop, seed)
+        if self.hedge is not None:
+            chunks = self.hedge.stream(*self._hedge_attempts("/api/chat", params, session_id), usage)
+        else:
+            chunks = self._astream("/api/chat", params, usage, session_id)
+        try:
+            async for text in chunks:
+                yield text
+        finally:
+            # 読み出し側が途中で終了した場合も、HTTPストリームをすぐに閉じてOllama側の生成を止める
+            await chunks.aclose()
+    
+    @staticmethod
+    def _fill_usage(data: Dict[str, Any], usage: Optional[Dict[str, Any]], timing: GenerationTiming) -> None:
+        """
+        最終レスポンスに含まれる処理時間を計測値として記録し、トークン数と合わせて usage に書き込む
+        """
+        if not data.get("done"):
+            return
+        result = timing.finish_ollama(data)
+        if usage is None:
+            return
+        usage["prompt_tokens"] = data.get("prompt_eval_count", 0)
+        usage["completion_tokens"] = data.get("eval_count", 0)
+        usage["timing"] = result
+    
+    async def _apost(
+        self,
+        path: str,
+        params: Dict[str, Any],
+        usage: Optional[Dict[str, int]] = None,
+        session_id: Optional[str] = None,
+        backend: Optional[OllamaBackend] = None,
+    ) -> str:
+        """
+        非ストリーミングの生成リクエストを、選んだインスタンスの共有クライアントで送信する
+        （backend を指定した場合はそのインスタンスに送る）
+        """
+        backend = backend or self.pool.select(session_id)
+        timing = GenerationTiming("ollama")
+        try:
+            with self.pool.track(backend, session_id):
+                response = await backend.get_client().post(path, json=params)
+                if response.status_code == 200:
+                    data = response.json()
+                    self._fill_usage(data, usage, timing)
+                    return self._extract_text(data) or ""
+                else:
+                    logger.error(f"テキスト生成リクエストが失敗しました: {response.status_code}, {response.text}")
+                    raise RuntimeError(f"テキスト生成リクエストが失敗しました: {response.status_code}")
+        except Exception as e:
+            logger.error(f"テキスト生成中にエラーが発生しました: {str(e)}")
+            raise
+    
+    async def _astream(
+        self,
+        path: str,
+        params: Dict[str, Any],
+        usage: Optional[Dict[str, int]] = None,
+        session_id: Optional[str] = None,
+        backend: Optional[OllamaBackend] = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        ストリーミングレスポンスを、選んだインスタンスの共有クライアントで処理する
+        （backend を指定した場合はそのインスタンスに送る）
+        """
+        backend = backend or self.pool.select(session_id)
+        timing = GenerationTiming("ollama")
+        try:
+            with self.pool.track(backend, session_id):
+                async with backend.get_client().stream("POST", path, json=params) as response:
+                    if response.status_code != 200:
+                        body = await response.aread()
+                        logger.error(f"ストリーミングリクエストが失敗しました: {response.status_code}, {body.decode(errors='replace')}")
+                        raise RuntimeError(f"ストリーミングリクエストが失敗しました: {response.status_code}")
+                
+                    async for line in response.aiter_lines():
+                        if line:
+                            try:
+                                data = json.loads(line)
+                                self._fill_usage(data, usage, timing)
+                                text = self._extract_text(data)
+                                if text:
+                                    timing.mark_first_token()
+                                if text is not None:
+                                    yield text
+                            except json.JSONDecodeError:
+                                logger.warning(f"JSON解析エラー: {line}")
+        except Exception as e:
+            logger.error(f"ストリーミング中にエラーが発生しました: {str(e)}")
+            raise
+    
+    def _hedge_attempts(self, path: str, params: Dict[str, Any], session_id: Optional[str]) -> Tuple[Attempt, Attempt]:
+        """
+        ヘッジで競わせる、主のインスタンスと別のインスタンスへのストリーミングリクエストを作成する
+        （別のインスタンスはヘッジを始める時点の処理中の件数で選ぶ）
+        """
+        primary = self.pool.select(session_id)
+        
+        def primary_attempt(usage: Dict[str, int]) -> AsyncGenerator[str, None]:
+            return self._astream(path, params, usage, session_id, backend=primary)
+        
+        def secondary_attempt(usage: Dict[str, int]) -> AsyncGenerator[str, None]:
+            return self._astream(path, params, usage, session_id, backend=self.pool.select(session_id, exclude=primary))
+        
+        return primary_attempt, secondary_attempt
+    
+    async def embed(self, text: str) -> List[float]:
+        """
+        テキストの埋め込みベクトルを非同期に取得する
+        
+        Args:
+            text: 入力テキスト
+            
+        Returns:
+            埋め込みベクトル
+        """
+        embeddings = await self.embed_batch([text])
+        return embeddings[0].tolist()
+    
+    async def embed_batch(self, texts: List[str]) -> np.ndarray:
+        """
+        複数テキストの埋め込みベクトルを /api/embed の1回の呼び出しで取得する
+        （キャッシュにないテキストのみ計算する）
+        
+        Args:
+            texts: 入力テキストのリスト
+            
+        Returns:
+            (テキスト数, 次元数) のfloat32配列
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        
+        # 計算済みのテキストはキャッシュから返し、残りだけをOllamaに送る
+        return await get_embedding_cache().aget_or_compute(self.model_name, texts, self._aembed)
+    
+    async def _aembed(self, texts: List[str]) -> np.ndarray:
+        """
+        /api/embed を非同期に呼び出し、キャッシュを通さずに埋め込みを計算する
+        """
+        backend = self.pool.select()
+        
+        try:
+            with self.pool.track(backend):
+                response = await backend.get_client().post("/api/embed", json=self._build_embed_params(texts))
+                if response.status_code == 200:
+                    embeddings = response.json().get("embeddings", [])
+                    if len(embeddings) != len(texts):
+                        raise RuntimeError(f"埋め込みの数が入力と一致しません: {len(embeddings)} != {len(texts)}")
+                    return np.asarray(embeddings, dtype=np.float32)
+                else:
+                    logger.error(f"埋め込み生成リクエストが失敗しました: {response.status_code}, {response.text}")
+                    raise RuntimeError(f"埋め込み生成リクエストが失敗しました: {response.status_code}")
         except Exception as e:
             logger.error(f"埋め込み生成中にエラーが発生しました: {str(e)}")
             raise
             
+    async def warmup(self) -> bool:
+        """
+        モデルをメモリに読み込み、小さな生成を1回実行する
+        
+        最初のリクエストがモデルの読み込み時間を負担しないよう、起動時に呼び出される。
+        複数のインスタンスがある場合はすべてで並行して実行する
+        
+        Returns:
+            ウォームアップに1つ以上のインスタンスで成功したかどうか
+        """
+        params = self._build_generate_params("こんにちは", 1, 0.0, None, None, False)
+        start_time = time.time()
+        
+        logger.info(f"モデル '{self.model_name}' のウォームアップを開始します")
+        results = await asyncio.gather(
+            *(self._apost("/api/generate", params, backend=backend) for backend in self.pool.backends),
+            return_exceptions=True,
+        )
+        
+        for backend, result in zip(self.pool.backends, results):
+            if isinstance(result, Exception):
+                logger.error(f"モデルのウォームアップ中にエラーが発生しました（{backend.url}）: {str(result)}")
+        
+        self.warm = any(not isinstance(result, Exception) for result in results)
+        if self.warm:
+            self.warmup_seconds = round(time.time() - start_time, 2)
+            logger.info(f"モデル '{self.model_name}' のウォームアップが完了しました（{self.warmup_seconds}秒）")
+        
+        return self.warm
+    
+    def get_load_state(self) -> Optional[Dict[str, Any]]:
+        """
+        /api/ps から、モデルが現在メモリに読み込まれているかとその使用メモリを取得する
+        
+        複数のインスタンスがある場合は、正常なインスタンスのうち最初に読み込まれているものの情報を返す
+        
+        Returns:
+            読み込まれている場合はメモリ情報の辞書、読み込まれていない場合はNone
+        """
+        backends = [backend for backend in self.pool.backends if backend.healthy] or self.pool.backends
+        for backend in backends:
+            response = backend.session.get(f"{backend.url}/api/ps", timeout=10)
+            if response.status_code != 200:
+                raise RuntimeError(f"Ollamaサーバーからのレスポンスが異常です: {response.status_code}")
+            
+            for model in response.json().get("models", []):
+                if self.model_name in (model.get("name"), model.get("model")):
+                    return {
+                        "size": model.get("size"),
+                        "size_vram": model.get("size_vram"),
+                        "expires_at": model.get("expires_at"),
+                        "url": backend.url,
+                    }
+        
+        # 一定時間使われずにアンロードされた場合は、次のウォームアップまでコールド扱いにする
+        self.warm = False
+        return None
+    
     def get_model_info(self) -> Dict[str, Any]:
         """
         モデルの情報を返す
         
+        statusはモデルが実際にメモリに読み込まれているか（/api/ps）を表す
+        
         Returns:
             モデル情報の辞書
         """
         try:
-            response = requests.get(f"{self.base_url}/api/tags")
+            backend = self.pool.select()
+            response = backend.session.get(f"{backend.url}/api/tags")
             if response.status_code == 200:
                 models = response.json().get("models", [])
                 for model in models:
                     if model.get("name") == self.model_name:
+                        memory = self.get_load_state()
                         return {
-                            "status": "loaded",
+                            "status": "loaded" if memory else "not_loaded",
                             "model_id": self.model_name,
                             "model_type": "Ollama",
                             "tokenizer_type": "Ollama",
@@ -194,13 +764,19 @@ class OllamaModel:
                             "parameters": {
                                 "size": model.get("size", "Unknown"),
                                 "modified_at": model.get("modified_at", "Unknown"),
-                            }
+                                "keep_alive": settings.OLLAMA_KEEP_ALIVE,
+                                "warmup_seconds": self.warmup_seconds,
+                                "backends": self.pool.get_stats(),
+                            },
+                            "warm": self.warm and memory is not None,
+                            "memory": memory,
                         }
                 
                 return {
                     "status": "not_loaded",
                     "model_id": self.model_name,
                     "model_type": "Ollama",
+                    "warm": False,
                 }
             else:
                 return {
@@ -214,7 +790,27 @@ class OllamaModel:
                 "model_id": self.model_name,
                 "error": f"Ollamaへの接続中にエラーが発生しました: {str(e)}"
             }
+    
+    def get_backend_stats(self) -> List[Dict[str, Any]]:
+        """
+        Ollamaインスタンスごとの状態と統計情報を返す
+        """
+        return self.pool.get_stats()["backends"]
+    
+    def get_hedge_stats(self) -> Optional[Dict[str, Any]]:
+        """
+        ヘッジの統計情報を返す（ヘッジが無効な場合はNone）
+        """
+        return self.hedge.get_stats() if self.hedge is not None else None
 
 # シングルトンインスタンスを取得する関数
 def get_ollama_model() -> OllamaModel:
     return OllamaModel()
+
+async def close_ollama_model() -> None:
+    """
+    作成済みのOllamaモデルがあれば、その接続を閉じる
+    """
+    instance = OllamaModel._instance
+    if instance is not None and getattr(instance, "_initialized", False):
+        await instance.aclose()
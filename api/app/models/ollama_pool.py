@@ -0,0 +1,260 @@
+import logging
+import threading
+import time
+import httpx
+import requests
+from collections import OrderedDict
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+from typing import Dict, List, Optional, Any, Iterator
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 接続できないことを示すエラー（発生したインスタンスはすぐにルーティング対象から外す）
+CONNECTION_ERRORS = (httpx.TransportError, requests.ConnectionError, requests.Timeout)
+
+class OllamaBackend:
+    """
+    1つのOllamaインスタンスへの接続と状態
+    """
+    
+    def __init__(self, url: str):
+        """
+        Args:
+            url: OllamaインスタンスのベースURL
+        """
+        self.url = url.rstrip("/")
+        
+        # 同期呼び出し用のキープアライブ付きセッション
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=settings.OLLAMA_MAX_CONNECTIONS,
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        
+        # 非同期呼び出し用の共有クライアント（最初の使用時に作成）
+        self._client: Optional[httpx.AsyncClient] = None
+        
+        self.healthy = True
+        self.outstanding = 0
+        self.last_error: Optional[str] = None
+        self.last_checked: Optional[float] = None
+        
+        # 統計情報
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+        self.busy_seconds = 0.0
+    
+    def get_client(self) -> httpx.AsyncClient:
+        """
+        このインスタンス用の共有の非同期HTTPクライアントを取得する
+        
+        すべての非同期リクエストは同じコネクションプールを使い回すため、
+        リクエストごとのTCP接続確立が発生しない
+        """
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.url,
+                timeout=httpx.Timeout(settings.OLLAMA_REQUEST_TIMEOUT, connect=10.0),
+                limits=httpx.Limits(
+                    max_connections=settings.OLLAMA_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.OLLAMA_MAX_KEEPALIVE_CONNECTIONS,
+                ),
+            )
+        return self._client
+    
+    async def aclose(self) -> None:
+        """
+        共有HTTPクライアントとセッションを閉じる
+        """
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+        self.session.close()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        インスタンスの状態と統計情報を返す
+        """
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejections": self.ejections,
+            "average_seconds": round(self.busy_seconds / self.requests, 3) if self.requests else 0.0,
+            "last_error": self.last_error,
+            "last_checked": self.last_checked,
+        }
+
+class OllamaBackendPool:
+    """
+    複数のOllamaインスタンスにリクエストを振り分けるプール
+    
+    処理中のリクエストが最も少ないインスタンスを選ぶ。ただしセッションを前回処理したインスタンスは、
+    処理中の件数の差が affinity_slack 以内なら優先し、そのインスタンスに残っている会話のKVキャッシュを使わせる。
+    接続できなかったインスタンスとヘルスチェックに失敗したインスタンスは対象から外し、
+    ヘルスチェックまたはリクエストが成功したら戻す
+    """
+    
+    def __init__(self, urls: List[str], health_check_interval: float, affinity_slack: int, affinity_size: int):
+        """
+        Args:
+            urls: OllamaインスタンスのベースURLのリスト
+            health_check_interval: ヘルスチェックの間隔（秒、0以下の場合は行わない）
+            affinity_slack: セッションの前回のインスタンスを優先する、処理中の件数の差の上限
+            affinity_size: インスタンスを記録しておくセッションの最大数
+        """
+        if not urls:
+            raise RuntimeError("OllamaのURLが指定されていません")
+        
+        self.backends = [OllamaBackend(url) for url in urls]
+        self.health_check_interval = health_check_interval
+        self.affinity_slack = max(0, affinity_slack)
+        self.affinity_size = max(0, affinity_size)
+        
+        self._lock = threading.Lock()
+        self._affinity: "OrderedDict[str, OllamaBackend]" = OrderedDict()
+        self._next = 0
+        
+        # 統計情報
+        self.affinity_hits = 0
+        self.affinity_misses = 0
+        
+        # インスタンスが1つの場合は振り分け先がないため、定期的なヘルスチェックは行わない
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        if len(self.backends) > 1 and health_check_interval > 0:
+            self._thread = threading.Thread(target=self._health_loop, name="ollama-health-check", daemon=True)
+            self._thread.start()
+    
+    def select(self, session_id: Optional[str] = None, exclude: Optional[OllamaBackend] = None) -> OllamaBackend:
+        """
+        リクエストを送るインスタンスを選ぶ
+        
+        Args:
+            session_id: セッションID（指定した場合は前回のインスタンスを優先する）
+            exclude: 選ばないインスタンス（ヘッジで主のインスタンス以外に送る場合など、他にインスタンスがある場合のみ除く）
+        
+        Returns:
+            選ばれたインスタンス（正常なインスタンスがない場合は全インスタンスから選ぶ）
+        """
+        with self._lock:
+            backends = [backend for backend in self.backends if backend is not exclude] or self.backends
+            candidates = [backend for backend in backends if backend.healthy] or backends
+            least = min(backend.outstanding for backend in candidates)
+            
+            if session_id:
+                preferred = self._affinity.get(session_id)
+                if preferred is not None and preferred in candidates and preferred.outstanding <= least + self.affinity_slack:
+                    self.affinity_hits += 1
+                    return preferred
+                self.affinity_misses += 1
+            
+            # 処理中の件数が同じインスタンスが複数ある場合は順番に使う
+            tied = [backend for backend in candidates if backend.outstanding == least]
+            self._next += 1
+            return tied[self._next % len(tied)]
+    
+    @contextmanager
+    def track(self, backend: OllamaBackend, session_id: Optional[str] = None) -> Iterator[OllamaBackend]:
+        """
+        インスタンスへのリクエストの間、処理中の件数を数え、結果を記録する
+        
+        接続できなかった場合はインスタンスをルーティング対象から外す。
+        成功した場合はインスタンスを戻し、セッションとの対応を記録する
+        """
+        start_time = time.time()
+        with self._lock:
+            backend.outstanding += 1
+            backend.requests += 1
+        try:
+            yield backend
+        except Exception as e:
+            with self._lock:
+                backend.failures += 1
+                backend.last_error = str(e)
+            if isinstance(e, CONNECTION_ERRORS):
+                self._eject(backend, str(e))
+            raise
+        else:
+            with self._lock:
+                if not backend.healthy:
+                    logger.info(f"Ollamaインスタンス {backend.url} へのリクエストが成功したため、ルーティング対象に戻します")
+                backend.healthy = True
+                if session_id and self.affinity_size:
+                    self._affinity[session_id] = backend
+                    self._affinity.move_to_end(session_id)
+                    while len(self._affinity) > self.affinity_size:
+                        self._affinity.popitem(last=False)
+        finally:
+            with self._lock:
+                backend.outstanding -= 1
+                backend.busy_seconds += time.time() - start_time
+    
+    def _eject(self, backend: OllamaBackend, reason: str) -> None:
+        """
+        インスタンスをルーティング対象から外す
+        """
+        with self._lock:
+            if not backend.healthy:
+                return
+            backend.healthy = False
+            backend.ejections += 1
+            backend.last_error = reason
+        logger.warning(f"Ollamaインスタンス {backend.url} をルーティング対象から外しました: {reason}")
+    
+    def check_health(self) -> None:
+        """
+        すべてのインスタンスに /api/tags を問い合わせ、結果に応じてルーティング対象から外す・戻す
+        """
+        for backend in self.backends:
+            try:
+                response = backend.session.get(f"{backend.url}/api/tags", timeout=5)
+                if response.status_code != 200:
+                    raise RuntimeError(f"ヘルスチェックのレスポンスが異常です: {response.status_code}")
+                backend.last_checked = time.time()
+                if not backend.healthy:
+                    with self._lock:
+                        backend.healthy = True
+                    logger.info(f"Ollamaインスタンス {backend.url} がヘルスチェックに成功したため、ルーティング対象に戻します")
+            except Exception as e:
+                backend.last_checked = time.time()
+                self._eject(backend, str(e))
+    
+    def _health_loop(self) -> None:
+        """
+        ヘルスチェックを一定間隔で実行するワーカースレッドのループ
+        """
+        while not self._stop.wait(self.health_check_interval):
+            try:
+                self.check_health()
+            except Exception as e:
+                logger.error(f"Ollamaのヘルスチェック中にエラーが発生しました: {str(e)}")
+    
+    async def aclose(self) -> None:
+        """
+        ヘルスチェックを止め、すべてのインスタンスの接続を閉じる
+        """
+        self._stop.set()
+        for backend in self.backends:
+            await backend.aclose()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        インスタンスごとの状態と統計情報を返す
+        """
+        with self._lock:
+            return {
+                "backends": [backend.get_stats() for backend in self.backends],
+                "healthy": sum(1 for backend in self.backends if backend.healthy),
+                "sessions": len(self._affinity),
+                "affinity_hits": self.affinity_hits,
+                "affinity_misses": self.affinity_misses,
+            }
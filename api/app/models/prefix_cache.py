@@ -0,0 +1,177 @@
+import logging
+import threading
+import numpy as np
+import torch
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any, Tuple
+
+from .batch_scheduler import to_legacy_cache, from_legacy_cache
+
+logger = logging.getLogger(__name__)
+
+class PrefixKVCache:
+    """
+    登録したプロンプトの先頭部分（システムプロンプトなど）のKVキャッシュを保持するクラス
+    
+    登録時にはトークン化だけを行い、KVキャッシュは最初に一致したプロンプトの処理時に計算する。
+    入力プロンプトと最も長く一致する登録済みプレフィックスのKVキャッシュを返すので、
+    呼び出し側は残りの部分だけをプレフィルすればよい。
+    保持するKVキャッシュの合計サイズは max_bytes までで、超えた場合は最も古く使われたものから破棄する
+    """
+    
+    def __init__(self, model: Any, tokenizer: Any, max_bytes: int, min_tokens: int):
+        """
+        Args:
+            model: Hugging Face の CausalLM モデル
+            tokenizer: モデルのトークナイザー
+            max_bytes: 保持するKVキャッシュの合計サイズの上限（バイト）
+            min_tokens: 再利用する一致部分の最小トークン数
+        """
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_bytes = max(0, max_bytes)
+        self.min_tokens = max(1, min_tokens)
+        
+        self._lock = threading.Lock()
+        self._registered: Dict[Tuple[int, ...], str] = {}
+        self._entries: "OrderedDict[Tuple[int, ...], Tuple[Tuple, int]]" = OrderedDict()
+        self._bytes = 0
+        
+        # 統計情報
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+        self.computed = 0
+        self.evictions = 0
+    
+    def register(self, text: str) -> bool:
+        """
+        プロンプトの先頭部分を登録する（同じテキストの再登録は無視する）
+        
+        Args:
+            text: プロンプトの先頭に来るテキスト（チャットテンプレート適用後の形式）
+        
+        Returns:
+            登録されたかどうか（min_tokens より短い場合は登録しない）
+        """
+        ids = tuple(self.tokenizer(text)["input_ids"])
+        if len(ids) < self.min_tokens:
+            return False
+        
+        with self._lock:
+            if ids not in self._registered:
+                self._registered[ids] = text
+                logger.info(f"プレフィックスを登録しました（{len(ids)}トークン）")
+        return True
+    
+    def lookup(self, input_ids: List[int]) -> Tuple[Optional[Tuple], int]:
+        """
+        入力と最も長く一致する登録済みプレフィックスのKVキャッシュを返す
+        
+        最後のトークンは次トークンの予測に必要なため、一致部分は入力より1トークン以上短くする
+        
+        Args:
+            input_ids: 入力プロンプトのトークンID
+        
+        Returns:
+            一致部分の (key, value) タプル形式のKVキャッシュと一致したトークン数のタプル。
+            一致しない場合は (None, 0)
+        """
+        with self._lock:
+            key, length = self._find_longest_match(input_ids)
+            if key is None:
+                self.misses += 1
+                return None, 0
+            
+            past = self._get_entry(key)
+            self.hits += 1
+            self.reused_tokens += length
+        
+        if length < len(key):
+            past = tuple(tuple(tensor[:, :, :length, :] for tensor in layer) for layer in past)
+        return past, length
+    
+    def _find_longest_match(self, input_ids: List[int]) -> Tuple[Optional[Tuple[int, ...]], int]:
+        """
+        入力との共通部分が最も長い登録済みプレフィックスと、その共通部分のトークン数を求める
+        """
+        best_key, best_length = None, 0
+        if not input_ids:
+            return best_key, best_length
+        
+        target = np.asarray(input_ids)
+        for ids in self._registered:
+            n = min(len(ids), len(target) - 1)
+            if n <= best_length:
+                continue
+            mismatch = np.flatnonzero(np.asarray(ids[:n]) != target[:n])
+            length = int(mismatch[0]) if mismatch.size else n
+            if length > best_length:
+                best_key, best_length = ids, length
+        
+        if best_length < self.min_tokens:
+            return None, 0
+        return best_key, best_length
+    
+    def _get_entry(self, key: Tuple[int, ...]) -> Tuple:
+        """
+        登録済みプレフィックスのKVキャッシュを返す（未計算または破棄済みの場合は計算する）
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            return entry[0]
+        
+        input_ids = torch.tensor([key], dtype=torch.long, device=self.model.device)
+        with torch.no_grad():
+            outputs = self.model(
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                # スライディングウィンドウ層も含め全層のKVを保持し、任意の長さの入力に続けられるようにする
+                past_key_values=from_legacy_cache(()),
+                use_cache=True,
+            )
+        past = to_legacy_cache(outputs.past_key_values)
+        size = sum(tensor.numel() * tensor.element_size() for layer in past for tensor in layer)
+        self.computed += 1
+        
+        if size > self.max_bytes:
+            # 保持できないプレフィックスは毎回の再計算を避けるため登録から外す（今回の計算結果は使う）
+            logger.warning(f"プレフィックスのKVキャッシュ（{size}バイト）が上限（{self.max_bytes}バイト）を超えるため登録を解除します")
+            del self._registered[key]
+            return past
+        
+        while self._entries and self._bytes + size > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+        
+        self._entries[key] = (past, size)
+        self._bytes += size
+        return past
+    
+    def clear(self) -> None:
+        """
+        保持しているKVキャッシュを破棄する（登録は残す）
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        プレフィックスキャッシュの統計情報を返す
+        """
+        lookups = self.hits + self.misses
+        return {
+            "registered": len(self._registered),
+            "cached": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "reused_tokens": self.reused_tokens,
+            "computed": self.computed,
+            "evictions": self.evictions,
+        }
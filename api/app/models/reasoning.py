@@ -5,9 +5,53 @@ from typing import Dict, List, Any, Optional, Tuple, Union
 
 from .chat_model import get_chat_model, Message
 from ..core.config import settings
+from ..core.metrics import generation_call_site
+from ..core.intent_cache import FailedDetection, detection_succeeded, memoize_intent
 
 logger = logging.getLogger(__name__)
 
+# 推論意図の検出プロンプト（ユーザーメッセージは末尾に追加し、共通部分のKVキャッシュを再利用できるようにする）
+REASONING_DETECT_PROMPT = """あなたはユーザーメッセージから推論の意図を特定するアシスタントです。
+以下のメッセージから推論の意図を検出し、JSONフォーマットで返してください。
+
+以下のような表現が推論意図を示します:
+1. ステップバイステップで考えてほしい要求
+2. 理由を説明してほしい要求
+3. 論理的分析や証明を求める表現
+4. オプションの比較や評価を求める表現
+5. 文の真偽の評価を求める表現
+
+必ず以下のJSON形式で出力してください。すべてのプロパティ名はダブルクォーテーション（"）で囲んでください：
+{
+  "is_reasoning_intent": true/false,
+  "reasoning_type": "step_by_step/evaluate_statement/compare_options",
+  "parameters": {
+    "question": "推論のための質問・問題",
+    "context": "追加コンテキスト（あれば）",
+    "detail_level": "low/medium/high",
+    "options": ["選択肢1", "選択肢2"] // compare_optionsの場合のみ
+  }
+}
+"""
+
+# 詳細レベルキーワード
+DETAIL_KEYWORDS = {
+    "詳しく": "high",
+    "詳細に": "high",
+    "簡潔に": "low",
+    "簡単に": "low",
+    "要点だけ": "low"
+}
+
+def detect_detail_level(user_message: str) -> str:
+    """
+    ユーザーメッセージのキーワードから推論の詳細レベルを判定する（該当しない場合は "medium"）
+    """
+    for keyword, level in DETAIL_KEYWORDS.items():
+        if keyword in user_message:
+            return level
+    return "medium"
+
 class ReasoningEngine:
     """
     推論エンジンクラス
@@ -31,6 +75,7 @@ class ReasoningEngine:
             
         self._initialized = True
         self.chat_model = get_chat_model()
+        self.chat_model.register_prompt_prefix(REASONING_DETECT_PROMPT)
         logger.info("ReasoningEngine: 初期化完了")
     
     def clean_json_string(self, json_str: str) -> str:
@@ -63,6 +108,7 @@ class ReasoningEngine:
         
         return json_str
 
+    @generation_call_site("reasoning")
     def perform_step_by_step_reasoning(self, 
                                        question: str, 
                                        context: Optional[str] = None,
@@ -129,6 +175,9 @@ class ReasoningEngine:
 現在の日付: {settings.CURRENT_DATE if hasattr(settings, 'CURRENT_DATE') else "不明"}
 """
 
+        # システムプロンプトは詳細レベルごとに同じ内容になるため、KVキャッシュを再利用する
+        self.chat_model.register_prompt_prefix(system_prompt)
+        
         # メッセージの準備
         messages = [Message(role="system", content=system_prompt)]
         
@@ -210,6 +259,7 @@ class ReasoningEngine:
                 "reasoning_quality": "low"
             }
     
+    @generation_call_site("reasoning")
     def evaluate_statement(self, 
                            statement: str, 
                            context: Optional[str] = None,
@@ -274,6 +324,9 @@ class ReasoningEngine:
 現在の日付: {settings.CURRENT_DATE if hasattr(settings, 'CURRENT_DATE') else "不明"}
 """
 
+        # システムプロンプトは詳細レベルごとに同じ内容になるため、KVキャッシュを再利用する
+        self.chat_model.register_prompt_prefix(system_prompt)
+        
         # メッセージの準備
         messages = [Message(role="system", content=system_prompt)]
         
@@ -345,6 +398,7 @@ class ReasoningEngine:
                 "conclusion": "評価に失敗しました。もう一度お試しください。"
             }
     
+    @generation_call_site("reasoning")
     def compare_options(self, 
                         question: str, 
                         options: List[str],
@@ -426,6 +480,9 @@ class ReasoningEngine:
 現在の日付: {settings.CURRENT_DATE if hasattr(settings, 'CURRENT_DATE') else "不明"}
 """
 
+        # システムプロンプトは詳細レベルごとに同じ内容になるため、KVキャッシュを再利用する
+        self.chat_model.register_prompt_prefix(system_prompt)
+        
         # メッセージの準備
         messages = [Message(role="system", content=system_prompt)]
         
@@ -500,6 +557,8 @@ class ReasoningEngine:
                 "reasoning": "比較処理中にエラーが発生しました。もう一度お試しください。"
             }
     
+    @memoize_intent("reasoning", cacheable=detection_succeeded)
+    @generation_call_site("intent")
     def detect_reasoning_intent(self, user_message: str) -> Tuple[bool, str, Dict[str, Any]]:
         """
         ユーザーメッセージから推論に関する意図を検出
@@ -516,47 +575,11 @@ class ReasoningEngine:
         reasoning_keywords = ["理由を説明して", "分析して", "考えて", "推論して", "ステップバイステップで", 
                               "考察して", "論理的に説明して", "なぜ", "どうして", "証明して"]
         
-        # 詳細レベルキーワード
-        detail_keywords = {
-            "詳しく": "high",
-            "詳細に": "high",
-            "簡潔に": "low",
-            "簡単に": "low",
-            "要点だけ": "low"
-        }
-        
         # 詳細レベルの検出
-        detail_level = "medium"  # デフォルト
-        for keyword, level in detail_keywords.items():
-            if keyword in user_message:
-                detail_level = level
-                break
+        detail_level = detect_detail_level(user_message)
         
         # 推論意図の検出プロンプト
-        detect_prompt = """あなたはユーザーメッセージから推論の意図を特定するアシスタントです。
-以下のメッセージから推論の意図を検出し、JSONフォーマットで返してください。
-
-ユーザーメッセージ: {}
-
-以下のような表現が推論意図を示します:
-1. ステップバイステップで考えてほしい要求
-2. 理由を説明してほしい要求
-3. 論理的分析や証明を求める表現
-4. オプションの比較や評価を求める表現
-5. 文の真偽の評価を求める表現
-
-必ず以下のJSON形式で出力してください。すべてのプロパティ名はダブルクォーテーション（"）で囲んでください：
-{{
-  "is_reasoning_intent": true/false,
-  "reasoning_type": "step_by_step/evaluate_statement/compare_options",
-  "parameters": {{
-    "question": "推論のための質問・問題",
-    "context": "追加コンテキスト（あれば）",
-    "detail_level": "low/medium/high",
-    "options": ["選択肢1", "選択肢2"] // compare_optionsの場合のみ
-  }}
-}}
-""".format(user_message)
+        detect_prompt = REASONING_DETECT_PROMPT + f"\nユーザーメッセージ: {user_message}\n"
 
         # モデルに推論させる
         response = self.chat_model.generate_response([
@@ -568,7 +591,7 @@ class ReasoningEngine:
         json_match = re.search(r'\{.*\}', response, re.DOTALL)
         if not json_match:
             logger.warning(f"推論意図検出: JSONが見つかりませんでした: {response}")
-            return False, "", {}
+            return FailedDetection((False, "", {}))
             
         json_str = json_match.group(0)
         
@@ -580,7 +603,7 @@ class ReasoningEngine:
                 result = json.loads(cleaned_json)
             except json.JSONDecodeError as e:
                 logger.error(f"クリーンアップ後もJSONのパースに失敗しました: {str(e)}")
-                return False, "", {}
+                return FailedDetection((False, "", {}))
             
             # 結果を整形
             is_reasoning_intent = result.get("is_reasoning_intent", False)
@@ -600,7 +623,7 @@ class ReasoningEngine:
             
         except Exception as e:
             logger.error(f"JSONのパース中にエラーが発生しました: {str(e)}")
-            return False, "", {}
+            return FailedDetection((False, "", {}))
 
     def format_reasoning_result(self, reasoning_type: str, result: Dict[str, Any]) -> str:
         """
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field, field_validator, model_validator
 from typing import List, Optional, Dict, Any, Union
 
 class TextGenerationRequest(BaseModel):
@@ -11,6 +11,9 @@ class TextGenerationRequest(BaseModel):
     top_p: Optional[float] = Field(None, description="top-p サンプリングのパラメータ", ge=0.0, le=1.0)
     top_k: Optional[int] = Field(None, description="top-k サンプリングのパラメータ", ge=1, le=100)
     stream: Optional[bool] = Field(False, description="ストリーミング生成を行うかどうか")
+    stop: Optional[List[str]] = Field(None, description="生成を止める文字列のリスト（出力には含まれない）", max_length=8)
+    seed: Optional[int] = Field(None, description="乱数シード（指定した場合は同じ入力から同じ出力を生成し、応答キャッシュの対象になる）")
+    include_usage: Optional[bool] = Field(False, description="ストリーミングの最後に、使用量と計測値（timing）を usage イベントで送るかどうか")
     
     @field_validator('prompt')
     def prompt_not_empty(cls, v):
@@ -54,6 +57,10 @@ class ChatCompletionRequest(BaseModel):
     top_p: Optional[float] = Field(None, description="top-p サンプリングのパラメータ", ge=0.0, le=1.0)
     top_k: Optional[int] = Field(None, description="top-k サンプリングのパラメータ", ge=1, le=100)
     stream: Optional[bool] = Field(False, description="ストリーミング生成を行うかどうか")
+    stop: Optional[List[str]] = Field(None, description="生成を止める文字列のリスト（出力には含まれない）", max_length=8)
+    seed: Optional[int] = Field(None, description="乱数シード（指定した場合は同じ入力から同じ出力を生成し、応答キャッシュの対象になる）")
+    include_usage: Optional[bool] = Field(False, description="ストリーミングの最後に、使用量と計測値（timing）を usage イベントで送るかどうか")
+    include_progress: Optional[bool] = Field(False, description="ストリーミング中に、ツール（Web検索・GitHub操作・推論・ファイル操作）の進捗を progress イベントで送るかどうか")
     session_id: Optional[str] = Field(None, description="セッションID (メモリ機能使用時)")
     session_title: Optional[str] = Field(None, description="セッションタイトル (新規セッション作成時)")
     
@@ -77,19 +84,64 @@ class EmbeddingRequest(BaseModel):
     """
     埋め込みリクエストのスキーマ
     """
-    text: str = Field(..., description="埋め込みを取得するテキスト")
+    text: Optional[str] = Field(None, description="埋め込みを取得するテキスト（単一入力、後方互換用）")
+    input: Optional[Union[str, List[str]]] = Field(None, description="埋め込みを取得するテキスト、またはテキストのリスト")
+    encoding_format: str = Field("float", description="ベクトルの形式 (float または base64: リトルエンディアンfloat32のバイト列)")
     
     @field_validator('text')
     def text_not_empty(cls, v):
-        if not v or not v.strip():
+        if v is None:
+            return v
+        if not v.strip():
             raise ValueError('テキストは空であってはいけません')
         return v.strip()
+    
+    @field_validator('input')
+    def input_not_empty(cls, v):
+        if v is None:
+            return v
+        texts = [v] if isinstance(v, str) else v
+        if not texts:
+            raise ValueError('入力リストは空であってはいけません')
+        if len(texts) > 2048:
+            raise ValueError('入力は2048件以下である必要があります')
+        if any(not text or not text.strip() for text in texts):
+            raise ValueError('テキストは空であってはいけません')
+        return [text.strip() for text in texts] if isinstance(v, list) else v.strip()
+    
+    @field_validator('encoding_format')
+    def validate_encoding_format(cls, v):
+        if v not in ["float", "base64"]:
+            raise ValueError('encoding_formatは "float" または "base64" である必要があります')
+        return v
+    
+    @model_validator(mode='after')
+    def text_or_input(self):
+        if self.text is None and self.input is None:
+            raise ValueError('text または input のいずれかを指定する必要があります')
+        return self
+    
+    @property
+    def texts(self) -> List[str]:
+        """埋め込みを取得するテキストのリスト"""
+        if self.input is not None:
+            return [self.input] if isinstance(self.input, str) else self.input
+        return [self.text]
+
+class EmbeddingData(BaseModel):
+    """
+    埋め込みベクトル1件分のスキーマ
+    """
+    index: int = Field(..., description="入力リスト内の位置")
+    embedding: Union[List[float], str] = Field(..., description="埋め込みベクトル（base64の場合はエンコード済み文字列）")
 
 class EmbeddingResponse(BaseModel):
     """
     埋め込みレスポンスのスキーマ
     """
-    embedding: List[float] = Field(..., description="テキストの埋め込みベクトル")
+    embedding: Optional[Union[List[float], str]] = Field(None, description="テキストの埋め込みベクトル（入力が1件の場合のみ）")
+    data: List[EmbeddingData] = Field([], description="入力ごとの埋め込みベクトル")
+    encoding_format: str = Field("float", description="ベクトルの形式")
     usage: Dict[str, Any] = Field(..., description="使用量情報")
 
 class ModelInfoResponse(BaseModel):
@@ -102,6 +154,8 @@ class ModelInfoResponse(BaseModel):
     tokenizer_type: Optional[str] = Field(None, description="トークナイザーの種類")
     device: Optional[str] = Field(None, description="デバイス")
     parameters: Optional[Dict[str, Any]] = Field(None, description="パラメータ情報")
+    warm: Optional[bool] = Field(None, description="ウォームアップ済みでメモリに読み込まれているかどうか")
+    memory: Optional[Dict[str, Any]] = Field(None, description="モデルのメモリ使用量")
 
 class HealthResponse(BaseModel):
     """
@@ -9,9 +9,55 @@ from .brave_search import get_brave_search_client
 from .github_client import get_github_client
 from .reasoning import get_reasoning_engine
 from ..core.config import settings
+from ..core.metrics import generation_call_site
+from ..core.intent_cache import FailedDetection, detection_succeeded, memoize_intent
 
 logger = logging.getLogger(__name__)
 
+# Web検索意図の検出プロンプト（ユーザーメッセージは末尾に追加し、共通部分のKVキャッシュを再利用できるようにする）
+WEB_SEARCH_DETECT_PROMPT = """あなたはユーザーメッセージからWeb検索の意図を特定するアシスタントです。
+以下のメッセージからWeb検索の意図を検出し、JSONフォーマットで返してください。
+
+以下のような表現が検索意図を示します:
+1. 「検索して」「調べて」などの明示的な検索リクエスト
+2. 「〜について教えて」のような情報要求
+3. 「最新の〜は?」のような最新情報の要求
+4. 「〜の方法は?」のような手順や方法の質問
+
+出力はJSON形式で:
+{
+  "is_search_intent": true/false,
+  "search_query": "検索クエリ（検索意図がない場合は空）"
+}
+"""
+
+# GitHub操作意図の検出プロンプト（ユーザーメッセージは末尾に追加し、共通部分のKVキャッシュを再利用できるようにする）
+GITHUB_DETECT_PROMPT = """あなたはユーザーメッセージからGitHub操作の意図を特定するアシスタントです。
+以下のメッセージからGitHub操作の意図を検出し、JSONフォーマットで返してください。
+
+以下の操作を検出できます:
+1. リポジトリ一覧表示: 例「GitHubのリポジトリ一覧を表示して」
+2. リポジトリ作成: 例「新しいリポジトリを作成して」
+3. リポジトリ検索: 例「Pythonのマークダウンパーサーのリポジトリを検索して」
+4. ファイル内容取得: 例「リポジトリのREADME.mdを表示して」
+5. ファイル作成・更新: 例「リポジトリにHello Worldのファイルを作成して」
+6. イシュー作成: 例「バグ報告のイシューを作成して」
+7. プルリクエスト作成: 例「このブランチからプルリクエストを作成して」
+
+出力はJSON形式で:
+{
+  "is_github_operation": true/false,
+  "operation_type": "list_repos/create_repo/search_repos/get_file/update_file/create_issue/create_pr",
+  "parameters": {
+    "owner": "リポジトリのオーナー",
+    "repo": "リポジトリ名",
+    "path": "ファイルパス",
+    "content": "ファイル内容",
+    ...
+  }
+}
+"""
+
 class SmartAssistant:
     """
     Web検索とGitHub操作機能を持つスマートアシスタント
@@ -38,6 +84,10 @@ class SmartAssistant:
         self.github_client = get_github_client()
         self.reasoning_engine = get_reasoning_engine()
         
+        # 意図検出の固定プロンプトはKVキャッシュを再利用する
+        self.chat_model.register_prompt_prefix(WEB_SEARCH_DETECT_PROMPT)
+        self.chat_model.register_prompt_prefix(GITHUB_DETECT_PROMPT)
+        
         # APIキーの状態をログに出力
         if self.brave_search.api_key:
             logger.info("SmartAssistant: Brave Search APIキーが設定されています")
@@ -49,6 +99,8 @@ class SmartAssistant:
         else:
             logger.warning("SmartAssistant: GitHub APIトークンが設定されていません")
     
+    @memoize_intent("web_search", cacheable=detection_succeeded)
+    @generation_call_site("intent")
     def detect_web_search_intent(self, user_message: str) -> Tuple[bool, str]:
         """
         ユーザーメッセージからWeb検索の意図を検出する
@@ -80,23 +132,7 @@ class SmartAssistant:
             return True, query
         
         # 検索の意図を検出するためのプロンプトを作成
-        detect_prompt = """あなたはユーザーメッセージからWeb検索の意図を特定するアシスタントです。
-以下のメッセージからWeb検索の意図を検出し、JSONフォーマットで返してください。
-
-ユーザーメッセージ: {}
-
-以下のような表現が検索意図を示します:
-1. 「検索して」「調べて」などの明示的な検索リクエスト
-2. 「〜について教えて」のような情報要求
-3. 「最新の〜は?」のような最新情報の要求
-4. 「〜の方法は?」のような手順や方法の質問
-
-出力はJSON形式で:
-{{
-  "is_search_intent": true/false,
-  "search_query": "検索クエリ（検索意図がない場合は空）"
-}}
-""".format(user_message)
+        detect_prompt = WEB_SEARCH_DETECT_PROMPT + f"\nユーザーメッセージ: {user_message}\n"
 
         # モデルに推論させる
         response = self.chat_model.generate_response([
@@ -108,7 +144,7 @@ class SmartAssistant:
         json_match = re.search(r'\{.*\}', response, re.DOTALL)
         if not json_match:
             logger.warning(f"Web検索意図検出: JSONが見つかりませんでした: {response}")
-            return False, ""
+            return FailedDetection((False, ""))
             
         json_str = json_match.group(0)
         
@@ -128,8 +164,10 @@ class SmartAssistant:
             
         except Exception as e:
             logger.error(f"JSONのパース中にエラーが発生しました: {str(e)}")
-            return False, ""
+            return FailedDetection((False, ""))
     
+    @memoize_intent("github_operation", cacheable=detection_succeeded)
+    @generation_call_site("intent")
     def detect_github_operation_intent(self, user_message: str) -> Tuple[bool, str, Dict[str, Any]]:
         """
         ユーザーメッセージからGitHub操作の意図を検出する
@@ -162,33 +200,7 @@ class SmartAssistant:
             return True, operation_type, parameters
         
         # GitHub操作の意図を検出するためのプロンプトを作成
-        detect_prompt = """あなたはユーザーメッセージからGitHub操作の意図を特定するアシスタントです。
-以下のメッセージからGitHub操作の意図を検出し、JSONフォーマットで返してください。
-
-ユーザーメッセージ: {}
-
-以下の操作を検出できます:
-1. リポジトリ一覧表示: 例「GitHubのリポジトリ一覧を表示して」
-2. リポジトリ作成: 例「新しいリポジトリを作成して」
-3. リポジトリ検索: 例「Pythonのマークダウンパーサーのリポジトリを検索して」
-4. ファイル内容取得: 例「リポジトリのREADME.mdを表示して」
-5. ファイル作成・更新: 例「リポジトリにHello Worldのファイルを作成して」
-6. イシュー作成: 例「バグ報告のイシューを作成して」
-7. プルリクエスト作成: 例「このブランチからプルリクエストを作成して」
-
-出力はJSON形式で:
-{{
-  "is_github_operation": true/false,
-  "operation_type": "list_repos/create_repo/search_repos/get_file/update_file/create_issue/create_pr",
-  "parameters": {{
-    "owner": "リポジトリのオーナー",
-    "repo": "リポジトリ名",
-    "path": "ファイルパス",
-    "content": "ファイル内容",
-    ...
-  }}
-}}
-""".format(user_message)
+        detect_prompt = GITHUB_DETECT_PROMPT + f"\nユーザーメッセージ: {user_message}\n"
 
         # モデルに推論させる
         response = self.chat_model.generate_response([
@@ -200,7 +212,7 @@ class SmartAssistant:
         json_match = re.search(r'\{.*\}', response, re.DOTALL)
         if not json_match:
             logger.warning(f"GitHub操作意図検出: JSONが見つかりませんでした: {response}")
-            return False, "", {}
+            return FailedDetection((False, "", {}))
             
         json_str = json_match.group(0)
         
@@ -221,8 +233,9 @@ class SmartAssistant:
             
         except Exception as e:
             logger.error(f"JSONのパース中にエラーが発生しました: {str(e)}")
-            return False, "", {}
+            return FailedDetection((False, "", {}))
     
+    @generation_call_site("intent")
     def detect_reasoning_intent(self, user_message: str) -> Tuple[bool, str, Dict[str, Any]]:
         """
         ユーザーメッセージから推論意図を検出する
@@ -359,6 +372,7 @@ class SmartAssistant:
                 "data": None
             }
     
+    @generation_call_site("reasoning")
     def perform_reasoning(self, reasoning_type: str, parameters: Dict[str, Any]) -> Dict[str, Any]:
         """
         推論を実行する
@@ -432,20 +446,16 @@ class SmartAssistant:
                 "result": None
             }
     
-    def enhance_response_with_search(self, query: str, user_message: str) -> str:
+    def get_direct_search_response(self, search_results: Dict[str, Any]) -> Optional[str]:
         """
-        Web検索結果を含めた応答を生成する
+        モデルで回答を生成せずにそのまま返す応答（検索エラー、日付などの特殊データ）を返す
         
         Args:
-            query: 検索クエリ
-            user_message: 元のユーザーメッセージ
+            search_results: perform_web_search の検索結果
             
         Returns:
-            str: 検索結果を含めた応答
+            Optional[str]: そのまま返す応答（モデルで回答を生成する場合は None）
         """
-        # 検索を実行
-        search_results = self.perform_web_search(query)
-        
         if not search_results["success"]:
             return f"検索エラー: {search_results.get('message', '不明なエラー')}"
         
@@ -456,6 +466,19 @@ class SmartAssistant:
             if special_data["type"] == "date":
                 return f"今日は{special_data['value']}です。"
         
+        return None
+    
+    def build_search_messages(self, search_results: Dict[str, Any], user_message: str) -> List[Message]:
+        """
+        検索結果を参考にして回答を生成するためのメッセージを作成する
+        
+        Args:
+            search_results: perform_web_search の検索結果
+            user_message: 元のユーザーメッセージ
+            
+        Returns:
+            List[Message]: 回答を生成するメッセージのリスト
+        """
         # 検索結果を整形
         formatted_results = self.brave_search.format_results(search_results)
         
@@ -477,11 +500,34 @@ class SmartAssistant:
 
 ユーザーへの回答:"""
 
-        # 強化された応答を生成
-        enhanced_response = self.chat_model.generate_response([
+        return [
             Message(role="system", content=enhance_prompt),
             Message(role="user", content=user_message)
-        ])
+        ]
+    
+    @generation_call_site("search")
+    def enhance_response_with_search(self, query: str, user_message: str) -> str:
+        """
+        Web検索結果を含めた応答を生成する
+        
+        Args:
+            query: 検索クエリ
+            user_message: 元のユーザーメッセージ
+            
+        Returns:
+            str: 検索結果を含めた応答
+        """
+        # 検索を実行
+        search_results = self.perform_web_search(query)
+        
+        direct_response = self.get_direct_search_response(search_results)
+        if direct_response is not None:
+            return direct_response
+        
+        # 強化された応答を生成
+        enhanced_response = self.chat_model.generate_response(
+            self.build_search_messages(search_results, user_message)
+        )
         
         return enhanced_response
     
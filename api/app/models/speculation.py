@@ -0,0 +1,170 @@
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, Any, Optional, AsyncGenerator
+
+logger = logging.getLogger(__name__)
+
+class SpeculativeGeneration:
+    """
+    意図の判定と並行して開始した通常のチャットの生成
+    
+    バックグラウンドのタスクがバックエンドのストリームを読み進めてチャンクをバッファに貯める。
+    ツールを使う意図がなければ adopt でバッファのチャンクと以降のチャンクを受け取り、
+    ツールを使う場合は cancel で生成を止める
+    """
+    
+    def __init__(self, speculator: "ChatSpeculator", chunks: AsyncGenerator[str, None], usage: Dict[str, Any]):
+        """
+        Args:
+            speculator: 統計を記録する ChatSpeculator
+            chunks: バックエンドのストリーム
+            usage: バックエンドがトークン使用量を書き込む辞書
+        """
+        self.usage = usage
+        self.adopted = False
+        self.cancelled = False
+        self.started_at = time.perf_counter()
+        self.first_chunk_at: Optional[float] = None
+        self.received = 0
+        self._speculator = speculator
+        self._chunks = chunks
+        # チャンク、失敗した場合は例外、終了した場合は None を入れる
+        self._queue: "asyncio.Queue[Any]" = asyncio.Queue()
+        self._task = asyncio.ensure_future(self._run())
+    
+    async def _run(self) -> None:
+        try:
+            async for chunk in self._chunks:
+                if self.first_chunk_at is None:
+                    self.first_chunk_at = time.perf_counter()
+                self.received += 1
+                self._queue.put_nowait(chunk)
+        except Exception as e:
+            # 実行枠を確保できない場合（ModelBusyError）なども、採用した時点で呼び出し元に送出する
+            self._queue.put_nowait(e)
+        finally:
+            self._queue.put_nowait(None)
+    
+    def adopt(self) -> AsyncGenerator[str, None]:
+        """
+        投機的な生成を採用し、バッファのチャンクと以降のチャンクを返すストリームを返す
+        """
+        self.adopted = True
+        self._speculator._record_adopted(self)
+        return self._drain()
+    
+    async def _drain(self) -> AsyncGenerator[str, None]:
+        try:
+            while True:
+                item = await self._queue.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            await self._stop()
+    
+    async def cancel(self) -> None:
+        """
+        採用しなかった生成を止める（2回目以降の呼び出しや採用後の呼び出しは何もしない）
+        """
+        if self.adopted or self.cancelled:
+            return
+        self.cancelled = True
+        self._speculator._record_cancelled(self)
+        await self._stop()
+    
+    async def _stop(self) -> None:
+        # ストリームを閉じると、バックエンドへの接続も閉じられて生成が止まる
+        if not self._task.done():
+            self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        await self._chunks.aclose()
+
+class ChatSpeculator:
+    """
+    意図の判定と並行して通常のチャットの生成を開始し、その採用・破棄の統計を記録する
+    
+    最初のトークンまでの時間の短縮は、採用時点で「意図の判定にかかった時間」と「生成の最初のチャンクまでの時間」の
+    短い方として推定する（判定の後に生成を開始した場合は、両者の合計が最初のトークンまでの時間になるため）
+    """
+    _instance = None
+    
+    def __new__(cls):
+        """シングルトンパターンを使用"""
+        if cls._instance is None:
+            cls._instance = super(ChatSpeculator, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+    
+    def __init__(self):
+        """
+        ChatSpeculatorを初期化する
+        """
+        if self._initialized:
+            return
+        
+        self._initialized = True
+        self._lock = threading.Lock()
+        
+        # 統計情報
+        self.started = 0
+        self.adopted = 0
+        self.cancelled = 0
+        self.wasted_chunks = 0
+        self.detection_seconds = 0.0
+        self.saved_seconds = 0.0
+    
+    def start(self, chunks: AsyncGenerator[str, None], usage: Dict[str, Any]) -> SpeculativeGeneration:
+        """
+        ストリームの読み出しをバックグラウンドで開始する
+        
+        Args:
+            chunks: バックエンドのストリーム（まだ読み出していないもの）
+            usage: バックエンドがトークン使用量を書き込む辞書
+        """
+        with self._lock:
+            self.started += 1
+        return SpeculativeGeneration(self, chunks, usage)
+    
+    def _record_adopted(self, speculation: SpeculativeGeneration) -> None:
+        detection = time.perf_counter() - speculation.started_at
+        saved = detection
+        if speculation.first_chunk_at is not None:
+            saved = min(detection, speculation.first_chunk_at - speculation.started_at)
+        with self._lock:
+            self.adopted += 1
+            self.detection_seconds += detection
+            self.saved_seconds += saved
+    
+    def _record_cancelled(self, speculation: SpeculativeGeneration) -> None:
+        with self._lock:
+            self.cancelled += 1
+            self.wasted_chunks += speculation.received
+        logger.info(f"ツールを使う意図が検出されたため、投機的な生成を中止しました（受信済みのチャンク: {speculation.received}）")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        投機的な生成を破棄した割合と、最初のトークンまでの時間の推定短縮量を返す
+        """
+        with self._lock:
+            finished = self.adopted + self.cancelled
+            return {
+                "started": self.started,
+                "adopted": self.adopted,
+                "cancelled": self.cancelled,
+                "wasted_rate": round(self.cancelled / finished, 4) if finished else 0.0,
+                "wasted_chunks": self.wasted_chunks,
+                "average_detection_seconds": round(self.detection_seconds / self.adopted, 3) if self.adopted else 0.0,
+                "average_ttft_saved_seconds": round(self.saved_seconds / self.adopted, 3) if self.adopted else 0.0,
+            }
+
+# シングルトンインスタンスを取得する関数
+def get_chat_speculator() -> ChatSpeculator:
+    """
+    ChatSpeculatorのインスタンスを取得する
+    """
+    return ChatSpeculator()
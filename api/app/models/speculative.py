@@ -0,0 +1,135 @@
+import logging
+import threading
+import time
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+class SpeculativeDecoder:
+    """
+    小さなドラフトモデルでトークンを先読みし、本体のモデルでまとめて検証する投機的デコーディング
+    
+    生成は transformers の assisted generation（generate の assistant_model）で行う。
+    受理率は各モデルのフォワード回数から求める（本体の1回の検証で受理されたドラフトトークン数+1トークンが確定する）。
+    通常のデコーディングとの速度比を求めるため、baseline_interval 件ごとに1件はドラフトモデルを使わずに生成する
+    """
+    
+    def __init__(
+        self,
+        model: Any,
+        draft_model: Any,
+        tokenizer: Any,
+        draft_tokenizer: Any,
+        num_assistant_tokens: int,
+        baseline_interval: int,
+    ):
+        """
+        Args:
+            model: 本体の CausalLM モデル
+            draft_model: トークンを先読みするドラフトモデル
+            tokenizer: 本体のトークナイザー
+            draft_tokenizer: ドラフトモデルのトークナイザー
+            num_assistant_tokens: 1回の検証でドラフトモデルが先読みするトークン数の初期値
+            baseline_interval: 通常のデコーディングで速度を計測する間隔（件数、0の場合は計測しない）
+        """
+        self.model = model
+        self.draft_model = draft_model
+        self.baseline_interval = max(0, baseline_interval)
+        self.draft_model.generation_config.num_assistant_tokens = max(1, num_assistant_tokens)
+        
+        self._assistant_kwargs: Dict[str, Any] = {"assistant_model": draft_model}
+        # 語彙が異なる場合はトークナイザーを渡し、テキストを介して候補を変換させる
+        if model.config.get_text_config().vocab_size != draft_model.config.get_text_config().vocab_size:
+            logger.info("本体とドラフトモデルの語彙サイズが異なるため、トークナイザーを介して候補を変換します")
+            self._assistant_kwargs.update({"tokenizer": tokenizer, "assistant_tokenizer": draft_tokenizer})
+        
+        # フォワード回数はスレッドごとに数える（生成は同時に複数のワーカースレッドで実行される）
+        self._local = threading.local()
+        model.register_forward_hook(self._count_target_forward)
+        draft_model.register_forward_hook(self._count_draft_forward)
+        
+        self._lock = threading.Lock()
+        self._calls = 0
+        
+        # 統計情報
+        self.requests = 0
+        self.generated_tokens = 0
+        self.verify_steps = 0
+        self.draft_tokens = 0
+        self.accepted_tokens = 0
+        self.seconds = 0.0
+        self.baseline_requests = 0
+        self.baseline_tokens = 0
+        self.baseline_seconds = 0.0
+    
+    def _count_target_forward(self, module: Any, args: Any, output: Any) -> None:
+        self._local.target_forwards = getattr(self._local, "target_forwards", 0) + 1
+    
+    def _count_draft_forward(self, module: Any, args: Any, output: Any) -> None:
+        self._local.draft_forwards = getattr(self._local, "draft_forwards", 0) + 1
+    
+    def generate(self, **kwargs: Any) -> Any:
+        """
+        model.generate と同じ引数で生成を行う（通常はドラフトモデルを使い、計測用の一部は使わない）
+        
+        Returns:
+            model.generate の出力（プロンプトを含むトークンID）
+        """
+        with self._lock:
+            self._calls += 1
+            baseline = self.baseline_interval > 0 and self._calls % self.baseline_interval == 0
+        
+        # 本体は計算済みのプレフィックスKVをそのまま使い、ドラフトモデルはプロンプト全体を自分で処理する
+        if not baseline:
+            kwargs.update(self._assistant_kwargs)
+        
+        prompt_tokens = kwargs["input_ids"].shape[1]
+        self._local.target_forwards = 0
+        self._local.draft_forwards = 0
+        start_time = time.time()
+        outputs = self.model.generate(**kwargs)
+        elapsed = time.time() - start_time
+        generated = int(outputs.shape[1] - prompt_tokens)
+        
+        with self._lock:
+            if baseline:
+                self.baseline_requests += 1
+                self.baseline_tokens += generated
+                self.baseline_seconds += elapsed
+            else:
+                verify_steps = self._local.target_forwards
+                self.requests += 1
+                self.generated_tokens += generated
+                self.verify_steps += verify_steps
+                self.draft_tokens += self._local.draft_forwards
+                # 各検証で本体が1トークンを確定させ、残りは受理されたドラフトトークン
+                self.accepted_tokens += max(0, generated - verify_steps)
+                self.seconds += elapsed
+        
+        return outputs
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        受理率と通常のデコーディングに対する速度比を返す
+        """
+        with self._lock:
+            seconds_per_token = self.seconds / self.generated_tokens if self.generated_tokens else None
+            baseline_seconds_per_token = self.baseline_seconds / self.baseline_tokens if self.baseline_tokens else None
+            speedup: Optional[float] = None
+            if seconds_per_token and baseline_seconds_per_token:
+                speedup = round(baseline_seconds_per_token / seconds_per_token, 2)
+            
+            return {
+                "draft_model": getattr(self.draft_model, "name_or_path", None),
+                "num_assistant_tokens": self.draft_model.generation_config.num_assistant_tokens,
+                "requests": self.requests,
+                "generated_tokens": self.generated_tokens,
+                "draft_tokens": self.draft_tokens,
+                "accepted_tokens": self.accepted_tokens,
+                "acceptance_rate": round(self.accepted_tokens / self.draft_tokens, 4) if self.draft_tokens else 0.0,
+                "tokens_per_verify_step": round(self.generated_tokens / self.verify_steps, 2) if self.verify_steps else 0.0,
+                "tokens_per_second": round(1 / seconds_per_token, 2) if seconds_per_token else 0.0,
+                "baseline_requests": self.baseline_requests,
+                "baseline_tokens_per_second": round(1 / baseline_seconds_per_token, 2) if baseline_seconds_per_token else 0.0,
+                "speedup": speedup,
+            }
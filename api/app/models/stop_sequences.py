@@ -0,0 +1,85 @@
+from typing import Iterable, List, Optional, Tuple
+
+# ChatModel.format_prompt 形式のプロンプトで、モデルが次の発話を自分で書き始めたことを示す役割の目印
+ROLE_STOP_SEQUENCES = ["\nユーザー:", "\nアシスタント:"]
+
+def merge_stop_sequences(*groups: Optional[Iterable[str]]) -> List[str]:
+    """
+    複数の停止文字列のリストを、順序を保ったまま重複と空文字列を除いて1つにまとめる
+    """
+    merged: List[str] = []
+    for group in groups:
+        for stop in group or []:
+            if stop and stop not in merged:
+                merged.append(stop)
+    return merged
+
+def truncate_at_stop(text: str, stop: Optional[List[str]]) -> Tuple[str, bool]:
+    """
+    テキストを最初に現れた停止文字列の直前で切り詰める
+    
+    Returns:
+        切り詰めたテキストと、停止文字列が見つかったかどうかのタプル
+    """
+    positions = [text.find(s) for s in stop or [] if s]
+    positions = [position for position in positions if position >= 0]
+    if not positions:
+        return text, False
+    return text[:min(positions)], True
+
+class StopSequenceFilter:
+    """
+    ストリーミング出力から停止文字列以降を取り除くフィルタ
+    
+    停止文字列がチャンクの境界をまたいでも途中まで出力しないよう、
+    停止文字列の先頭部分と一致する末尾は次のチャンクが来るまで保留する
+    """
+    
+    def __init__(self, stop: List[str]):
+        """
+        Args:
+            stop: 停止文字列のリスト
+        """
+        self.stop = [s for s in stop if s]
+        self.stopped = False
+        self._buffer = ""
+    
+    def feed(self, chunk: str) -> str:
+        """
+        チャンクを追加し、出力してよい部分を返す
+        
+        停止文字列が見つかった場合はその直前までを返し、以降のチャンクはすべて捨てる
+        """
+        if self.stopped:
+            return ""
+        
+        self._buffer += chunk
+        text, self.stopped = truncate_at_stop(self._buffer, self.stop)
+        if self.stopped:
+            self._buffer = ""
+            return text
+        
+        held = self._partial_match_length(self._buffer)
+        text = self._buffer[:len(self._buffer) - held]
+        self._buffer = self._buffer[len(self._buffer) - held:]
+        return text
+    
+    def flush(self) -> str:
+        """
+        出力の終了時に、保留していた部分を返す
+        """
+        text = "" if self.stopped else self._buffer
+        self._buffer = ""
+        return text
+    
+    def _partial_match_length(self, text: str) -> int:
+        """
+        テキストの末尾と停止文字列の先頭が一致する最大の長さを返す
+        """
+        longest = 0
+        for stop in self.stop:
+            for length in range(min(len(stop) - 1, len(text)), longest, -1):
+                if text.endswith(stop[:length]):
+                    longest = length
+                    break
+        return longest
@@ -0,0 +1,112 @@
+from fastapi import APIRouter, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from typing import Dict, Any
+import logging
+
+from ..core.embedding_cache import get_embedding_cache
+from ..core.response_cache import get_response_cache
+from ..core.semantic_cache import get_semantic_cache
+from ..core.intent_cache import get_intent_cache
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+@router.get(
+    "/stats",
+    summary="キャッシュ統計",
+    description="各キャッシュのヒット・ミス数と保持件数を取得します",
+)
+async def get_cache_stats() -> Dict[str, Any]:
+    """
+    キャッシュの統計情報を返すエンドポイント
+    """
+    try:
+        return {
+            "embeddings": await run_in_threadpool(get_embedding_cache().get_stats),
+            "responses": await run_in_threadpool(get_response_cache().get_stats),
+            "semantic": get_semantic_cache().get_stats(),
+            "intents": get_intent_cache().get_stats(),
+        }
+    except Exception as e:
+        logger.error(f"キャッシュ統計の取得中にエラーが発生しました: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"キャッシュ統計の取得中にエラーが発生しました: {str(e)}",
+        )
+
+@router.delete(
+    "/embeddings",
+    summary="埋め込みキャッシュの削除",
+    description="メモリとSQLiteに保存された埋め込みキャッシュをすべて削除します",
+)
+async def clear_embedding_cache() -> Dict[str, Any]:
+    """
+    埋め込みキャッシュを削除するエンドポイント
+    """
+    try:
+        await run_in_threadpool(get_embedding_cache().clear)
+        return {"success": True}
+    except Exception as e:
+        logger.error(f"埋め込みキャッシュの削除中にエラーが発生しました: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"埋め込みキャッシュの削除中にエラーが発生しました: {str(e)}",
+        )
+
+@router.delete(
+    "/responses",
+    summary="応答キャッシュの削除",
+    description="メモリとSQLiteに保存された応答キャッシュをすべて削除します",
+)
+async def clear_response_cache() -> Dict[str, Any]:
+    """
+    応答キャッシュを削除するエンドポイント
+    """
+    try:
+        await run_in_threadpool(get_response_cache().clear)
+        return {"success": True}
+    except Exception as e:
+        logger.error(f"応答キャッシュの削除中にエラーが発生しました: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"応答キャッシュの削除中にエラーが発生しました: {str(e)}",
+        )
+
+@router.delete(
+    "/semantic",
+    summary="意味的キャッシュの削除",
+    description="意味的キャッシュに保持された質問と回答をすべて削除します",
+)
+async def clear_semantic_cache() -> Dict[str, Any]:
+    """
+    意味的キャッシュを削除するエンドポイント
+    """
+    try:
+        get_semantic_cache().clear()
+        return {"success": True}
+    except Exception as e:
+        logger.error(f"意味的キャッシュの削除中にエラーが発生しました: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"意味的キャッシュの削除中にエラーが発生しました: {str(e)}",
+        )
+
+@router.delete(
+    "/intents",
+    summary="意図の判定結果のキャッシュの削除",
+    description="意図の判定結果のキャッシュをすべて削除します（判定のプロンプトや分類器を更新した後に使います）",
+)
+async def clear_intent_cache() -> Dict[str, Any]:
+    """
+    意図の判定結果のキャッシュを削除するエンドポイント
+    """
+    try:
+        get_intent_cache().clear()
+        return {"success": True}
+    except Exception as e:
+        logger.error(f"意図の判定結果のキャッシュの削除中にエラーが発生しました: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"意図の判定結果のキャッシュの削除中にエラーが発生しました: {str(e)}",
+        )
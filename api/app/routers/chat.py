@@ -1,17 +1,28 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
 from fastapi.responses import StreamingResponse
-from typing import Dict, List, Optional, Any
+from fastapi.concurrency import run_in_threadpool, iterate_in_threadpool
+from typing import Dict, List, Optional, Any, AsyncGenerator
+import asyncio
 import logging
 import time
 import json
 import uuid
 
 from ..models.chat_model import get_chat_model, Message as ChatMessage
-from ..models.model_factory import get_model, get_tokenizer
+from ..models.model_factory import get_model
+from ..models.generation_pool import ModelBusyError, prime_stream
+from ..models.stop_sequences import ROLE_STOP_SEQUENCES, merge_stop_sequences
 from ..models.files_assistant import get_files_assistant
+from ..models.intent_router import get_message_intents
+from ..models.speculation import get_chat_speculator
 from ..models.smart_assistant import get_smart_assistant
 from ..models.schemas import ChatCompletionRequest, ChatCompletionResponse, Message
+from ..core.config import settings
 from ..core.dependencies import check_rate_limit
+from ..core.tokenizer import count_tokens, get_token_counter
+from ..core.response_cache import CachedResponse, ResponseCache, get_response_cache
+from ..core.semantic_cache import get_semantic_cache
+from ..core.metrics import generation_call_site
 from ..core.database import get_memory_setting, get_session, create_session, add_message
 from ..core.database import store_user_memory, get_user_memory, delete_user_memory, get_all_user_memories, delete_all_user_memories
 from .user_memory import detect_memory_intent, extract_key_value_from_memory_text, get_memory_help_text
@@ -20,6 +31,228 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# ツールの実行中に、経過時間の進捗を送る間隔（秒）
+TOOL_PROGRESS_INTERVAL_SECONDS = 5.0
+
+def _progress(stage: str, message: str, **details: Any) -> Dict[str, Any]:
+    """
+    ツールの進捗（progress イベントの内容）を作成する
+    """
+    return {"stage": stage, "message": message, **details}
+
+async def _wait_with_progress(task: "asyncio.Future[Any]", stage: str) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    スレッドプールで実行中のツールの完了を待つ間、TOOL_PROGRESS_INTERVAL_SECONDS ごとに経過時間の進捗を返す
+    （読み出し側が途中で終了した場合は、完了を待たずにタスクを取り消す）
+    """
+    started = time.perf_counter()
+    try:
+        while not task.done():
+            await asyncio.wait({task}, timeout=TOOL_PROGRESS_INTERVAL_SECONDS)
+            if not task.done():
+                elapsed = round(time.perf_counter() - started)
+                yield _progress(stage, f"処理中です（{elapsed}秒経過）", elapsed_seconds=elapsed)
+    finally:
+        if not task.done():
+            task.cancel()
+
+def _format_file_operation_result(op_type: str, result: Dict[str, Any]) -> str:
+    """
+    ファイル操作の結果を応答のテキストに整形する
+    """
+    if not result.get("success", False):
+        return f"エラーが発生しました: {result.get('message', '不明なエラー')}"
+    
+    if op_type == "list_files":
+        files = result.get("files", [])
+        current_dir = result.get("current_dir", "")
+        
+        files_text = ""
+        for file in files:
+            file_type = "📁 " if file.get("is_dir") else "📄 "
+            size_info = f" ({file.get('size', 0)} bytes)" if not file.get("is_dir") else ""
+            files_text += f"{file_type}{file.get('name')}{size_info}\n"
+        
+        return f"## ディレクトリ: {current_dir or '/'}\n\n{files_text}"
+    
+    if op_type == "read_file":
+        content = result.get("content", "")
+        path = result.get("path", "")
+        
+        return f"## ファイル: {path}\n\n```\n{content}\n```"
+    
+    return f"ファイル操作が完了しました: {result.get('message', '')}"
+
+async def _text_steps(response_text: str) -> AsyncGenerator[Any, None]:
+    """
+    作成済みの応答のテキストだけを返すステップ
+    """
+    yield response_text
+
+async def _tool_response(
+    request: Request,
+    data: ChatCompletionRequest,
+    steps: AsyncGenerator[Any, None],
+    session_id: str,
+    memory_enabled: bool,
+    user_message: str,
+    start_time: float,
+    usage: Optional[Dict[str, Any]] = None,
+) -> Any:
+    """
+    ツールを使う分岐（記憶操作・ファイル操作・推論・Web検索・GitHub操作）の応答を返す
+    
+    steps はツールの進捗（辞書）と応答のテキスト（文字列）を順に返す非同期ジェネレータ。
+    ストリーミングの場合は、進捗を progress イベント（include_progress 指定時）、テキストを data として
+    届いた順に送るため、ツールの実行中も応答が止まらない。そうでない場合はテキストをつなげて返す
+    
+    Args:
+        usage: ステップ内の生成でバックエンドがトークン使用量を書き込む辞書（生成しない場合は None）
+    """
+    usage = usage if usage is not None else {}
+    
+    if data.stream:
+        async def streaming_generator():
+            response_chunks = []
+            try:
+                async for item in steps:
+                    # クライアントが切断した場合は、ツールの実行と生成を止めて終了する
+                    if await request.is_disconnected():
+                        logger.info("クライアントが切断したため生成を中止します")
+                        break
+                    if isinstance(item, str):
+                        response_chunks.append(item)
+                        yield f"data: {item}\n\n"
+                    elif data.include_progress:
+                        yield f"event: progress\ndata: {json.dumps(item, ensure_ascii=False)}\n\n"
+            except Exception as e:
+                logger.error(f"ストリーミング生成中にエラーが発生しました: {str(e)}")
+                yield f"data: [ERROR] {str(e)}\n\n"
+            finally:
+                await steps.aclose()
+                # メモリ機能が有効な場合、ユーザーメッセージとアシスタント応答を保存
+                if memory_enabled:
+                    try:
+                        add_message(session_id, "user", user_message)
+                        if response_chunks:
+                            add_message(session_id, "assistant", "".join(response_chunks))
+                    except Exception as save_error:
+                        logger.error(f"メッセージ保存中にエラーが発生しました: {str(save_error)}")
+                
+                if data.include_usage:
+                    usage_event = {
+                        "prompt_tokens": usage.get("prompt_tokens", 0),
+                        "completion_tokens": usage.get("completion_tokens", 0),
+                        "time_seconds": round(time.time() - start_time, 2),
+                        "cached": False,
+                        "timing": usage.get("timing"),
+                    }
+                    yield f"event: usage\ndata: {json.dumps(usage_event, ensure_ascii=False)}\n\n"
+                
+                # ストリーミング終了を通知
+                yield "data: [DONE]\n\n"
+        
+        return StreamingResponse(
+            streaming_generator(),
+            media_type="text/event-stream",
+        )
+    
+    try:
+        response_text = "".join([item async for item in steps if isinstance(item, str)])
+    finally:
+        await steps.aclose()
+    
+    # メモリ機能が有効な場合、ユーザーメッセージとアシスタント応答を保存
+    if memory_enabled:
+        add_message(session_id, "user", user_message)
+        add_message(session_id, "assistant", response_text)
+    
+    # 応答メッセージを作成
+    prompt_tokens = int(usage.get("prompt_tokens") or 0)
+    completion_tokens = int(usage.get("completion_tokens") or 0)
+    response = ChatCompletionResponse(
+        message=Message(
+            role="assistant",
+            content=response_text
+        ),
+        usage={
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "time_seconds": round(time.time() - start_time, 2),
+        },
+        session_id=session_id
+    )
+    
+    return response
+
+def _get_user_memory_text() -> str:
+    """
+    ユーザー定義記憶をシステムメッセージに追加するためのテキストを作成する
+    """
+    try:
+        memories = get_all_user_memories()
+    except Exception as e:
+        logger.warning(f"ユーザー定義記憶の取得中にエラーが発生しました: {str(e)}")
+        return ""
+    
+    if not memories:
+        return ""
+    
+    memory_text = "以下はユーザーが記憶として保存した情報です：\n"
+    for memory in memories:
+        memory_text += f"・{memory['key']}: {memory['value']}\n"
+    memory_text += "\n必要に応じて上記の情報を参照して応答を生成してください。\n\n"
+    return memory_text
+
+def _semantic_cache_response(
+    entry: CachedResponse,
+    http_response: Response,
+    stream: bool,
+    session_id: str,
+    memory_enabled: bool,
+    user_message: str,
+    start_time: float,
+) -> Any:
+    """
+    意味的キャッシュにヒットした回答を、リクエストに合わせてストリーミングまたは通常の応答として返す
+    """
+    # メモリ機能が有効な場合、ユーザーメッセージとアシスタント応答を保存
+    if memory_enabled:
+        add_message(session_id, "user", user_message)
+        add_message(session_id, "assistant", entry.text)
+    
+    if stream:
+        async def streaming_generator():
+            async for text_chunk in ResponseCache.replay(entry):
+                yield f"data: {text_chunk}\n\n"
+            yield "data: [DONE]\n\n"
+        
+        return StreamingResponse(
+            streaming_generator(),
+            media_type="text/event-stream",
+            headers={"X-Semantic-Cache": "hit"},
+        )
+    
+    http_response.headers["X-Semantic-Cache"] = "hit"
+    prompt_tokens = int(entry.usage.get("prompt_tokens") or 0)
+    completion_tokens = int(entry.usage.get("completion_tokens") or 0)
+    response = ChatCompletionResponse(
+        message=Message(
+            role="assistant",
+            content=entry.text
+        ),
+        usage={
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "time_seconds": round(time.time() - start_time, 2),
+            "cached": True,
+        },
+        session_id=session_id
+    )
+    return response
+
 @router.post(
     "/chat/completions", 
     response_model=ChatCompletionResponse,
@@ -27,7 +260,7 @@ router = APIRouter()
     description="モデルを使用してチャット応答を生成します",
     dependencies=[Depends(check_rate_limit)],
 )
-async def chat_completion(request: Request, data: ChatCompletionRequest):
+async def chat_completion(request: Request, http_response: Response, data: ChatCompletionRequest):
     """
     チャット応答生成エンドポイント
     
@@ -37,14 +270,24 @@ async def chat_completion(request: Request, data: ChatCompletionRequest):
     * top_p: top-p サンプリングのパラメータ
     * top_k: top-k サンプリングのパラメータ
     * stream: ストリーミング生成を行うかどうか
+    * stop: 生成を止める文字列のリスト（役割の目印 "ユーザー:" などには常に止まります）
+    * seed: 乱数シード（temperature が0またはシードを指定した場合、同じ入力の応答はキャッシュから返します）
+    * include_usage: ストリーミングの最後に使用量と計測値を usage イベントで送るかどうか
+    * include_progress: ストリーミング中にツールの進捗（「検索しています…」「N件」など）を progress イベントで送るかどうか
     * session_id: セッションID（メモリ機能使用時、指定しない場合は新しいセッションが作成されます）
+    
+    記憶操作・ファイル操作・推論・Web検索・GitHub操作の応答も stream を指定するとストリーミングで返します
+    （Web検索の回答はバックエンドから届いた順に送ります）
+    
+    意味的キャッシュが有効な場合、文脈のない単独の質問は言い換えを含めて過去の回答を返すことがあります
+    （X-Semantic-Cache ヘッダーに hit / miss を返します）
     """
     start_time = time.time()
+    speculation = None
     
     try:
         chat_model = get_chat_model()
         model = get_model()
-        tokenizer = get_tokenizer()
         smart_assistant = get_smart_assistant()
         
         # メッセージリストをChatMessageオブジェクトに変換
@@ -65,6 +308,7 @@ async def chat_completion(request: Request, data: ChatCompletionRequest):
         user_memory_enabled = user_memory_enabled_str == "true" if user_memory_enabled_str else True
         
         # セッションが存在するか確認し、なければ作成
+        session = None
         if memory_enabled:
             session = get_session(session_id)
             if not session:
@@ -73,6 +317,11 @@ async def chat_completion(request: Request, data: ChatCompletionRequest):
         # 最後のユーザーメッセージを取得
         latest_user_message = data.messages[-1].content if data.messages and data.messages[-1].role == "user" else ""
         
+        # 会話の文脈（過去の発話、システムメッセージ、既存セッションの履歴）を持たない単独の質問のみ、意味的キャッシュの対象にする
+        semantic_cache = get_semantic_cache()
+        semantic_cacheable = semantic_cache.enabled and len(data.messages) == 1 and bool(latest_user_message) and session is None
+        semantic_vector = None
+        
         # ユーザー定義記憶の意図を検出（「〇〇を覚えて」など）
         if latest_user_message and user_memory_enabled:
             is_memory_op, op_type, content = detect_memory_intent(latest_user_message)
@@ -125,252 +374,286 @@ async def chat_completion(request: Request, data: ChatCompletionRequest):
                     # 記憶操作のヘルプを表示
                     response_text = get_memory_help_text()
                 
-                # メモリ機能が有効な場合、ユーザーメッセージとアシスタント応答を保存
-                if memory_enabled:
-                    add_message(session_id, "user", latest_user_message)
-                    add_message(session_id, "assistant", response_text)
-                
-                # 応答メッセージを作成
-                response = ChatCompletionResponse(
-                    message=Message(
-                        role="assistant",
-                        content=response_text
-                    ),
-                    usage={
-                        "prompt_tokens": 0,
-                        "completion_tokens": 0,
-                        "total_tokens": 0,
-                        "time_seconds": round(time.time() - start_time, 2),
-                    },
-                    session_id=session_id
+                return await _tool_response(
+                    request, data, _text_steps(response_text), session_id, memory_enabled, latest_user_message, start_time
                 )
-                
-                return response
+        
+        # 言い換えられた同じ質問に答えたことがあれば、意図の検出と生成を行わずにその回答を返す
+        # （記憶操作はモデルを呼ばずに検出できるため、それより後、意図の判定より前に問い合わせる）
+        if semantic_cacheable:
+            semantic_vector = await semantic_cache.embed(latest_user_message)
+            semantic_hit = semantic_cache.lookup(semantic_vector)
+            if semantic_hit is not None:
+                return _semantic_cache_response(semantic_hit, http_response, data.stream, session_id, memory_enabled, latest_user_message, start_time)
+            http_response.headers["X-Semantic-Cache"] = "miss"
+        
+        # 通常のチャットの入力は、投機的な生成を意図の判定と並行して開始できるよう、判定の前に作成する
+        # ユーザー定義記憶をシステムメッセージに追加する
+        memory_text = _get_user_memory_text() if user_memory_enabled else ""
+        history_session_id = session_id if memory_enabled else None
+        
+        if settings.USE_CHAT_API:
+            # 構造化メッセージのまま送信し、バックエンド側で会話プレフィックスのKVキャッシュを再利用させる
+            chat_input = chat_model.build_messages(chat_messages, history_session_id, memory_text or None, data.max_tokens)
+            prompt = "\n".join(msg["content"] for msg in chat_input)
+        else:
+            chat_input = None
+            # メモリ情報はシステムメッセージの後かつ会話前に配置し、トークン予算にも含める
+            prompt = chat_model.format_prompt(chat_messages, history_session_id, memory_text or None, data.max_tokens)
+        
+        generation_params = {
+            "max_tokens": data.max_tokens,
+            "temperature": data.temperature,
+            "top_p": data.top_p,
+            "top_k": data.top_k,
+            # 複数のOllamaインスタンスがある場合は、会話履歴のKVキャッシュが残っているインスタンスを優先させる
+            "session_id": history_session_id,
+            # モデルが次のユーザーの発話を書き始めたら、そこで生成を止める
+            "stop": merge_stop_sequences(ROLE_STOP_SEQUENCES, data.stop),
+            "seed": data.seed,
+        }
+        
+        # 決定的な生成であれば、整形済みの入力（会話履歴とメモリを含む）が同じ応答をキャッシュから返す
+        cache = get_response_cache()
+        cache_params = cache.sampling_params(
+            data.max_tokens, data.temperature, data.top_p, data.top_k, generation_params["stop"], data.seed
+        )
+        cache_key = None
+        if cache.is_cacheable(cache_params):
+            cache_key = cache.make_key("chat", chat_input if chat_input is not None else prompt, cache_params)
+        cached = await cache.aget(cache_key) if cache_key else None
+        cache_headers = {"X-Response-Cache": "hit" if cached else "miss"} if cache_key else {}
+        
+        # ツールを使う意図がなかった場合の生成を、意図の判定と並行して開始しておく（判定の結果ツールを使う場合は中止する）
+        if settings.SPECULATIVE_CHAT_ENABLED and latest_user_message and cached is None:
+            speculation_usage = {}
+            if chat_input is not None:
+                speculative_chunks = model.stream_chat(chat_input, usage=speculation_usage, **generation_params)
+            else:
+                speculative_chunks = model.stream(prompt, usage=speculation_usage, **generation_params)
+            with generation_call_site("chat"):
+                speculation = get_chat_speculator().start(speculative_chunks, speculation_usage)
         
         # ファイル操作の意図を検出
         if latest_user_message:
+            # 統合ルーターが有効な場合は、最初の問い合わせですべての意図を1回のモデル呼び出しで判定する
+            intents = get_message_intents(latest_user_message)
             files_assistant = get_files_assistant()
-            is_file_op, op_type, op_params = files_assistant.detect_file_operation(latest_user_message)
+            is_file_op, op_type, op_params = await intents.file_operation()
             
             if is_file_op:
-                # ファイル操作を実行
-                result = files_assistant.execute_file_operation(op_type, op_params)
-                
-                # 操作結果に基づいて応答を生成
-                if result.get("success", False):
-                    if op_type == "list_files":
-                        files = result.get("files", [])
-                        current_dir = result.get("current_dir", "")
-                        
-                        files_text = ""
-                        for file in files:
-                            file_type = "📁 " if file.get("is_dir") else "📄 "
-                            size_info = f" ({file.get('size', 0)} bytes)" if not file.get("is_dir") else ""
-                            files_text += f"{file_type}{file.get('name')}{size_info}\n"
-                        
-                        response_text = f"## ディレクトリ: {current_dir or '/'}\n\n{files_text}"
-                        
-                    elif op_type == "read_file":
-                        content = result.get("content", "")
-                        path = result.get("path", "")
-                        
-                        response_text = f"## ファイル: {path}\n\n```\n{content}\n```"
-                        
-                    else:
-                        response_text = f"ファイル操作が完了しました: {result.get('message', '')}"
-                else:
-                    response_text = f"エラーが発生しました: {result.get('message', '不明なエラー')}"
+                if speculation is not None:
+                    await speculation.cancel()
                 
-                # メモリ機能が有効な場合、ユーザーメッセージとアシスタント応答を保存
-                if memory_enabled:
-                    add_message(session_id, "user", latest_user_message)
-                    add_message(session_id, "assistant", response_text)
+                async def file_operation_steps():
+                    yield _progress("file_operation", f"ファイル操作（{op_type}）を実行しています…", operation_type=op_type)
+                    # ファイル操作を実行
+                    task = asyncio.ensure_future(run_in_threadpool(files_assistant.execute_file_operation, op_type, op_params))
+                    async for progress in _wait_with_progress(task, "file_operation"):
+                        yield progress
+                    result = task.result()
+                    if result.get("success", False) and op_type == "list_files":
+                        count = len(result.get("files", []))
+                        yield _progress("file_operation", f"{count}件見つかりました", results=count)
+                    
+                    # 操作結果に基づいて応答を生成
+                    yield _format_file_operation_result(op_type, result)
                 
-                # 応答メッセージを作成
-                response = ChatCompletionResponse(
-                    message=Message(
-                        role="assistant",
-                        content=response_text
-                    ),
-                    usage={
-                        "prompt_tokens": 0,
-                        "completion_tokens": 0,
-                        "total_tokens": 0,
-                        "time_seconds": round(time.time() - start_time, 2),
-                    },
-                    session_id=session_id
+                return await _tool_response(
+                    request, data, file_operation_steps(), session_id, memory_enabled, latest_user_message, start_time
                 )
-                
-                return response
             
             # 推論意図の検出
-            is_reasoning, reasoning_type, reasoning_params = smart_assistant.detect_reasoning_intent(latest_user_message)
+            is_reasoning, reasoning_type, reasoning_params = await intents.reasoning()
             if is_reasoning:
-                # 推論を実行
-                result = smart_assistant.perform_reasoning(reasoning_type, reasoning_params)
-                
-                # 推論結果を整形
-                response_text = smart_assistant.format_reasoning_result(result)
+                if speculation is not None:
+                    await speculation.cancel()
                 
-                # メモリ機能が有効な場合、ユーザーメッセージとアシスタント応答を保存
-                if memory_enabled:
-                    add_message(session_id, "user", latest_user_message)
-                    add_message(session_id, "assistant", response_text)
+                async def reasoning_steps():
+                    yield _progress("reasoning", "推論しています…", reasoning_type=reasoning_type)
+                    # 推論を実行（結果はJSONで受け取ってから整形するため、完了までは経過時間の進捗を送る）
+                    task = asyncio.ensure_future(run_in_threadpool(smart_assistant.perform_reasoning, reasoning_type, reasoning_params))
+                    async for progress in _wait_with_progress(task, "reasoning"):
+                        yield progress
+                    
+                    # 推論結果を整形
+                    yield smart_assistant.format_reasoning_result(task.result())
                 
-                # 応答メッセージを作成
-                response = ChatCompletionResponse(
-                    message=Message(
-                        role="assistant",
-                        content=response_text
-                    ),
-                    usage={
-                        "prompt_tokens": 0,
-                        "completion_tokens": 0,
-                        "total_tokens": 0,
-                        "time_seconds": round(time.time() - start_time, 2),
-                    },
-                    session_id=session_id
+                return await _tool_response(
+                    request, data, reasoning_steps(), session_id, memory_enabled, latest_user_message, start_time
                 )
-                
-                return response
             
             # Web検索の意図を検出
-            is_web_search, search_query = smart_assistant.detect_web_search_intent(latest_user_message)
+            is_web_search, search_query = await intents.web_search()
             if is_web_search and search_query:
-                # Web検索結果を含めた応答を生成
-                response_text = smart_assistant.enhance_response_with_search(search_query, latest_user_message)
+                if speculation is not None:
+                    await speculation.cancel()
+                search_usage = {}
                 
-                # メモリ機能が有効な場合、ユーザーメッセージとアシスタント応答を保存
-                if memory_enabled:
-                    add_message(session_id, "user", latest_user_message)
-                    add_message(session_id, "assistant", response_text)
+                async def web_search_steps():
+                    yield _progress("search", f"「{search_query}」を検索しています…", query=search_query)
+                    task = asyncio.ensure_future(run_in_threadpool(smart_assistant.perform_web_search, search_query))
+                    async for progress in _wait_with_progress(task, "search"):
+                        yield progress
+                    search_results = task.result()
+                    
+                    response_chunks = []
+                    direct_response = smart_assistant.get_direct_search_response(search_results)
+                    if direct_response is not None:
+                        response_chunks.append(direct_response)
+                        yield direct_response
+                    else:
+                        count = len(search_results.get("results", []))
+                        yield _progress("search", f"検索結果 {count}件", results=count)
+                        yield _progress("search", "回答を生成しています…")
+                        # Web検索結果を含めた応答を、バックエンドから届いた順に返す
+                        chunks = chat_model.stream_response(
+                            smart_assistant.build_search_messages(search_results, latest_user_message),
+                            usage=search_usage,
+                        )
+                        with generation_call_site("search"):
+                            chunks = await prime_stream(chunks)
+                        try:
+                            async for text_chunk in chunks:
+                                response_chunks.append(text_chunk)
+                                yield text_chunk
+                        finally:
+                            await chunks.aclose()
+                    
+                    # 検索結果から生成した回答だけを保存する（検索エラーは次の同じ質問で検索をやり直し、
+                    # 日付などの特殊データは時刻によって変わるため保存しない）
+                    if direct_response is None:
+                        semantic_cache.store(semantic_vector, latest_user_message, response_chunks, search_usage)
                 
-                # 応答メッセージを作成
-                response = ChatCompletionResponse(
-                    message=Message(
-                        role="assistant",
-                        content=response_text
-                    ),
-                    usage={
-                        "prompt_tokens": 0,
-                        "completion_tokens": 0,
-                        "total_tokens": 0,
-                        "time_seconds": round(time.time() - start_time, 2),
-                    },
-                    session_id=session_id
+                return await _tool_response(
+                    request, data, web_search_steps(), session_id, memory_enabled, latest_user_message, start_time, search_usage
                 )
-                
-                return response
             
             # GitHub操作の意図を検出
-            is_github_op, op_type, op_params = smart_assistant.detect_github_operation_intent(latest_user_message)
+            is_github_op, op_type, op_params = await intents.github_operation()
             if is_github_op:
-                # GitHub操作を実行
-                result = smart_assistant.perform_github_operation(op_type, op_params)
+                if speculation is not None:
+                    await speculation.cancel()
                 
-                # 操作結果を整形
-                response_text = smart_assistant.format_github_operation_result(op_type, result)
-                
-                # メモリ機能が有効な場合、ユーザーメッセージとアシスタント応答を保存
-                if memory_enabled:
-                    add_message(session_id, "user", latest_user_message)
-                    add_message(session_id, "assistant", response_text)
+                async def github_operation_steps():
+                    yield _progress("github_operation", f"GitHub操作（{op_type}）を実行しています…", operation_type=op_type)
+                    # GitHub操作を実行
+                    task = asyncio.ensure_future(run_in_threadpool(smart_assistant.perform_github_operation, op_type, op_params))
+                    async for progress in _wait_with_progress(task, "github_operation"):
+                        yield progress
+                    result = task.result()
+                    if result.get("success") and op_type in ("list_repos", "search_repos"):
+                        items = result.get("data") or []
+                        count = len(items.get("items", []) if isinstance(items, dict) else items)
+                        yield _progress("github_operation", f"{count}件見つかりました", results=count)
+                    
+                    # 操作結果を整形
+                    yield smart_assistant.format_github_operation_result(op_type, result)
                 
-                # 応答メッセージを作成
-                response = ChatCompletionResponse(
-                    message=Message(
-                        role="assistant",
-                        content=response_text
-                    ),
-                    usage={
-                        "prompt_tokens": 0,
-                        "completion_tokens": 0,
-                        "total_tokens": 0,
-                        "time_seconds": round(time.time() - start_time, 2),
-                    },
-                    session_id=session_id
+                return await _tool_response(
+                    request, data, github_operation_steps(), session_id, memory_enabled, latest_user_message, start_time
                 )
-                
-                return response
+        
+        if memory_text:
+            # ユーザー定義記憶に合わせた回答は、他の利用者の同じ質問には返さない
+            semantic_vector = None
+        if semantic_vector is not None:
+            cache_headers["X-Semantic-Cache"] = "miss"
         
         if data.stream:
+            if cached is not None:
+                chunks = cache.replay(cached)
+                stream_usage = dict(cached.usage)
+            else:
+                if speculation is not None:
+                    chunks = speculation.adopt()
+                    stream_usage = speculation.usage
+                else:
+                    stream_usage = {}
+                    if chat_input is not None:
+                        chunks = model.stream_chat(chat_input, usage=stream_usage, **generation_params)
+                    else:
+                        chunks = model.stream(prompt, usage=stream_usage, **generation_params)
+                # 実行枠を確保できない場合は、StreamingResponse を返す前に503を返す
+                with generation_call_site("chat"):
+                    chunks = await prime_stream(chunks)
+                if cache_key:
+                    chunks = cache.record(cache_key, chunks, stream_usage)
+                if semantic_vector is not None:
+                    chunks = semantic_cache.record(semantic_vector, latest_user_message, chunks, stream_usage)
+            
             async def streaming_generator():
+                response_chunks = []
                 try:
-                    prompt = chat_model.format_prompt(chat_messages, session_id if memory_enabled else None)
-                    for text_chunk in model.generate_text(
-                        prompt=prompt,
-                        max_tokens=data.max_tokens,
-                        temperature=data.temperature,
-                        top_p=data.top_p,
-                        top_k=data.top_k,
-                        stream=True,
-                    ):
+                    async for text_chunk in chunks:
+                        # クライアントが切断した場合は、バックエンドの生成を止めて終了する
+                        if await request.is_disconnected():
+                            logger.info("クライアントが切断したため生成を中止します")
+                            break
+                        response_chunks.append(text_chunk)
                         yield f"data: {text_chunk}\n\n"
                 except Exception as e:
                     logger.error(f"ストリーミング生成中にエラーが発生しました: {str(e)}")
                     yield f"data: [ERROR] {str(e)}\n\n"
                 finally:
+                    await chunks.aclose()
                     # ストリーミング完了後、メッセージを保存
+                    # 次のターンで同じ会話プレフィックスを送れるよう、応答も履歴に残す
                     if memory_enabled:
                         try:
                             add_message(session_id, "user", latest_user_message)
-                            # ストリーミングの場合、応答全体を取得できないため、保存は行わない
+                            if response_chunks:
+                                add_message(session_id, "assistant", "".join(response_chunks))
                         except Exception as save_error:
                             logger.error(f"メッセージ保存中にエラーが発生しました: {str(save_error)}")
                     
+                    if data.include_usage:
+                        usage_event = {
+                            "prompt_tokens": stream_usage.get("prompt_tokens", 0),
+                            "completion_tokens": stream_usage.get("completion_tokens", 0),
+                            "time_seconds": round(time.time() - start_time, 2),
+                            "cached": cached is not None,
+                            "timing": stream_usage.get("timing"),
+                        }
+                        yield f"event: usage\ndata: {json.dumps(usage_event, ensure_ascii=False)}\n\n"
+                    
                     # ストリーミング終了を通知
                     yield "data: [DONE]\n\n"
             
             return StreamingResponse(
                 streaming_generator(),
                 media_type="text/event-stream",
+                headers=cache_headers,
             )
         else:
-            # プロンプトを整形してモデルに送信
-            prompt = chat_model.format_prompt(chat_messages, session_id if memory_enabled else None)
-
-            # ユーザー定義記憶をプロンプトに追加
-            if user_memory_enabled:
-                try:
-                    memories = get_all_user_memories()
-                    
-                    if memories:
-                        memory_text = "以下はユーザーが記憶として保存した情報です：\n"
-                        for memory in memories:
-                            memory_text += f"・{memory['key']}: {memory['value']}\n"
-                        memory_text += "\n必要に応じて上記の情報を参照して応答を生成してください。\n\n"
-                        
-                        # プロンプトにメモリ情報を追加（システムメッセージの後かつ会話前に配置）
-                        if "あなたは役立つAIアシスタントです。" in prompt:
-                            prompt = prompt.replace(
-                                "あなたは役立つAIアシスタントです。以下の会話を元に最新の質問に回答してください。\n\n",
-                                f"あなたは役立つAIアシスタントです。以下の会話を元に最新の質問に回答してください。\n\n{memory_text}"
-                            )
-                except Exception as e:
-                    logger.warning(f"ユーザー定義記憶の取得中にエラーが発生しました: {str(e)}")
-            
-            response_text = model.generate_text(
-                prompt=prompt,
-                max_tokens=data.max_tokens,
-                temperature=data.temperature,
-                top_p=data.top_p,
-                top_k=data.top_k,
-                stream=False,
-            )
+            http_response.headers.update(cache_headers)
+            if cached is not None:
+                response_text = cached.text
+                usage = dict(cached.usage)
+            else:
+                usage = {}
+                with generation_call_site("chat"):
+                    if speculation is not None:
+                        response_text = "".join([text_chunk async for text_chunk in speculation.adopt()])
+                        usage = speculation.usage
+                    elif chat_input is not None:
+                        response_text = await model.chat(chat_input, usage=usage, **generation_params)
+                    else:
+                        response_text = await model.generate(prompt, usage=usage, **generation_params)
+                if cache_key:
+                    await cache.aput(cache_key, [response_text], usage)
+                semantic_cache.store(semantic_vector, latest_user_message, [response_text], usage)
             
             # メモリ機能が有効な場合、ユーザーメッセージとアシスタント応答を保存
             if memory_enabled:
                 add_message(session_id, "user", latest_user_message)
                 add_message(session_id, "assistant", response_text)
             
-            # トークン使用量の計算（これは推定です）
-            try:
-                input_tokens = len(tokenizer.encode(prompt))
-                output_tokens = len(tokenizer.encode(response_text))
-            except:
-                # トークン化に失敗した場合、単語数で代用
-                input_tokens = len(prompt.split())
-                output_tokens = len(response_text.split())
+            # トークン使用量（バックエンドが報告した値を優先し、なければトークナイザーで数える）
+            if not usage.get("prompt_tokens"):
+                usage["prompt_tokens"] = get_token_counter().count_messages(chat_input) if chat_input is not None else count_tokens(prompt)
+            input_tokens = usage["prompt_tokens"]
+            output_tokens = usage.get("completion_tokens") or count_tokens(response_text)
             
             # レスポンスの作成
             response = ChatCompletionResponse(
@@ -383,18 +666,26 @@ async def chat_completion(request: Request, data: ChatCompletionRequest):
                     "completion_tokens": output_tokens,
                     "total_tokens": input_tokens + output_tokens,
                     "time_seconds": round(time.time() - start_time, 2),
+                    "cached": cached is not None,
+                    "timing": usage.get("timing"),
                 },
                 session_id=session_id
             )
             
             return response
     
+    except ModelBusyError:
+        raise
     except Exception as e:
         logger.error(f"チャット生成中にエラーが発生しました: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"チャット生成中にエラーが発生しました: {str(e)}",
         )
+    finally:
+        # 採用しなかった投機的な生成（記憶操作・意味的キャッシュのヒット・エラーなど）は止める
+        if speculation is not None:
+            await speculation.cancel()
 
 @router.post(
     "/chat/new-session",
@@ -433,7 +724,8 @@ async def chat_with_new_session(request: Request, data: ChatCompletionRequest):
             session_title = chat_messages[0].content[:20] + "..."
         
         # 新しいセッションで応答を生成
-        result = chat_model.generate_with_new_session(
+        result = await run_in_threadpool(
+            chat_model.generate_with_new_session,
             messages=chat_messages,
             title=session_title,
             max_tokens=data.max_tokens,
@@ -445,13 +737,27 @@ async def chat_with_new_session(request: Request, data: ChatCompletionRequest):
         
         if data.stream:
             async def streaming_generator():
+                response_iterator = result["response"]
                 try:
-                    for text_chunk in result["response"]:
+                    async for text_chunk in iterate_in_threadpool(response_iterator):
+                        # クライアントが切断した場合は、バックエンドの生成を止めて終了する
+                        if await request.is_disconnected():
+                            logger.info("クライアントが切断したため生成を中止します")
+                            break
                         yield f"data: {text_chunk}\n\n"
                 except Exception as e:
                     logger.error(f"ストリーミング生成中にエラーが発生しました: {str(e)}")
                     yield f"data: [ERROR] {str(e)}\n\n"
                 finally:
+                    # HFバックエンドは cancel で生成を止め、Ollamaはジェネレータを閉じてHTTPストリームを切断する
+                    if hasattr(response_iterator, "cancel"):
+                        response_iterator.cancel()
+                    elif hasattr(response_iterator, "close"):
+                        try:
+                            response_iterator.close()
+                        except ValueError:
+                            # 別スレッドで読み出し中の場合は、読み出しの終了後に閉じられる
+                            pass
                     # セッションIDを含めて終了を通知
                     yield f"data: [SESSION]{result['session_id']}\n\n"
                     yield "data: [DONE]\n\n"
@@ -465,17 +771,9 @@ async def chat_with_new_session(request: Request, data: ChatCompletionRequest):
             response_text = result["response"]
             session_id = result["session_id"]
             
-            # トークン使用量の計算（推定）
-            try:
-                tokenizer = get_tokenizer()
-                prompt = chat_model.format_prompt(chat_messages)
-                input_tokens = len(tokenizer.encode(prompt))
-                output_tokens = len(tokenizer.encode(response_text))
-            except:
-                # トークン化に失敗した場合、単語数で代用
-                prompt = " ".join([msg.content for msg in chat_messages])
-                input_tokens = len(prompt.split())
-                output_tokens = len(response_text.split())
+            # トークン使用量の計算（同期APIではバックエンドの値を受け取れないため、トークナイザーで数える）
+            input_tokens = count_tokens(chat_model.format_prompt(chat_messages))
+            output_tokens = count_tokens(response_text)
             
             # レスポンスの作成
             response = ChatCompletionResponse(
@@ -494,6 +792,8 @@ async def chat_with_new_session(request: Request, data: ChatCompletionRequest):
             
             return response
     
+    except ModelBusyError:
+        raise
     except Exception as e:
         logger.error(f"チャット生成中にエラーが発生しました: {str(e)}")
         raise HTTPException(
@@ -1,16 +1,30 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Union
+import base64
 import logging
 import time
+import numpy as np
 
-from ..models.model_factory import get_model, get_tokenizer
-from ..models.schemas import EmbeddingRequest, EmbeddingResponse
+from ..models.model_factory import get_model
+from ..models.schemas import EmbeddingRequest, EmbeddingResponse, EmbeddingData
 from ..core.dependencies import check_rate_limit
+from ..core.tokenizer import count_tokens
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+def encode_embedding(vector: np.ndarray, encoding_format: str) -> Union[List[float], str]:
+    """
+    埋め込みベクトルを指定された形式に変換する
+    
+    base64はリトルエンディアンのfloat32バイト列をエンコードしたもので、
+    floatのJSONリストより大幅に小さくなる
+    """
+    if encoding_format == "base64":
+        return base64.b64encode(np.asarray(vector, dtype="<f4").tobytes()).decode("ascii")
+    return vector.tolist()
+
 @router.post(
     "/embeddings", 
     response_model=EmbeddingResponse,
@@ -22,26 +36,28 @@ async def get_embeddings(request: Request, data: EmbeddingRequest):
     """
     テキスト埋め込みエンドポイント
     
-    * text: 埋め込みベクトルを取得するテキスト
+    * text: 埋め込みベクトルを取得するテキスト（後方互換用）
+    * input: 埋め込みベクトルを取得するテキスト、またはテキストのリスト（まとめて1回のバッチで計算）
+    * encoding_format: "float"（デフォルト）または "base64"（リトルエンディアンfloat32）
     """
     start_time = time.time()
     
     try:
         model = get_model()
-        tokenizer = get_tokenizer()
         
-        embeddings = model.get_embeddings(data.text)
+        texts = data.texts
+        embeddings = await model.embed_batch(texts)
+        
+        # トークン使用量の計算（キャッシュから返したテキストも含め、入力全体のトークン数）
+        input_tokens = sum(count_tokens(text) for text in texts)
         
-        # トークン使用量の計算（これは推定です）
-        try:
-            input_tokens = len(tokenizer.encode(data.text))
-        except:
-            # トークン化に失敗した場合、単語数で代用
-            input_tokens = len(data.text.split())
+        encoded = [encode_embedding(vector, data.encoding_format) for vector in embeddings]
         
         # レスポンスの作成
         response = EmbeddingResponse(
-            embedding=embeddings,
+            embedding=encoded[0] if len(encoded) == 1 else None,
+            data=[EmbeddingData(index=i, embedding=vector) for i, vector in enumerate(encoded)],
+            encoding_format=data.encoding_format,
             usage={
                 "prompt_tokens": input_tokens,
                 "total_tokens": input_tokens,
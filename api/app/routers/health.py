@@ -1,12 +1,24 @@
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
 from typing import Dict, Any
+import asyncio
+import logging
 
 from ..models.model_factory import get_model
+from ..models.intent_router import get_intent_router
+from ..models.speculation import get_chat_speculator
 from ..models.schemas import HealthResponse, ModelInfoResponse
 from ..core.config import settings
+from ..core.metrics import get_generation_metrics
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# 実行中のバックグラウンドウォームアップ
+_warmup_task = None
+
 @router.get(
     "/", 
     response_model=HealthResponse,
@@ -18,7 +30,7 @@ async def health_check():
     API サーバーのヘルスステータスを返すエンドポイント
     """
     model = get_model()
-    model_info = model.get_model_info()
+    model_info = await run_in_threadpool(model.get_model_info)
     
     return HealthResponse(
         status="ok",
@@ -37,4 +49,94 @@ async def model_info():
     読み込まれているモデルの情報を返すエンドポイント
     """
     model = get_model()
-    return model.get_model_info()
+    return await run_in_threadpool(model.get_model_info)
+
+
+@router.get(
+    "/ready",
+    summary="レディネスチェック",
+    description="モデルがウォームアップ済みでメモリに読み込まれている場合のみ200を返します",
+)
+async def readiness_check(response: Response):
+    """
+    ロードバランサー向けのレディネスチェック
+    
+    モデルがアンロードされている場合は503を返し、バックグラウンドで再ウォームアップを開始する
+    """
+    global _warmup_task
+    
+    model = get_model()
+    model_info = await run_in_threadpool(model.get_model_info)
+    ready = model_info["status"] == "loaded" and bool(model_info.get("warm"))
+    
+    if not ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        if _warmup_task is None or _warmup_task.done():
+            logger.info("モデルがウォームアップされていないため、再ウォームアップを開始します")
+            _warmup_task = asyncio.create_task(model.warmup())
+    
+    return {
+        "ready": ready,
+        "status": model_info["status"],
+        "memory": model_info.get("memory"),
+    }
+
+@router.get(
+    "/backends",
+    summary="バックエンドの状態",
+    description="Ollamaインスタンスごとの状態（正常かどうか、処理中のリクエスト数、平均処理時間）と、ヘッジの発生率・勝敗の統計を取得します",
+)
+async def backend_status():
+    """
+    バックエンドのインスタンスごとの状態とヘッジの統計を返すエンドポイント
+    """
+    model = get_model()
+    return {
+        "backends": await run_in_threadpool(model.get_backend_stats),
+        "hedging": model.get_hedge_stats(),
+    }
+
+@router.get(
+    "/metrics",
+    summary="生成の計測値",
+    description="生成ごとの待ち時間、最初のトークンまでの時間（TTFT）、デコード速度、合計時間のヒストグラムを、呼び出し元とバックエンド別に取得します",
+)
+async def generation_metrics():
+    """
+    生成の計測値のヒストグラムと分位点を返すエンドポイント
+    """
+    return get_generation_metrics().get_stats()
+
+@router.get(
+    "/metrics/prometheus",
+    summary="生成の計測値（Prometheus形式）",
+    description="生成の計測値のヒストグラムを Prometheus のテキスト形式で取得します",
+    response_class=PlainTextResponse,
+)
+async def generation_metrics_prometheus():
+    """
+    生成の計測値を Prometheus のテキスト形式で返すエンドポイント
+    """
+    return PlainTextResponse(get_generation_metrics().render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@router.get(
+    "/intents",
+    summary="意図の判定の統計",
+    description="チャットの意図の判定（統合ルーター）の回数、意図ごとの件数、JSONをパースできなかった回数、平均処理時間を取得します",
+)
+async def intent_stats():
+    """
+    意図の判定の統計を返すエンドポイント
+    """
+    return get_intent_router().get_stats()
+
+@router.get(
+    "/speculation",
+    summary="投機的な生成の統計",
+    description="意図の判定と並行して開始した通常のチャットの生成について、採用・中止の件数、中止した割合（無駄になった生成の割合）、最初のトークンまでの時間の推定短縮量を取得します",
+)
+async def speculation_stats():
+    """
+    投機的な生成の統計を返すエンドポイント
+    """
+    return get_chat_speculator().get_stats()
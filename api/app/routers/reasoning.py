@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi.concurrency import run_in_threadpool
 from typing import Dict, List, Optional, Any
 import logging
 import time
@@ -71,7 +72,8 @@ async def step_by_step_reasoning(request: Request, data: StepByStepRequest):
             data.detail_level = "medium"
         
         # 推論の実行
-        result = reasoning_engine.perform_step_by_step_reasoning(
+        result = await run_in_threadpool(
+            reasoning_engine.perform_step_by_step_reasoning,
             question=data.question,
             context=data.context,
             detail_level=data.detail_level,
@@ -120,7 +122,8 @@ async def evaluate_statement(request: Request, data: EvaluateStatementRequest):
             data.detail_level = "medium"
         
         # 評価の実行
-        result = reasoning_engine.evaluate_statement(
+        result = await run_in_threadpool(
+            reasoning_engine.evaluate_statement,
             statement=data.statement,
             context=data.context,
             detail_level=data.detail_level,
@@ -178,7 +181,8 @@ async def compare_options(request: Request, data: CompareOptionsRequest):
             data.detail_level = "medium"
         
         # 比較の実行
-        result = reasoning_engine.compare_options(
+        result = await run_in_threadpool(
+            reasoning_engine.compare_options,
             question=data.question,
             options=data.options,
             criteria=data.criteria,
@@ -3,10 +3,15 @@ from fastapi.responses import StreamingResponse
 from typing import Dict, List, Optional, Any
 import logging
 import time
+import json
 
-from ..models.model_factory import get_model, get_tokenizer
+from ..models.model_factory import get_model
+from ..models.generation_pool import ModelBusyError, prime_stream
 from ..models.schemas import TextGenerationRequest, TextGenerationResponse
 from ..core.dependencies import check_rate_limit
+from ..core.tokenizer import count_tokens
+from ..core.response_cache import get_response_cache
+from ..core.metrics import generation_call_site
 
 logger = logging.getLogger(__name__)
 
@@ -19,7 +24,7 @@ router = APIRouter()
     description="モデルを使用してテキストを生成します",
     dependencies=[Depends(check_rate_limit)],
 )
-async def generate_text(request: Request, data: TextGenerationRequest):
+async def generate_text(request: Request, response: Response, data: TextGenerationRequest):
     """
     テキスト生成エンドポイント
     
@@ -29,67 +34,115 @@ async def generate_text(request: Request, data: TextGenerationRequest):
     * top_p: top-p サンプリングのパラメータ
     * top_k: top-k サンプリングのパラメータ
     * stream: ストリーミング生成を行うかどうか
+    * stop: 生成を止める文字列のリスト（出力には含まれない）
+    * seed: 乱数シード
+    * include_usage: ストリーミングの最後に使用量と計測値を usage イベントで送るかどうか
+    
+    temperature が0またはシードを指定したリクエストは、同じ入力の応答をキャッシュから返す
+    （X-Response-Cache ヘッダーに hit / miss を付ける）
     """
     start_time = time.time()
     
     try:
         model = get_model()
-        tokenizer = get_tokenizer()
+        
+        # 決定的な生成であれば、同じプロンプトと設定の応答をキャッシュから返す
+        cache = get_response_cache()
+        params = cache.sampling_params(data.max_tokens, data.temperature, data.top_p, data.top_k, data.stop, data.seed)
+        cache_key = cache.make_key("generate", data.prompt, params) if cache.is_cacheable(params) else None
+        cached = await cache.aget(cache_key) if cache_key else None
+        cache_headers = {"X-Response-Cache": "hit" if cached else "miss"} if cache_key else {}
         
         if data.stream:
-            async def streaming_generator():
-                try:
-                    for text_chunk in model.generate_text(
+            usage = {}
+            if cached is not None:
+                chunks = cache.replay(cached)
+                usage = dict(cached.usage)
+            else:
+                # 実行枠を確保できない場合は、StreamingResponse を返す前に503を返す
+                with generation_call_site("generate"):
+                    chunks = await prime_stream(model.stream(
                         prompt=data.prompt,
                         max_tokens=data.max_tokens,
                         temperature=data.temperature,
                         top_p=data.top_p,
                         top_k=data.top_k,
-                        stream=True,
-                    ):
+                        stop=data.stop,
+                        seed=data.seed,
+                        usage=usage,
+                    ))
+                if cache_key:
+                    chunks = cache.record(cache_key, chunks, usage)
+            
+            async def streaming_generator():
+                try:
+                    async for text_chunk in chunks:
+                        # クライアントが切断した場合は、バックエンドの生成を止めて終了する
+                        if await request.is_disconnected():
+                            logger.info("クライアントが切断したため生成を中止します")
+                            break
                         yield f"data: {text_chunk}\n\n"
                 except Exception as e:
                     logger.error(f"ストリーミング生成中にエラーが発生しました: {str(e)}")
                     yield f"data: [ERROR] {str(e)}\n\n"
                 finally:
+                    await chunks.aclose()
+                    if data.include_usage:
+                        stream_usage = {
+                            "prompt_tokens": usage.get("prompt_tokens", 0),
+                            "completion_tokens": usage.get("completion_tokens", 0),
+                            "time_seconds": round(time.time() - start_time, 2),
+                            "cached": cached is not None,
+                            "timing": usage.get("timing"),
+                        }
+                        yield f"event: usage\ndata: {json.dumps(stream_usage, ensure_ascii=False)}\n\n"
                     yield "data: [DONE]\n\n"
             
             return StreamingResponse(
                 streaming_generator(),
                 media_type="text/event-stream",
+                headers=cache_headers,
             )
         else:
-            generated_text = model.generate_text(
-                prompt=data.prompt,
-                max_tokens=data.max_tokens,
-                temperature=data.temperature,
-                top_p=data.top_p,
-                top_k=data.top_k,
-                stream=False,
-            )
+            response.headers.update(cache_headers)
+            if cached is not None:
+                generated_text = cached.text
+                usage = dict(cached.usage)
+            else:
+                usage = {}
+                with generation_call_site("generate"):
+                    generated_text = await model.generate(
+                        prompt=data.prompt,
+                        max_tokens=data.max_tokens,
+                        temperature=data.temperature,
+                        top_p=data.top_p,
+                        top_k=data.top_k,
+                        stop=data.stop,
+                        seed=data.seed,
+                        usage=usage,
+                    )
+                if cache_key:
+                    await cache.aput(cache_key, [generated_text], usage)
             
-            # トークン使用量の計算（これは推定です）
-            try:
-                input_tokens = len(tokenizer.encode(data.prompt))
-                output_tokens = len(tokenizer.encode(generated_text))
-            except:
-                # トークン化に失敗した場合、単語数で代用
-                input_tokens = len(data.prompt.split())
-                output_tokens = len(generated_text.split())
+            # トークン使用量（バックエンドが報告した値を優先し、なければトークナイザーで数える）
+            input_tokens = usage.get("prompt_tokens") or count_tokens(data.prompt)
+            output_tokens = usage.get("completion_tokens") or count_tokens(generated_text)
             
             # レスポンスの作成
-            response = TextGenerationResponse(
+            return TextGenerationResponse(
                 text=generated_text,
                 usage={
                     "prompt_tokens": input_tokens,
                     "completion_tokens": output_tokens,
                     "total_tokens": input_tokens + output_tokens,
                     "time_seconds": round(time.time() - start_time, 2),
+                    "cached": cached is not None,
+                    "timing": usage.get("timing"),
                 }
             )
-            
-            return response
     
+    except ModelBusyError:
+        raise
     except Exception as e:
         logger.error(f"テキスト生成中にエラーが発生しました: {str(e)}")
         raise HTTPException(
@@ -0,0 +1,174 @@
+"""
+app.main のコールドスタート時のインポート時間を計測するベンチマーク
+
+`python -X importtime -c "import app.main"` を別プロセスで実行し、その出力を集計して
+インポート時間の合計と、時間のかかっているモジュールを表示する。
+上限時間や読み込まれてはいけないモジュールを指定すると、超えた場合に終了コード1で終了するため、
+起動時間の劣化の検出に使える。
+
+使用例（api ディレクトリで実行）:
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --backend hf --top 20
+    python benchmarks/import_time.py --repeat 5 --max-ms 1500 --forbid torch transformers
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List, Any, Optional
+
+# api ディレクトリ（app パッケージの親）
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Ollamaのみの構成で読み込まれてはいけないモジュール
+OLLAMA_FORBIDDEN_MODULES = ["torch", "transformers"]
+
+def run_importtime(module: str, backend: str) -> Dict[str, Dict[str, Any]]:
+    """
+    モジュールのインポートを別プロセスで1回実行し、モジュールごとのインポート時間を返す
+    
+    Args:
+        module: インポートするモジュール
+        backend: 使用するバックエンド（"ollama" または "hf"）
+    
+    Returns:
+        モジュール名をキーとする {"self_us", "cumulative_us", "depth"} の辞書
+    """
+    env = dict(os.environ)
+    env["USE_OLLAMA"] = "true" if backend == "ollama" else "false"
+    # バイトコードのキャッシュを使わない設定では毎回のコンパイル時間が含まれてしまうため解除する
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=API_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{module} のインポートに失敗しました:\n{result.stderr[-2000:]}")
+    
+    modules: Dict[str, Dict[str, Any]] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            # ヘッダー行（self [us] | cumulative | imported package）
+            continue
+        name = fields[2].rstrip()
+        stripped = name.lstrip()
+        modules[stripped] = {
+            "self_us": int(fields[0]),
+            "cumulative_us": int(fields[1]),
+            "depth": (len(name) - len(stripped)) // 2,
+        }
+    
+    if module not in modules:
+        raise RuntimeError(f"{module} のインポート時間を取得できませんでした")
+    return modules
+
+def summarize(runs: List[Dict[str, Dict[str, Any]]], module: str, top: int) -> Dict[str, Any]:
+    """
+    複数回の計測結果を集計する（ばらつきを除くため、各モジュールの最小値を使う）
+    """
+    best = min(runs, key=lambda run: run[module]["cumulative_us"])
+    names = set().union(*runs)
+    
+    def minimum(name: str, key: str) -> int:
+        return min(run[name][key] for run in runs if name in run)
+    
+    by_cumulative = sorted(
+        (name for name in names if name != module),
+        key=lambda name: minimum(name, "cumulative_us"),
+        reverse=True,
+    )
+    by_self = sorted(names, key=lambda name: minimum(name, "self_us"), reverse=True)
+    
+    return {
+        "module": module,
+        "runs": len(runs),
+        "total_ms": round(best[module]["cumulative_us"] / 1000, 1),
+        "runs_ms": [round(run[module]["cumulative_us"] / 1000, 1) for run in runs],
+        "modules_loaded": len(best),
+        "top_cumulative": [
+            {"module": name, "cumulative_ms": round(minimum(name, "cumulative_us") / 1000, 1)}
+            for name in by_cumulative[:top]
+        ],
+        "top_self": [
+            {"module": name, "self_ms": round(minimum(name, "self_us") / 1000, 1)}
+            for name in by_self[:top]
+        ],
+        "loaded": sorted(names),
+    }
+
+def check(summary: Dict[str, Any], max_ms: Optional[float], forbidden: List[str]) -> List[str]:
+    """
+    上限時間と読み込まれてはいけないモジュールを確認し、違反の一覧を返す
+    """
+    violations = []
+    if max_ms is not None and summary["total_ms"] > max_ms:
+        violations.append(f"インポート時間 {summary['total_ms']}ms が上限 {max_ms}ms を超えています")
+    
+    loaded = set(summary["loaded"])
+    for name in forbidden:
+        if name in loaded:
+            violations.append(f"{name} が読み込まれています")
+    return violations
+
+def print_report(summary: Dict[str, Any], backend: str) -> None:
+    """
+    集計結果を表形式で表示する
+    """
+    print(f"{summary['module']} のインポート時間（backend={backend}, {summary['runs']}回中の最小）: {summary['total_ms']}ms")
+    print(f"各回: {', '.join(f'{ms}ms' for ms in summary['runs_ms'])}")
+    print(f"読み込まれたモジュール数: {summary['modules_loaded']}")
+    
+    print("\n累積時間の上位モジュール:")
+    for item in summary["top_cumulative"]:
+        print(f"  {item['cumulative_ms']:>9.1f}ms  {item['module']}")
+    
+    print("\n自身の時間の上位モジュール:")
+    for item in summary["top_self"]:
+        print(f"  {item['self_ms']:>9.1f}ms  {item['module']}")
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="app.main のコールドスタート時のインポート時間を計測する")
+    parser.add_argument("--module", default="app.main", help="計測するモジュール")
+    parser.add_argument("--backend", choices=["ollama", "hf"], default="ollama", help="USE_OLLAMA に設定するバックエンド")
+    parser.add_argument("--repeat", type=int, default=3, help="計測回数（最小値を使う）")
+    parser.add_argument("--top", type=int, default=15, help="表示する上位モジュール数")
+    parser.add_argument("--max-ms", type=float, default=None, help="インポート時間の上限（ミリ秒、超えた場合は終了コード1）")
+    parser.add_argument(
+        "--forbid",
+        nargs="*",
+        default=None,
+        help="読み込まれてはいけないモジュール（省略時、ollama では torch と transformers）",
+    )
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    args = parser.parse_args()
+    
+    forbidden = args.forbid if args.forbid is not None else (OLLAMA_FORBIDDEN_MODULES if args.backend == "ollama" else [])
+    
+    runs = [run_importtime(args.module, args.backend) for _ in range(max(1, args.repeat))]
+    summary = summarize(runs, args.module, args.top)
+    violations = check(summary, args.max_ms, forbidden)
+    
+    if args.json:
+        output = {key: value for key, value in summary.items() if key != "loaded"}
+        output["backend"] = args.backend
+        output["violations"] = violations
+        print(json.dumps(output, ensure_ascii=False, indent=2))
+    else:
+        print_report(summary, args.backend)
+        if violations:
+            print("\n問題:")
+            for violation in violations:
+                print(f"  - {violation}")
+    
+    return 1 if violations else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
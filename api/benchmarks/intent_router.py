@@ -0,0 +1,131 @@
+"""
+意図の分類器と統合ルーター（モデル呼び出し）の判定時間と一致率を比較するベンチマーク
+
+統合ルーターの判定ログ（INTENT_LOG_ENABLED=true で記録した data/intent_decisions.jsonl）を
+ルーターの正解として、分類器を学習データで学習（または学習済みの分類器を読み込み）し、評価データで
+確信度の閾値ごとに次の値を求める。
+
+- coverage: 分類器の判定をそのまま使う割合（閾値以上かつ、パラメータをメッセージから作れるラベル）
+- agreement: 最終的な判定（分類器またはルーター）がルーターの判定と一致する割合
+- latency_ms: 1件あたりの平均判定時間（分類器の時間 + ルーターに回した分のログ上のルーターの時間）
+
+使用例（api ディレクトリで実行）:
+    python benchmarks/intent_router.py
+    python benchmarks/intent_router.py --holdout 0.3 --thresholds 0.8 0.9 0.95
+    python benchmarks/intent_router.py --model data/intent_classifier.npz --json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Any
+
+# api ディレクトリ（app パッケージの親）をインポートパスに追加する
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+
+from app.models.intent_classifier import (  # noqa: E402
+    IntentClassifier,
+    INTENT_LOG_PATH,
+    load_decisions,
+    split_holdout,
+)
+from app.models.intent_router import LOCAL_LABELS  # noqa: E402
+
+DEFAULT_THRESHOLDS = [0.5, 0.7, 0.8, 0.9, 0.95, 0.99]
+
+def benchmark(
+    classifier: IntentClassifier,
+    texts: List[str],
+    labels: List[str],
+    router_seconds: List[float],
+    thresholds: List[float],
+) -> Dict[str, Any]:
+    """
+    評価データで分類器の判定時間を計測し、閾値ごとのカバー率・一致率・平均判定時間を求める
+    """
+    start = time.perf_counter()
+    predictions = [classifier.predict(text) for text in texts]
+    classifier_seconds = (time.perf_counter() - start) / len(texts)
+    router_mean = sum(router_seconds) / len(router_seconds)
+    
+    rows = []
+    for threshold in thresholds:
+        local = agree = 0
+        latency = 0.0
+        for (label, confidence), expected, seconds in zip(predictions, labels, router_seconds):
+            latency += classifier_seconds
+            if confidence >= threshold and label in LOCAL_LABELS:
+                local += 1
+                agree += label == expected
+            else:
+                # ルーターに回した分はルーターの判定をそのまま使う
+                agree += 1
+                latency += seconds
+        rows.append({
+            "threshold": threshold,
+            "coverage": round(local / len(texts), 4),
+            "agreement": round(agree / len(texts), 4),
+            "latency_ms": round(latency / len(texts) * 1000, 2),
+        })
+    
+    return {
+        "count": len(texts),
+        "labels": classifier.labels,
+        "classifier_microseconds": round(classifier_seconds * 1e6, 1),
+        "classifier_top1_agreement": round(
+            sum(label == expected for (label, _), expected in zip(predictions, labels)) / len(texts), 4
+        ),
+        "router_latency_ms": round(router_mean * 1000, 2),
+        "thresholds": rows,
+    }
+
+def print_report(result: Dict[str, Any]) -> None:
+    """
+    結果を表形式で表示する
+    """
+    print(f"評価データ: {result['count']}件（ラベル: {', '.join(result['labels'])}）")
+    print(f"分類器の判定時間: {result['classifier_microseconds']}µs/件、ラベルの一致率（閾値なし）: {result['classifier_top1_agreement']:.2%}")
+    print(f"ルーターのみの場合の平均判定時間: {result['router_latency_ms']}ms/件")
+    print(f"\n{'閾値':>6}  {'カバー率':>8}  {'一致率':>8}  {'平均判定時間':>12}")
+    for row in result["thresholds"]:
+        print(f"{row['threshold']:>6.2f}  {row['coverage']:>8.2%}  {row['agreement']:>8.2%}  {row['latency_ms']:>10.2f}ms")
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="意図の分類器と統合ルーターの判定時間と一致率を比較する")
+    parser.add_argument("--data", default=INTENT_LOG_PATH, help="統合ルーターの判定ログ（JSONL）のパス")
+    parser.add_argument("--model", default=None, help="学習済みの分類器のパス（省略時は判定ログの学習データで学習する）")
+    parser.add_argument("--holdout", type=float, default=0.2, help="評価用に取り分けるデータの割合（--model 指定時はすべて評価に使う）")
+    parser.add_argument("--thresholds", type=float, nargs="*", default=DEFAULT_THRESHOLDS, help="比較する確信度の閾値")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    args = parser.parse_args()
+    
+    texts, labels, seconds = load_decisions(args.data)
+    if args.model:
+        classifier = IntentClassifier.load(args.model)
+        test_indices = list(range(len(texts)))
+    else:
+        train_indices, test_indices = split_holdout(len(texts), args.holdout)
+        classifier = IntentClassifier.train([texts[i] for i in train_indices], [labels[i] for i in train_indices])
+    
+    if not len(test_indices):
+        print("評価データがありません", file=sys.stderr)
+        return 1
+    
+    result = benchmark(
+        classifier,
+        [texts[i] for i in test_indices],
+        [labels[i] for i in test_indices],
+        [seconds[i] for i in test_indices],
+        args.thresholds,
+    )
+    
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print_report(result)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
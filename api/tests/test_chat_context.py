@@ -0,0 +1,125 @@
+import pytest
+
+from app.core.config import settings
+from app.core.tokenizer import MESSAGE_OVERHEAD_TOKENS, TRUNCATION_MARKER, TokenCounter, get_token_counter
+from app.models.chat_model import MIN_LATEST_MESSAGE_TOKENS, ChatModel, Message
+
+
+@pytest.fixture(autouse=True)
+def approximate_tokens(monkeypatch):
+    """トークナイザーを読み込まず、概算（日本語は1文字1トークン）で数える"""
+    monkeypatch.setattr(settings, "TOKENIZER_ID", "")
+    monkeypatch.setattr(TokenCounter, "_instance", None)
+
+
+def make_chat_model(max_context_tokens):
+    """バックエンドとデータベースを使わない ChatModel を作成する"""
+    chat_model = ChatModel.__new__(ChatModel)
+    chat_model.memory_enabled = False
+    chat_model.max_context_messages = 20
+    chat_model.max_context_tokens = max_context_tokens
+    return chat_model
+
+
+def total_tokens(system_message, conversation):
+    counter = get_token_counter()
+    return counter.count(system_message) + MESSAGE_OVERHEAD_TOKENS + counter.count_messages(conversation)
+
+
+def test_assemble_conversation_keeps_messages_within_budget():
+    chat_model = make_chat_model(100)
+    messages = [Message("user", "あ" * 30), Message("assistant", "い" * 30), Message("user", "う" * 10)]
+    
+    _, conversation = chat_model._assemble_conversation(messages, None, "システム", max_tokens=20)
+    
+    assert [msg["content"][0] for msg in conversation] == ["い", "う"]
+    assert total_tokens("システム", conversation) + 20 <= 100
+
+
+def test_assemble_conversation_truncates_oversized_latest_message():
+    chat_model = make_chat_model(1000)
+    pasted = "先頭" + "あ" * 5000 + "質問です"
+    
+    _, conversation = chat_model._assemble_conversation([Message("user", pasted)], None, "システム", max_tokens=50)
+    
+    content = conversation[-1]["content"]
+    assert len(conversation) == 1
+    assert content.startswith("先頭")
+    assert content.endswith("質問です")
+    assert TRUNCATION_MARKER in content
+    assert total_tokens("システム", conversation) + 50 <= 1000
+
+
+def test_assemble_conversation_reserves_default_output_tokens(monkeypatch):
+    monkeypatch.setattr(settings, "MAX_NEW_TOKENS", 60)
+    chat_model = make_chat_model(1000)
+    
+    _, conversation = chat_model._assemble_conversation([Message("user", "あ" * 3000)], None, "システム")
+    
+    assert total_tokens("システム", conversation) + 60 <= 1000
+
+
+def test_assemble_conversation_caps_output_reservation():
+    chat_model = make_chat_model(1000)
+    
+    _, conversation = chat_model._assemble_conversation([Message("user", "あ" * 480)], None, "システム", max_tokens=100000)
+    
+    assert conversation[-1]["content"] == "あ" * 480
+
+
+def test_format_prompt_counts_system_suffix():
+    chat_model = make_chat_model(1000)
+    memory_text = "記" * 100 + "\n\n"
+    
+    prompt = chat_model.format_prompt([Message("user", "あ" * 3000)], None, memory_text, max_tokens=20)
+    
+    assert prompt.startswith(f"あなたは役立つAIアシスタントです。以下の会話を元に最新の質問に回答してください。\n\n{memory_text}ユーザー: ")
+    assert get_token_counter().count(prompt) + 20 <= 1000 + MESSAGE_OVERHEAD_TOKENS
+
+
+def test_truncate_keeps_short_text():
+    assert get_token_counter().truncate("こんにちは", 10) == "こんにちは"
+
+
+def test_assemble_conversation_shrinks_output_reserve_for_latest_message():
+    chat_model = make_chat_model(1000)
+    system_message = "シ" * 600
+    
+    _, conversation = chat_model._assemble_conversation([Message("user", "あ" * 500)], None, system_message, max_tokens=400)
+    
+    content = conversation[-1]["content"]
+    assert get_token_counter().count(content) >= MIN_LATEST_MESSAGE_TOKENS
+    assert total_tokens(system_message, conversation) <= 1000
+
+
+def test_assemble_conversation_truncates_oversized_system_message():
+    chat_model = make_chat_model(1000)
+    system_message = "検索結果" + "シ" * 5000 + "ユーザーへの回答:"
+    
+    system_message, conversation = chat_model._assemble_conversation(
+        [Message("user", "東京の天気は？")], None, system_message, max_tokens=200
+    )
+    
+    assert conversation == [{"role": "user", "content": "東京の天気は？"}]
+    assert system_message.startswith("検索結果")
+    assert system_message.endswith("ユーザーへの回答:")
+    assert total_tokens(system_message, conversation) <= 1000
+
+
+def test_build_messages_never_sends_empty_latest_message():
+    chat_model = make_chat_model(600)
+    
+    chat_messages = chat_model.build_messages(
+        [Message("system", "シ" * 3000), Message("user", "あ" * 2000)], max_tokens=300
+    )
+    
+    assert chat_messages[0]["role"] == "system"
+    assert get_token_counter().count(chat_messages[-1]["content"]) >= MIN_LATEST_MESSAGE_TOKENS
+    assert get_token_counter().count_messages(chat_messages) <= 600
+
+
+def test_assemble_conversation_rejects_too_small_context():
+    chat_model = make_chat_model(100)
+    
+    with pytest.raises(RuntimeError):
+        chat_model._assemble_conversation([Message("user", "あ" * 500)], None, "システム")
@@ -0,0 +1,83 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import app.routers.chat as chat
+from app.core.response_cache import CachedResponse
+
+
+class Recorder:
+    """呼び出されたメソッドを記録する偽のオブジェクト（ChatModel・モデル・意図の判定の代わり）"""
+    
+    def __init__(self):
+        self.calls = []
+    
+    def __getattr__(self, name):
+        def method(*args, **kwargs):
+            self.calls.append(name)
+            raise AssertionError(f"{name} が呼ばれました")
+        return method
+
+
+class FakeSemanticCache:
+    enabled = True
+    
+    def __init__(self, hit):
+        self.hit = hit
+        self.embedded = []
+    
+    async def embed(self, text):
+        self.embedded.append(text)
+        return [1.0]
+    
+    def lookup(self, vector):
+        return self.hit
+
+
+def make_client(monkeypatch, hit):
+    chat_model, model, assistant = Recorder(), Recorder(), Recorder()
+    routed = []
+    semantic_cache = FakeSemanticCache(hit)
+    
+    def get_message_intents(message):
+        routed.append(message)
+        return Recorder()
+    
+    monkeypatch.setattr(chat, "get_chat_model", lambda: chat_model)
+    monkeypatch.setattr(chat, "get_model", lambda: model)
+    monkeypatch.setattr(chat, "get_smart_assistant", lambda: assistant)
+    monkeypatch.setattr(chat, "get_message_intents", get_message_intents)
+    monkeypatch.setattr(chat, "get_semantic_cache", lambda: semantic_cache)
+    # メモリ機能とユーザー定義記憶を無効にする（セッションを作らず、単独の質問として扱う）
+    monkeypatch.setattr(chat, "get_memory_setting", lambda key: "false")
+    
+    app = FastAPI()
+    app.include_router(chat.router)
+    return TestClient(app), [chat_model, model, assistant], routed, semantic_cache
+
+
+def test_semantic_cache_hit_skips_intent_detection_and_generation(monkeypatch):
+    hit = CachedResponse(["東京は", "晴れです"], {"prompt_tokens": 3, "completion_tokens": 2}, None)
+    client, fakes, routed, semantic_cache = make_client(monkeypatch, hit)
+    
+    response = client.post("/chat/completions", json={"messages": [{"role": "user", "content": "東京の天気は？"}]})
+    
+    assert response.status_code == 200
+    assert response.headers["X-Semantic-Cache"] == "hit"
+    assert response.json()["message"]["content"] == "東京は晴れです"
+    assert semantic_cache.embedded == ["東京の天気は？"]
+    assert routed == []
+    assert all(fake.calls == [] for fake in fakes)
+
+
+def test_semantic_cache_hit_streams_without_model_calls(monkeypatch):
+    hit = CachedResponse(["東京は", "晴れです"], {}, None)
+    client, fakes, routed, _ = make_client(monkeypatch, hit)
+    
+    response = client.post(
+        "/chat/completions",
+        json={"messages": [{"role": "user", "content": "東京の天気は？"}], "stream": True},
+    )
+    
+    assert response.text == "data: 東京は\n\ndata: 晴れです\n\ndata: [DONE]\n\n"
+    assert routed == []
+    assert all(fake.calls == [] for fake in fakes)
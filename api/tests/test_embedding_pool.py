@@ -0,0 +1,98 @@
+import threading
+
+import numpy as np
+import pytest
+import torch
+
+from app.core.config import settings
+from app.models.gemma_model import GemmaModel
+from app.models.generation_pool import GenerationWorkerPool, ModelBusyError
+
+
+class FakeEncoding(dict):
+    def to(self, device):
+        return self
+
+
+class FakeTokenizer:
+    """1文字を1トークンとして右パディングする"""
+    
+    def __call__(self, texts, return_tensors=None, padding=False):
+        ids = [[ord(c) for c in text] for text in texts]
+        if return_tensors is None:
+            return {"input_ids": ids}
+        width = max(len(row) for row in ids)
+        return FakeEncoding(
+            input_ids=torch.tensor([row + [0] * (width - len(row)) for row in ids]),
+            attention_mask=torch.tensor([[1] * len(row) + [0] * (width - len(row)) for row in ids]),
+        )
+
+
+class FakeDecoder:
+    """トークンIDを1次元の隠れ状態として返し、呼び出し時に使用中の実行枠の数を記録する"""
+    
+    def __init__(self, pool):
+        self.pool = pool
+        self.running_slots = []
+    
+    def __call__(self, input_ids, attention_mask, use_cache):
+        self.running_slots.append(self.pool.get_stats()["running"])
+        
+        class Output:
+            last_hidden_state = input_ids.unsqueeze(-1).float()
+        return Output()
+
+
+class FakeModel:
+    device = "cpu"
+    
+    def __init__(self, decoder):
+        self.decoder = decoder
+    
+    def get_decoder(self):
+        return self.decoder
+
+
+def make_gemma_model(pool):
+    model = GemmaModel.__new__(GemmaModel)
+    model.tokenizer = FakeTokenizer()
+    model.pool = pool
+    model.model = FakeModel(FakeDecoder(pool))
+    return model
+
+
+@pytest.fixture(autouse=True)
+def embedding_settings(monkeypatch):
+    monkeypatch.setattr(settings, "HF_EMBEDDING_BATCH_SIZE", 2)
+    monkeypatch.setattr(settings, "HF_EMBEDDING_POOLING", "mean")
+
+
+def test_each_embedding_batch_runs_in_a_pool_slot():
+    pool = GenerationWorkerPool(workers=1, max_queue=0, queue_timeout=1.0, retry_after=1)
+    model = make_gemma_model(pool)
+    
+    vectors = model._compute_embeddings(["a", "bb", "ccc"])
+    
+    assert vectors.shape == (3, 1)
+    assert np.allclose(vectors, 1.0)
+    assert model.model.decoder.running_slots == [1, 1]
+    stats = pool.get_stats()
+    assert (stats["admitted"], stats["running"]) == (2, 0)
+
+
+def test_embedding_waits_for_a_free_slot_and_rejects_when_queue_is_full():
+    pool = GenerationWorkerPool(workers=1, max_queue=0, queue_timeout=1.0, retry_after=1)
+    model = make_gemma_model(pool)
+    
+    # 生成が実行枠を使っている間は、待機キューがなければ埋め込みも受け付けない
+    pool.acquire()
+    with pytest.raises(ModelBusyError):
+        model._compute_embeddings(["a"])
+    assert model.model.decoder.running_slots == []
+    
+    # 実行枠が空けば計算する
+    pool.max_queue = 1
+    timer = threading.Timer(0.05, pool.release)
+    timer.start()
+    assert model._compute_embeddings(["a"]).shape == (1, 1)
+    timer.join()
@@ -0,0 +1,199 @@
+import asyncio
+import time
+
+import pytest
+
+from app.core.config import settings
+from app.core.tokenizer import TokenCounter
+from app.models.chat_model import ChatModel, Message
+from app.models.hedging import HedgedModel, HedgePolicy
+
+
+class FakeAttempt:
+    """
+    最初のチャンクまで delay 秒待ってからチャンクを返す試行（error を指定すると最初のチャンクの前に失敗する）
+    """
+    
+    def __init__(self, chunks, delay=0.0, error=None, usage=None):
+        self.chunks = chunks
+        self.delay = delay
+        self.error = error
+        self.usage = usage or {}
+        self.started = False
+        self.closed = False
+        self.yielded = 0
+    
+    def __call__(self, usage):
+        self.started = True
+        return self._stream(usage)
+    
+    async def _stream(self, usage):
+        try:
+            await asyncio.sleep(self.delay)
+            if self.error is not None:
+                raise self.error
+            for chunk in self.chunks:
+                self.yielded += 1
+                yield chunk
+            usage.update(self.usage)
+        finally:
+            self.closed = True
+
+
+def collect(policy, primary, secondary, usage=None):
+    return asyncio.run(policy.collect(primary, secondary, usage))
+
+
+def test_fast_primary_does_not_hedge():
+    policy = HedgePolicy("test", delay=0.5)
+    primary = FakeAttempt(["a", "b"], usage={"completion_tokens": 2})
+    secondary = FakeAttempt(["x"])
+    usage = {}
+    
+    assert collect(policy, primary, secondary, usage) == "ab"
+    assert not secondary.started
+    assert usage == {"completion_tokens": 2}
+    assert policy.get_stats()["primary_wins"] == 1
+    assert policy.get_stats()["hedged"] == 0
+
+
+def test_slow_primary_loses_to_secondary_and_is_closed():
+    policy = HedgePolicy("test", delay=0.01)
+    primary = FakeAttempt(["slow"], delay=1.0, usage={"completion_tokens": 1})
+    secondary = FakeAttempt(["fa", "st"], usage={"completion_tokens": 2})
+    usage = {}
+    
+    assert collect(policy, primary, secondary, usage) == "fast"
+    assert primary.closed
+    assert primary.yielded == 0
+    assert usage == {"completion_tokens": 2}
+    stats = policy.get_stats()
+    assert (stats["hedged"], stats["secondary_wins"], stats["failures"]) == (1, 1, 0)
+
+
+def test_hedged_primary_can_still_win():
+    policy = HedgePolicy("test", delay=0.01)
+    primary = FakeAttempt(["p"], delay=0.05)
+    secondary = FakeAttempt(["s"], delay=1.0)
+    
+    assert collect(policy, primary, secondary) == "p"
+    assert secondary.started
+    assert secondary.closed
+    assert policy.get_stats()["primary_wins"] == 1
+
+
+def test_primary_error_fails_over_to_secondary():
+    policy = HedgePolicy("test", delay=0.5)
+    primary = FakeAttempt([], error=RuntimeError("down"))
+    secondary = FakeAttempt(["ok"])
+    
+    assert collect(policy, primary, secondary) == "ok"
+    stats = policy.get_stats()
+    assert (stats["failovers"], stats["hedged"], stats["secondary_wins"]) == (1, 0, 1)
+
+
+def test_all_attempts_failing_raises_primary_error_and_closes_streams():
+    policy = HedgePolicy("test", delay=0.5)
+    primary = FakeAttempt([], error=RuntimeError("primary"))
+    secondary = FakeAttempt([], error=RuntimeError("secondary"))
+    
+    with pytest.raises(RuntimeError, match="primary"):
+        collect(policy, primary, secondary)
+    assert primary.closed and secondary.closed
+    assert policy.get_stats()["failures"] == 1
+
+
+def test_without_secondary_primary_error_is_raised():
+    policy = HedgePolicy("test", delay=0.0)
+    
+    with pytest.raises(RuntimeError, match="down"):
+        collect(policy, FakeAttempt([], error=RuntimeError("down")), None)
+
+
+def test_closing_consumer_early_closes_winner():
+    policy = HedgePolicy("test", delay=0.5)
+    primary = FakeAttempt(["a", "b", "c"])
+    
+    async def read_first():
+        stream = policy.stream(primary, None)
+        first = await stream.__anext__()
+        await stream.aclose()
+        return first
+    
+    assert asyncio.run(read_first()) == "a"
+    assert primary.closed
+    assert primary.yielded == 1
+
+
+
+class FakeSyncModel:
+    """
+    同期の generate_text, generate_chat を持ち、最初のチャンクまで delay 秒待つモデル
+    """
+    
+    def __init__(self, chunks, delay=0.0):
+        self.chunks = chunks
+        self.delay = delay
+        self.calls = []
+        self.closed = False
+    
+    def generate_text(self, prompt, stream=False, **kwargs):
+        self.calls.append(("generate_text", prompt, stream))
+        return self._stream() if stream else "".join(self.chunks)
+    
+    def generate_chat(self, messages, stream=False, **kwargs):
+        self.calls.append(("generate_chat", messages, stream))
+        return self._stream() if stream else "".join(self.chunks)
+    
+    def _stream(self):
+        try:
+            time.sleep(self.delay)
+            yield from self.chunks
+        finally:
+            self.closed = True
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_hedged_model_hedges_sync_generate_text():
+    primary = FakeSyncModel(["slow"], delay=0.3)
+    secondary = FakeSyncModel(["fa", "st"])
+    model = HedgedModel(primary, lambda: secondary, HedgePolicy("test", delay=0.01))
+    
+    assert model.generate_text(prompt="質問") == "fast"
+    assert secondary.calls == [("generate_text", "質問", True)]
+    assert wait_until(lambda: primary.closed)
+    assert model.get_hedge_stats()["secondary_wins"] == 1
+
+
+def test_hedged_model_streams_sync_generate_chat():
+    primary = FakeSyncModel(["a", "b"])
+    secondary = FakeSyncModel(["x"])
+    model = HedgedModel(primary, lambda: secondary, HedgePolicy("test", delay=0.5))
+    
+    assert list(model.generate_chat(messages=[{"role": "user", "content": "こんにちは"}], stream=True)) == ["a", "b"]
+    assert secondary.calls == []
+    assert model.get_hedge_stats()["primary_wins"] == 1
+
+
+def test_generate_response_goes_through_hedged_path(monkeypatch):
+    monkeypatch.setattr(settings, "TOKENIZER_ID", "")
+    monkeypatch.setattr(TokenCounter, "_instance", None)
+    monkeypatch.setattr(settings, "USE_CHAT_API", True)
+    primary = FakeSyncModel(["slow"], delay=0.3)
+    secondary = FakeSyncModel(["hedged"])
+    
+    chat_model = ChatModel.__new__(ChatModel)
+    chat_model.memory_enabled = False
+    chat_model.max_context_messages = 20
+    chat_model.max_context_tokens = 4096
+    chat_model.model = HedgedModel(primary, lambda: secondary, HedgePolicy("test", delay=0.01))
+    
+    assert chat_model.generate_response([Message("user", "こんにちは")]) == "hedged"
+    assert secondary.calls[0][0] == "generate_chat"
+    assert chat_model.model.get_hedge_stats()["hedged"] == 1
@@ -0,0 +1,139 @@
+import pytest
+
+from app.core.config import settings
+from app.core.intent_cache import FailedDetection, IntentCache, detection_succeeded, get_intent_cache, memoize_intent, normalize_message
+from app.models.files_assistant import FilesAssistant
+from app.models.intent_router import IntentDecision
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    """設定を固定した新しい IntentCache を使う"""
+    monkeypatch.setattr(settings, "INTENT_CACHE_ENABLED", True)
+    monkeypatch.setattr(settings, "INTENT_CACHE_MAX_ITEMS", 2)
+    monkeypatch.setattr(settings, "INTENT_CACHE_TTL_SECONDS", 3600)
+    monkeypatch.setattr(IntentCache, "_instance", None)
+    return get_intent_cache()
+
+
+class Detector:
+    def __init__(self, result=None):
+        self.calls = 0
+        self.result = result
+    
+    @memoize_intent("test")
+    def detect(self, user_message):
+        self.calls += 1
+        return self.result if self.result is not None else (True, "read_file", {"path": user_message})
+    
+    @memoize_intent("router", cacheable=lambda decision: not decision.parse_failed)
+    def route(self, user_message):
+        self.calls += 1
+        return self.result
+
+
+@pytest.mark.parametrize("a, b", [
+    ("ファイル一覧を表示して", "ファイル一覧を表示して。"),
+    ("ファイル一覧を 表示して", "  ファイル一覧を  表示して！ "),
+    ("ＬＩＳＴ　Ｆｉｌｅｓ？", "list files"),
+    ("記憶一覧…", "記憶一覧"),
+])
+def test_normalize_message_folds_sentence_punctuation_width_and_case(a, b):
+    assert normalize_message(a) == normalize_message(b)
+
+
+@pytest.mark.parametrize("a, b", [
+    ("foo_bar.txtを削除して", "foo-bar.txtを削除して"),
+    ("foo_bar.txtを削除して", "foo/bar.txtを削除して"),
+    ("foo.txtを読んで", "footxtを読んで"),
+    ("owner/repoのREADME", "owner:repoのREADME"),
+])
+def test_normalize_message_keeps_path_characters(a, b):
+    assert normalize_message(a) != normalize_message(b)
+
+
+def test_memoize_intent_returns_cached_copy(cache):
+    detector = Detector()
+    first = detector.detect("a.txtを読んで")
+    first[2]["path"] = "changed"
+    second = detector.detect("a.txtを読んで。")
+    
+    assert detector.calls == 1
+    assert second == (True, "read_file", {"path": "a.txtを読んで"})
+    assert cache.get_stats()["detectors"]["test"] == {"hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+def test_memoize_intent_does_not_share_parameters_between_paths(cache):
+    detector = Detector()
+    assert detector.detect("foo_bar.txtを削除して")[2]["path"] == "foo_bar.txtを削除して"
+    assert detector.detect("foo-bar.txtを削除して")[2]["path"] == "foo-bar.txtを削除して"
+    assert detector.calls == 2
+
+
+def test_memoize_intent_skips_uncacheable_results(cache):
+    detector = Detector(IntentDecision(parse_failed=True))
+    detector.route("こんにちは")
+    detector.route("こんにちは")
+    assert detector.calls == 2
+    
+    detector.result = IntentDecision()
+    detector.route("こんにちは")
+    detector.route("こんにちは")
+    assert detector.calls == 3
+
+
+
+class FakeChatModel:
+    def __init__(self, response):
+        self.calls = 0
+        self.response = response
+    
+    def generate_response(self, messages, **kwargs):
+        self.calls += 1
+        return self.response
+
+
+def make_files_assistant(response):
+    assistant = FilesAssistant.__new__(FilesAssistant)
+    assistant.api_base_url = "http://localhost:8000"
+    assistant.chat_model = FakeChatModel(response)
+    return assistant
+
+
+def test_failed_detection_unpacks_like_result():
+    failed = FailedDetection((False, "", {}))
+    is_operation, operation_type, parameters = failed
+    assert failed == (False, "", {})
+    assert not detection_succeeded(failed)
+    assert detection_succeeded((False, "", {}))
+
+
+def test_failed_legacy_detection_is_not_memoized(cache):
+    assistant = make_files_assistant("JSONではない応答")
+    assert assistant.detect_file_operation("ファイル一覧を表示して") == (False, "", {})
+    assert assistant.detect_file_operation("ファイル一覧を表示して") == (False, "", {})
+    assert assistant.chat_model.calls == 2
+    
+    # 「意図なし」と判定できた結果はキャッシュする
+    assistant.chat_model.response = '{"is_file_operation": false, "operation_type": "", "parameters": {}}'
+    assert assistant.detect_file_operation("ファイル一覧を表示して") == (False, "", {})
+    assert assistant.detect_file_operation("ファイル一覧を表示して") == (False, "", {})
+    assert assistant.chat_model.calls == 3
+
+def test_intent_cache_evicts_least_recently_used(cache):
+    cache.put("test", "a", 1)
+    cache.put("test", "b", 2)
+    assert cache.get("test", "a") == (True, 1)
+    cache.put("test", "c", 3)
+    
+    assert cache.get("test", "b") == (False, None)
+    assert cache.get("test", "a") == (True, 1)
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_intent_cache_disabled_calls_detector(cache, monkeypatch):
+    monkeypatch.setattr(cache, "enabled", False)
+    detector = Detector()
+    detector.detect("x")
+    detector.detect("x")
+    assert detector.calls == 2
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from app.models.speculation import ChatSpeculator
+
+
+class FakeStream:
+    """チャンクを返し、閉じられたかどうかを記録するストリーム"""
+    
+    def __init__(self, chunks, delay=0.0, error=None):
+        self.chunks = chunks
+        self.delay = delay
+        self.error = error
+        self.closed = False
+        self.stream = self._stream()
+    
+    async def _stream(self):
+        try:
+            for chunk in self.chunks:
+                await asyncio.sleep(self.delay)
+                yield chunk
+            if self.error is not None:
+                raise self.error
+        finally:
+            self.closed = True
+
+
+@pytest.fixture
+def speculator(monkeypatch):
+    monkeypatch.setattr(ChatSpeculator, "_instance", None)
+    return ChatSpeculator()
+
+
+def test_adopt_returns_buffered_and_remaining_chunks(speculator):
+    fake = FakeStream(["a", "b", "c"], delay=0.01)
+    
+    async def run():
+        speculation = speculator.start(fake.stream, {})
+        await asyncio.sleep(0.015)
+        return [chunk async for chunk in speculation.adopt()]
+    
+    assert asyncio.run(run()) == ["a", "b", "c"]
+    assert fake.closed
+    stats = speculator.get_stats()
+    assert (stats["started"], stats["adopted"], stats["cancelled"]) == (1, 1, 0)
+
+
+def test_cancel_stops_stream_and_records_waste(speculator):
+    fake = FakeStream(["a", "b", "c"], delay=0.01)
+    
+    async def run():
+        speculation = speculator.start(fake.stream, {})
+        await asyncio.sleep(0.015)
+        await speculation.cancel()
+        # 2回目の取り消しは何もしない
+        await speculation.cancel()
+    
+    asyncio.run(run())
+    assert fake.closed
+    stats = speculator.get_stats()
+    assert (stats["cancelled"], stats["wasted_rate"]) == (1, 1.0)
+    assert 1 <= stats["wasted_chunks"] < 3
+
+
+def test_cancel_after_adopt_is_ignored(speculator):
+    fake = FakeStream(["a"])
+    
+    async def run():
+        speculation = speculator.start(fake.stream, {})
+        chunks = [chunk async for chunk in speculation.adopt()]
+        await speculation.cancel()
+        return chunks
+    
+    assert asyncio.run(run()) == ["a"]
+    assert speculator.get_stats()["cancelled"] == 0
+
+
+def test_adopt_raises_stream_error(speculator):
+    fake = FakeStream(["a"], error=RuntimeError("busy"))
+    
+    async def run():
+        speculation = speculator.start(fake.stream, {})
+        received = []
+        with pytest.raises(RuntimeError, match="busy"):
+            async for chunk in speculation.adopt():
+                received.append(chunk)
+        return received
+    
+    assert asyncio.run(run()) == ["a"]
@@ -0,0 +1,56 @@
+import pytest
+
+from app.models.stop_sequences import StopSequenceFilter, merge_stop_sequences, truncate_at_stop
+
+
+def run_filter(stop, chunks):
+    """チャンクを順に渡し、出力された部分のリストを返す"""
+    stop_filter = StopSequenceFilter(stop)
+    outputs = [stop_filter.feed(chunk) for chunk in chunks]
+    outputs.append(stop_filter.flush())
+    return outputs, stop_filter.stopped
+
+
+def test_merge_stop_sequences_keeps_order_and_drops_duplicates():
+    assert merge_stop_sequences(["\nユーザー:", ""], None, ["END", "\nユーザー:"]) == ["\nユーザー:", "END"]
+
+
+def test_truncate_at_stop_uses_earliest_match():
+    assert truncate_at_stop("abcENDdefSTOP", ["STOP", "END"]) == ("abc", True)
+    assert truncate_at_stop("abc", ["STOP"]) == ("abc", False)
+
+
+@pytest.mark.parametrize("chunks", [
+    ["こんにちは\nユーザー: 次の質問"],
+    ["こんにちは\n", "ユーザ", "ー: 次の質問"],
+    ["こんにちは", "\n", "ユ", "ー", "ザ", "ー", ":", " 次"],
+])
+def test_filter_stops_across_chunk_boundaries(chunks):
+    outputs, stopped = run_filter(["\nユーザー:"], chunks)
+    
+    assert "".join(outputs) == "こんにちは"
+    assert stopped
+
+
+def test_filter_holds_partial_match_until_it_diverges():
+    stop_filter = StopSequenceFilter(["\nユーザー:"])
+    
+    assert stop_filter.feed("行1\nユー") == "行1"
+    assert stop_filter.feed("モア") == "\nユーモア"
+    assert not stop_filter.stopped
+
+
+def test_filter_flushes_held_text_at_end():
+    outputs, stopped = run_filter(["END"], ["abcE", "N"])
+    
+    assert "".join(outputs) == "abcEN"
+    assert outputs[-1] == "EN"
+    assert not stopped
+
+
+def test_filter_drops_chunks_after_stop():
+    stop_filter = StopSequenceFilter(["END"])
+    
+    assert stop_filter.feed("aEND") == "a"
+    assert stop_filter.feed("more") == ""
+    assert stop_filter.flush() == ""